@@ -1,7 +1,10 @@
 import logging
 import asyncio
 import re
+import tempfile
+import time
 from pathlib import Path
+from typing import Optional
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application, 
@@ -14,10 +17,19 @@ from telegram.ext import (
 from telegram.constants import ParseMode
 from telegram.error import BadRequest
 
-from config import BOT_TOKEN, DOWNLOAD_DIR, COOKIES_FILE, MAX_FILE_SIZE, DEFAULT_TOP_HEADER, DEFAULT_BOTTOM_HEADER
-from youtube_downloader import YouTubeDownloader
-from video_processor_fast import FastVideoProcessor
-from user_settings import load_user_settings, update_user_settings, get_value
+from config import BOT_TOKEN, STORAGE_SINK, COOKIES_FILE, DEFAULT_TOP_HEADER, DEFAULT_BOTTOM_HEADER, BATCH_MAX_VIDEOS, BATCH_MAX_CONCURRENT_DOWNLOADS, JOB_QUEUE_MAX, JOB_QUEUE_MAX_PER_CHAT, JOB_BROKER, JOB_BROKER_POLL_INTERVAL, JOB_BROKER_WAIT_TIMEOUT, UPDATE_CONCURRENCY, PREVIEW_DEFAULT_TIMESTAMP
+from user_settings import load_user_settings, update_user_settings, get_value, settings_snapshot
+from job_scheduler import JobScheduler, QueueFull
+from job_store import RUNNING as JOB_RUNNING, DONE as JOB_DONE, FAILED as JOB_FAILED
+from chat_updates import ChatOrderedUpdateProcessor
+from executors import start_metrics_log
+from telegram_api import configure_builder
+from storage_sinks import available_sinks
+from pipeline import (
+    DEFAULT_TIMELINE, YOUTUBE_URL_PATTERN, DownloadError, downloader, processor, workspaces, job_store, job_flight,
+    extract_video_id, video_job_key, flight_key_str, links_only_key, progressive_delivery, collect_links, execute_job, estimate_job, format_eta, preview_source
+)
+from workspace import WorkspaceUnavailable
 
 USER_ASSETS_DIR = Path('user_assets')
 USER_ASSETS_DIR.mkdir(exist_ok=True)
@@ -50,23 +62,22 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Инициализация загрузчика и процессора
-downloader = YouTubeDownloader(DOWNLOAD_DIR, COOKIES_FILE)
-processor = FastVideoProcessor(DOWNLOAD_DIR / 'temp')
+# Очередь задач с ограниченным числом слотов и справедливостью между чатами
+job_scheduler = JobScheduler()
 
-# Регулярное выражение для YouTube URL
-YOUTUBE_URL_PATTERN = re.compile(
-    r'(https?://)?(www\.)?(youtube|youtu|youtube-nocookie)\.(com|be)/'
-    r'(watch\?v=|embed/|v/|.+\?v=)?([^&=%\?]{11})'
+# Регулярное выражение для ссылок на плейлист YouTube
+PLAYLIST_URL_PATTERN = re.compile(
+    r'(https?://)?(www\.|m\.)?youtube\.com/playlist\?(\S*&)?list=([\w-]+)'
 )
 
-# Состояние ожидаемых действий от пользователя
+# Состояние ожидаемых действий от пользователя.
+# Обновления одного чата обрабатываются по очереди (ChatOrderedUpdateProcessor), поэтому
+# запись по chat_id меняет только один обработчик за раз
 pending_actions = {}
 
 # Словарь для хранения пользовательских заголовков (устаревшее, оставлено для совместимости)
 user_headers = {}
 user_timelines = {}
-DEFAULT_TIMELINE = 30
 
 # ======= КНОПКИ НАСТРОЕК =======
 
@@ -82,6 +93,12 @@ def build_main_settings_kb(chat_id: int) -> InlineKeyboardMarkup:
         [InlineKeyboardButton(f'🎵 Фоновая музыка: {as_on_off("background_music.enabled")}', callback_data='CFG:BG_MUSIC')],
         [InlineKeyboardButton(f'🖼️ Баннер: {as_on_off("banner.enabled")}', callback_data='CFG:BANNER')],
         [InlineKeyboardButton('🍪 Cookies', callback_data='CFG:COOKIES')],
+        [InlineKeyboardButton(f'📬 Клипы по готовности: {"ON" if progressive_delivery(settings) else "OFF"}', callback_data='CFG:PROGRESSIVE')],
+        [InlineKeyboardButton('👁️ Предпросмотр', callback_data='CFG:PREVIEW')],
+    ]
+    if len(available_sinks()) > 1:
+        keyboard.append([InlineKeyboardButton(f'☁️ Хранилище: {get_value(settings, "storage.sink", STORAGE_SINK)}', callback_data='CFG:STORAGE')])
+    keyboard += [
         [InlineKeyboardButton('❌ Закрыть', callback_data='CFG:CLOSE')]
     ]
     return InlineKeyboardMarkup(keyboard)
@@ -155,7 +172,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         "1) Пришлите ссылку на YouTube\n"
         "2) Подождите — я всё сделаю автоматически\n\n"
         "⚙️ <b>Настройки</b>\n"
-        "• /settings — меню с кнопками\n\n"
+        "• /settings — меню с кнопками\n"
+        "• /preview — кадр и 5‑секундный ролик с текущим оформлением\n\n"
         "ℹ️ <b>Подсказки</b>\n"
         "• Длинные видео нарезаются на чанки\n"
         "• Если архив >50MB — пришлю ссылки Google Drive"
@@ -244,6 +262,76 @@ async def reset_headers_command(update: Update, context: ContextTypes.DEFAULT_TY
         parse_mode=ParseMode.HTML
     )
 
+def _parse_timestamp(value: str) -> Optional[float]:
+    """Время в видео: секунды, мм:сс или чч:мм:сс"""
+    try:
+        seconds = 0.0
+        for part in value.split(':'):
+            seconds = seconds * 60 + float(part)
+        return seconds if seconds >= 0 else None
+    except ValueError:
+        return None
+
+async def preview_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработчик команды /preview [ссылка] [время] - предпросмотр оформления"""
+    chat_id = update.effective_chat.id
+    url = None
+    timestamp = PREVIEW_DEFAULT_TIMESTAMP
+    for arg in context.args or []:
+        if is_youtube_url(arg):
+            url = arg
+            continue
+        parsed = _parse_timestamp(arg)
+        if parsed is None:
+            await update.message.reply_text(
+                "❌ <b>Неверный формат!</b>\n\n"
+                "Используйте: <code>/preview [ссылка] [время]</code>, например <code>/preview 1:30</code>",
+                parse_mode=ParseMode.HTML
+            )
+            return
+        timestamp = parsed
+    # Скачивание и рендер предпросмотра идут в фоне, не задерживая следующие сообщения чата
+    context.application.create_task(_send_preview(update.message, chat_id, url, timestamp))
+
+async def _send_preview(message, chat_id: int, url: Optional[str], timestamp: float) -> None:
+    """Отрисовать кадр и короткий ролик с текущими настройками чата (по ссылке или последнему видео)"""
+    url = url or job_store.last_url(chat_id)
+    if not url:
+        await message.reply_text("📎 Пришлите ссылку: <code>/preview ссылка [время]</code>", parse_mode=ParseMode.HTML)
+        return
+    status_message = await message.reply_text("👁️ Готовлю предпросмотр...")
+    settings = load_user_settings(chat_id)
+    top_header = get_value(settings, 'headers.top', DEFAULT_TOP_HEADER)
+    bottom_header = get_value(settings, 'headers.bottom', DEFAULT_BOTTOM_HEADER)
+    try:
+        with tempfile.TemporaryDirectory(dir=processor.temp_dir, prefix='preview_') as preview_dir:
+            source = await preview_source(url, chat_id, Path(preview_dir))
+            if not source:
+                await status_message.edit_text(
+                    "❌ Скачанного видео нет в кэше, а прочитать его напрямую не удалось.\n"
+                    "Для предпросмотра видео нужно скачать заново — отправьте ссылку на обработку."
+                )
+                return
+            frame_path, clip_path = await processor.render_preview(source, Path(preview_dir), timestamp, chat_id, top_header, bottom_header, settings)
+            if not frame_path and not clip_path:
+                await status_message.edit_text("❌ Не удалось отрисовать предпросмотр.")
+                return
+            if frame_path:
+                with open(frame_path, 'rb') as frame:
+                    await message.reply_photo(frame, caption=f"👁️ Кадр на {int(timestamp) // 60}:{int(timestamp) % 60:02d}")
+            if clip_path:
+                with open(clip_path, 'rb') as clip:
+                    await message.reply_video(clip, supports_streaming=True)
+    except Exception as e:
+        # Статусное сообщение не должно остаться висеть с «Готовлю предпросмотр...»
+        logger.error(f"Ошибка предпросмотра {url}: {e}")
+        try:
+            await status_message.edit_text("❌ Не удалось отрисовать предпросмотр.")
+        except BadRequest:
+            pass
+        return
+    await status_message.delete()
+
 async def timeline_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик команды /timeline - настройка длительности нарезки"""
     chat_id = update.effective_chat.id
@@ -307,6 +395,18 @@ def is_youtube_url(text: str) -> bool:
     """Проверить, является ли текст YouTube URL"""
     return bool(YOUTUBE_URL_PATTERN.search(text))
 
+def is_playlist_url(text: str) -> bool:
+    """Проверить, является ли текст ссылкой на плейлист YouTube"""
+    return bool(PLAYLIST_URL_PATTERN.search(text))
+
+def extract_youtube_urls(text: str) -> list:
+    """Достать все ссылки YouTube (видео и плейлисты) из сообщения, без повторов"""
+    urls = []
+    for token in text.split():
+        if (is_playlist_url(token) or is_youtube_url(token)) and token not in urls:
+            urls.append(token)
+    return urls
+
 # ======= CALLBACKS ДЛЯ КНОПОК =======
 
 async def settings_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -331,6 +431,32 @@ async def settings_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
         pending_actions.pop(chat_id, None)
         return
 
+    if data == 'CFG:PREVIEW':
+        context.application.create_task(_send_preview(query.message, chat_id, None, PREVIEW_DEFAULT_TIMESTAMP))
+        return
+
+    if data == 'CFG:PROGRESSIVE':
+        new_val = not progressive_delivery(load_user_settings(chat_id))
+        update_user_settings(chat_id, {"delivery": {"progressive": new_val}})
+        state = 'ON' if new_val else 'OFF'
+        try:
+            await query.edit_message_text(f"📬 Клипы по готовности: {state}", reply_markup=build_main_settings_kb(chat_id))
+        except BadRequest:
+            pass
+        return
+
+    if data == 'CFG:STORAGE':
+        # По кругу между хранилищами, настроенными в этом развёртывании
+        sinks = available_sinks()
+        current = get_value(load_user_settings(chat_id), 'storage.sink', STORAGE_SINK)
+        new_sink = sinks[(sinks.index(current) + 1) % len(sinks)] if current in sinks else sinks[0]
+        update_user_settings(chat_id, {"storage": {"sink": new_sink}})
+        try:
+            await query.edit_message_text(f"☁️ Клипы будут загружаться в: {new_sink}", reply_markup=build_main_settings_kb(chat_id))
+        except BadRequest:
+            pass
+        return
+
     if data == 'CFG:HEADERS':
         try:
             await query.edit_message_text("📝 Заголовки — выберите параметр. После выбора пришлю пример, затем отправьте своё значение.", reply_markup=build_headers_kb())
@@ -803,9 +929,14 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 # ======= ОСНОВНОЙ ФЛОУ ОБРАБОТКИ =======
 
-async def handle_youtube_url(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Обработчик YouTube ссылок - скачивает и обрабатывает видео"""
-    url = update.message.text.strip()
+def _queue_full_text(e: QueueFull) -> str:
+    if e.per_chat:
+        return f"⏳ У вас уже {JOB_QUEUE_MAX_PER_CHAT} задач в очереди. Дождитесь их завершения и отправьте ссылку снова."
+    return "⏳ Сейчас очередь заполнена. Попробуйте отправить ссылку через несколько минут."
+
+async def handle_youtube_url(update: Update, context: ContextTypes.DEFAULT_TYPE, url: Optional[str] = None) -> None:
+    """Обработчик YouTube ссылок - ставит видео в очередь на скачивание и обработку"""
+    url = url or update.message.text.strip()
     chat_id = update.effective_chat.id
     
     if not is_youtube_url(url):
@@ -817,144 +948,263 @@ async def handle_youtube_url(update: Update, context: ContextTypes.DEFAULT_TYPE)
     status_message = await update.message.reply_text(
         "🎬 Начинаю обработку видео..."
     )
-    
-    try:
-        await status_message.edit_text(
-            "📥 <b>Этап 1/5:</b> Скачивание видео...",
-            parse_mode=ParseMode.HTML
-        )
-        
-        file_path = await downloader.download_video(url, chat_id)
-        
-        if not file_path:
-            await status_message.edit_text(
-                "❌ Не удалось скачать видео. Возможно, видео недоступно или слишком большое."
-            )
-            return
-        
-        await status_message.edit_text(
-            "🎞️ <b>Этап 2/5:</b> Анализ и нарезка на чанки...",
-            parse_mode=ParseMode.HTML
-        )
-        
-        top_header, bottom_header = get_user_headers(chat_id)
-        timeline = get_user_timeline(chat_id)
-        
-        await status_message.edit_text(
-            "🎤 <b>Этап 3/5:</b> Создание вертикальных видео с субтитрами...",
-            parse_mode=ParseMode.HTML
+
+    settings = settings_snapshot(chat_id)
+    if JOB_BROKER == 'sqlite':
+        await _submit_to_broker(chat_id, url, settings, status_message)
+        return
+    flight_key = flight_key_str(url, settings, links_only=progressive_delivery(settings))
+    job_id = job_store.create_job(chat_id, url, settings, flight_key)
+    # Прогноз длительности может обращаться к YouTube — ставим в очередь в фоне
+    context.application.create_task(_enqueue_video_job(context.application, chat_id, url, settings, status_message, job_id, flight_key))
+
+async def _submit_to_broker(chat_id: int, url: str, settings: dict, status_message) -> None:
+    """Передать задачу процессам worker.py; они сами обновляют статус и отправляют результат"""
+    if job_store.count_active() >= JOB_QUEUE_MAX:
+        await status_message.edit_text(_queue_full_text(QueueFull("Очередь задач заполнена")))
+        return
+    if job_store.count_active(chat_id) >= JOB_QUEUE_MAX_PER_CHAT:
+        await status_message.edit_text(_queue_full_text(QueueFull("Слишком много задач от одного чата", per_chat=True)))
+        return
+    job_store.create_job(chat_id, url, settings, flight_key_str(url, settings, links_only=progressive_delivery(settings)), message_id=status_message.message_id)
+    await status_message.edit_text("⏳ Видео поставлено в очередь обработки...")
+
+async def _wait_broker_job(job_id: int, on_progress) -> dict:
+    """Дождаться завершения задачи в брокере, пересылая её прогресс.
+
+    Задача, не завершённая за JOB_BROKER_WAIT_TIMEOUT секунд с постановки, считается неудавшейся.
+    """
+    last_progress = None
+    while True:
+        job = job_store.get_job(job_id)
+        if job['status'] in (JOB_DONE, JOB_FAILED):
+            return job
+        if time.time() - job['created_at'] > JOB_BROKER_WAIT_TIMEOUT:
+            logger.warning(f"Задача {job_id} не выполнена за {JOB_BROKER_WAIT_TIMEOUT} с, пакет её больше не ждёт")
+            job_store.set_status(job_id, JOB_FAILED, "Истекло время ожидания обработчика")
+            return job_store.get_job(job_id)
+        if job['progress'] and job['progress'] != last_progress:
+            last_progress = job['progress']
+            await on_progress(last_progress)
+        await asyncio.sleep(JOB_BROKER_POLL_INTERVAL)
+
+async def _enqueue_video_job(application: Application, chat_id: int, url: str, settings: dict, status_message, job_id: int, flight_key: str) -> None:
+    """Поставить видео в очередь; результат будет отправлен в чат по завершении задачи.
+
+    `flight_key` — ключ задачи из базы задач: по нему находятся её контрольные точки.
+    """
+    async def show_progress(text: str) -> None:
+        try:
+            await status_message.edit_text(text, parse_mode=ParseMode.HTML)
+        except BadRequest:
+            pass
+
+    # Прогноз длительности нужен очереди, только если она упорядочивает задачи по нему
+    cost = await estimate_job(url, chat_id, settings) if job_scheduler.policy != 'fair' else None
+
+    async def show_position(position: int, eta: float) -> None:
+        text = (
+            f"⏳ <b>В очереди:</b> позиция {position}\n"
+            f"🕒 <b>Ожидаемый старт:</b> {format_eta(eta)}"
         )
+        if cost is not None:
+            text += f"\n⏱ <b>Обработка займёт:</b> {format_eta(cost)}"
+        await show_progress(text)
 
-        settings = load_user_settings(chat_id)
-        
-        archive_path = await processor.process_video(file_path, chat_id, top_header, bottom_header, segment_duration=timeline, settings=settings)
-        
-        if not archive_path:
-            await status_message.edit_text(
-                "❌ Не удалось обработать видео. Попробуйте другое видео."
-            )
-            downloader.cleanup_file(file_path)
-            return
+    async def job() -> None:
+        await execute_job(application.bot, job_id, chat_id, url, settings, status_message, flight_key=flight_key)
 
-        if archive_path.endswith('.txt'):
-            await status_message.edit_text(
-                "☁️ <b>Этап 4/5:</b> Загрузка на Google Drive...",
-                parse_mode=ParseMode.HTML
-            )
-            with open(archive_path, 'rb') as links_file:
-                await context.bot.send_document(
-                    chat_id=chat_id,
-                    document=links_file,
-                    filename=f"uploaded_links_{chat_id}.txt",
-                    caption="✅ Ссылки на все клипы загружены!"
-                )
-            processor.cleanup_temp_files(chat_id)
-            await status_message.edit_text(
-                "✅ <b>Этап 5/5:</b> Готово!",
-                parse_mode=ParseMode.HTML
-            )
-            await status_message.delete()
-        elif archive_path.endswith('.zip'):
-            await status_message.edit_text(
-                "📦 <b>Этап 4/5:</b> Финальная нарезка и архивация...",
-                parse_mode=ParseMode.HTML
-            )
+    if job_flight.in_flight(video_job_key(url, settings, links_only=links_only_key(flight_key))):
+        # Такая же задача уже выполняется — присоединяемся к ней без очереди
+        application.create_task(job())
+        return
+    try:
+        job_scheduler.submit(chat_id, job, on_position=show_position, cost=cost)
+    except QueueFull as e:
+        job_store.set_status(job_id, JOB_FAILED, str(e))
+        await status_message.edit_text(_queue_full_text(e))
 
-            await status_message.edit_text(
-                f"📤 <b>Этап 5/5:</b> Отправка архива...",
-                parse_mode=ParseMode.HTML
-            )
-            
-            file_size = processor.get_file_size(archive_path)
-            
-            if file_size > MAX_FILE_SIZE:
-                await context.bot.send_message(
-                    chat_id=chat_id,
-                    text=f"⚠️ Архив слишком большой ({file_size / (1024*1024):.1f} MB) для отправки в Telegram.\n\n" 
-                         f"Он сохранен в кеше проекта по пути: {archive_path}"
-                )
-            else:
-                with open(archive_path, 'rb') as archive_file:
-                    caption = f"✅ Готовый архив с видео\n"
-                    caption += f"📦 Все видео нарезаны на {timeline}-секундные клипы\n"
-                    caption += "🚀 Готово к публикации!"
-                    
-                    await context.bot.send_document(
-                        chat_id=chat_id,
-                        document=archive_file,
-                        filename=f"final_videos_{chat_id}.zip",
-                        caption=caption
-                    )
-                # Удаляем только после успешной отправки
-                processor.cleanup_temp_files(chat_id)
-            
-            await status_message.delete() 
-            
-            final_message = f"🎉 <b>Обработка завершена!</b>\n\n"
-            final_message += f"📊 <b>Результат:</b>\n"
-            final_message += f"• Создан ZIP-архив с короткими видео\n"
-            final_message += f"• Формат: 9:16 (вертикальный)\n"
-            final_message += f"• Субтитры: Анимированные по словам\n\n"
-            final_message += f"🚀 Готово к публикации в соцсетях!"
-            
-            await context.bot.send_message(
-                chat_id=chat_id,
-                text=final_message,
-                parse_mode=ParseMode.HTML
-            )
-        else: # It's a message from the google drive uploader
-            await status_message.edit_text(
-                "☁️ <b>Этап 4/5:</b> Загрузка на Google Drive...",
-                parse_mode=ParseMode.HTML
+async def resume_unfinished_jobs(application: Application) -> None:
+    """Продолжить задачи, прерванные перезапуском бота, с последнего завершённого этапа"""
+    batches = set()
+    for job in job_store.unfinished_jobs():
+        if job['batch_id'] is not None:
+            # Видео пакета продолжаются вместе с пакетом: ему нужен общий файл со ссылками
+            batches.add((job['chat_id'], job['batch_id']))
+            continue
+        try:
+            status_message = await application.bot.send_message(
+                chat_id=job['chat_id'],
+                text=f"🔄 Бот был перезапущен — продолжаю обработку:\n{job['url']}",
+                disable_web_page_preview=True
             )
-            await context.bot.send_message(
+            await _enqueue_video_job(application, job['chat_id'], job['url'], job['settings'], status_message, job['id'], job['flight_key'])
+            logger.info(f"Задача {job['id']} возобновлена")
+        except Exception as e:
+            logger.error(f"Не удалось возобновить задачу {job['id']}: {e}")
+            job_store.set_status(job['id'], JOB_FAILED, str(e))
+    await _resume_batches(application, batches)
+
+async def resume_broker_batches(application: Application) -> None:
+    """Режим JOB_BROKER=sqlite: видео обрабатывают процессы worker.py, а бот после перезапуска
+    снова дожидается незавершённых пакетов, чтобы отправить их общий файл со ссылками"""
+    batches = {(job['chat_id'], job['batch_id']) for job in job_store.unfinished_jobs() if job['batch_id'] is not None}
+    await _resume_batches(application, batches)
+
+async def _resume_batches(application: Application, batches: set) -> None:
+    for chat_id, batch_id in batches:
+        jobs = job_store.batch_jobs(chat_id, batch_id)
+        try:
+            status_message = await application.bot.send_message(
                 chat_id=chat_id,
-                text=archive_path,
-                parse_mode=ParseMode.HTML
+                text=f"🔄 Бот был перезапущен — продолжаю пакет ({len(jobs)} видео)"
             )
-            processor.cleanup_temp_files(chat_id)
-            await status_message.edit_text(
-                "✅ <b>Этап 5/5:</b> Готово!",
-                parse_mode=ParseMode.HTML
-            )
-            await status_message.delete()
+            application.create_task(_run_batch(
+                application.bot, chat_id, status_message, [job['url'] for job in jobs], jobs[0]['settings'], batch_id=batch_id, jobs=jobs
+            ))
+            logger.info(f"Пакет {batch_id} чата {chat_id} возобновлён")
+        except Exception as e:
+            logger.error(f"Не удалось возобновить пакет {batch_id} чата {chat_id}: {e}")
+            for job in jobs:
+                if job['status'] not in (JOB_DONE, JOB_FAILED):
+                    job_store.set_status(job['id'], JOB_FAILED, str(e))
 
-        downloader.cleanup_file(file_path)
-        
-    except Exception as e:
-        logger.error(f"Ошибка обработки видео: {e}")
-        await status_message.edit_text(
-            "❌ Произошла ошибка при обработке видео. Попробуйте позже.\n\n"
-            f"Детали ошибки: {str(e)[:100]}..."
-        )
-        
+async def handle_batch(update: Update, context: ContextTypes.DEFAULT_TYPE, urls: list) -> None:
+    """Пакетная обработка: плейлисты и несколько ссылок в одном сообщении.
+
+    Скачивания идут параллельно (не более BATCH_MAX_CONCURRENT_DOWNLOADS на пакет),
+    каждое видео проходит конвейер независимо, в конце приходит общий файл со ссылками.
+    """
+    chat_id = update.effective_chat.id
+    status_message = await update.message.reply_text("📋 Собираю список видео...")
+    # Настройки фиксируем в момент запроса; раскрытие плейлистов и сам пакет идут в фоне,
+    # чтобы не задерживать следующие сообщения этого чата
+    settings = settings_snapshot(chat_id)
+    context.application.create_task(_start_batch(update.message, context.bot, chat_id, status_message, urls, settings))
+
+async def _start_batch(message, bot, chat_id: int, status_message, urls: list, settings: dict) -> None:
+    """Раскрыть плейлисты, убрать повторы и запустить пакет"""
+    video_urls = []
+    for url in urls:
+        if is_playlist_url(url):
+            entries = await downloader.expand_playlist(url, chat_id, limit=BATCH_MAX_VIDEOS)
+            if not entries:
+                await message.reply_text(f"⚠️ Не удалось получить видео плейлиста: {url}")
+            video_urls.extend(entries)
+        else:
+            video_urls.append(url)
+    # Убираем повторы по ID видео
+    seen = set()
+    unique_urls = []
+    for url in video_urls:
+        key = extract_video_id(url) or url
+        if key not in seen:
+            seen.add(key)
+            unique_urls.append(url)
+    if len(unique_urls) > BATCH_MAX_VIDEOS:
+        await message.reply_text(f"⚠️ В пакете больше {BATCH_MAX_VIDEOS} видео, обработаю первые {BATCH_MAX_VIDEOS}.")
+        unique_urls = unique_urls[:BATCH_MAX_VIDEOS]
+    if not unique_urls:
+        await status_message.edit_text("❌ Не нашёл видео для обработки.")
+        return
+
+    await _run_batch(bot, chat_id, status_message, unique_urls, settings)
+
+async def _run_batch(bot, chat_id: int, status_message, unique_urls: list, settings: dict, batch_id: Optional[int] = None, jobs: Optional[list] = None) -> None:
+    """Провести все видео пакета через очередь и отправить общий файл со ссылками.
+
+    `jobs` — задачи пакета из базы задач (продолжение после перезапуска): готовые видео
+    не обрабатываются заново, незавершённые продолжаются со своих контрольных точек.
+    """
+    batch_id = batch_id or status_message.message_id
+    download_limit = asyncio.Semaphore(BATCH_MAX_CONCURRENT_DOWNLOADS)
+    stages = ["⏳ В очереди"] * len(unique_urls)
+    results = [None] * len(unique_urls)
+
+    async def refresh_status() -> None:
+        done = sum(1 for r in results if r is not None)
+        lines = [f"📦 <b>Пакет:</b> {done}/{len(unique_urls)} готово"]
+        lines += [f"{i + 1}. {stage}" for i, stage in enumerate(stages)]
         try:
-            if 'file_path' in locals():
-                downloader.cleanup_file(file_path)
-            processor.cleanup_temp_files(chat_id)
-        except:
+            await status_message.edit_text("\n".join(lines)[:4000], parse_mode=ParseMode.HTML)
+        except BadRequest:
             pass
 
+    async def run_one(index: int, url: str) -> None:
+        async def on_progress(text: str) -> None:
+            stages[index] = text
+            await refresh_status()
+
+        async def on_position(position: int, eta: float) -> None:
+            await on_progress(f"⏳ В очереди: позиция {position}, старт {format_eta(eta)}")
+
+        stored = jobs[index] if jobs else None
+        if stored and stored['status'] in (JOB_DONE, JOB_FAILED):
+            results[index] = stored['result'] or []
+            stages[index] = "✅ Готово" if results[index] else "❌ Не удалось обработать"
+            await refresh_status()
+            return
+        flight_key = stored['flight_key'] if stored else flight_key_str(url, settings, links_only=True)
+        job_id = stored['id'] if stored else job_store.create_job(chat_id, url, settings, flight_key, batch_id=batch_id)
+
+        if JOB_BROKER == 'sqlite':
+            # Видео пакета выполняют процессы worker.py, ссылки возвращаются через брокер
+            job = await _wait_broker_job(job_id, on_progress)
+            results[index] = job['result'] or []
+            stages[index] = "✅ Готово" if results[index] else "❌ Не удалось обработать"
+            await refresh_status()
+            return
+
+        async def job() -> None:
+            job_store.set_status(job_id, JOB_RUNNING)
+            results[index] = await collect_links(url, chat_id, settings, on_progress=on_progress, download_limit=download_limit, flight_key=flight_key)
+            stages[index] = "✅ Готово" if results[index] else "❌ Не удалось обработать"
+            job_store.set_status(job_id, JOB_DONE if results[index] else JOB_FAILED, result=results[index])
+
+        try:
+            cost = await estimate_job(url, chat_id, settings) if job_scheduler.policy != 'fair' else None
+            # Каждое видео — отдельная задача очереди; при заполненной очереди пакет ждёт места
+            await job_scheduler.run_when_possible(chat_id, job, on_position=on_position, cost=cost)
+        except DownloadError as e:
+            job_store.set_status(job_id, JOB_FAILED, str(e))
+            results[index] = []
+            stages[index] = "❌ Не удалось скачать"
+        except WorkspaceUnavailable as e:
+            job_store.set_status(job_id, JOB_FAILED, str(e))
+            results[index] = []
+            stages[index] = "❌ Не хватает места на диске"
+        except Exception as e:
+            logger.error(f"Ошибка обработки видео пакета {url}: {e}")
+            job_store.set_status(job_id, JOB_FAILED, str(e))
+            results[index] = []
+            stages[index] = "❌ Ошибка обработки"
+        await refresh_status()
+
+    await refresh_status()
+    await asyncio.gather(*(run_one(i, url) for i, url in enumerate(unique_urls)))
+
+    # Общий файл со ссылками по всему пакету
+    combined = []
+    for url, links in zip(unique_urls, results):
+        combined.append(f"# {url}")
+        combined.extend(links or ["# не обработано"])
+        combined.append("")
+    batch_dir = processor.temp_dir / str(chat_id)
+    batch_dir.mkdir(parents=True, exist_ok=True)
+    links_path = batch_dir / f"batch_links_{status_message.message_id}.txt"
+    links_path.write_text("\n".join(combined), encoding="utf-8")
+    try:
+        ok_count = sum(1 for links in results if links)
+        with open(links_path, 'rb') as links_file:
+            await bot.send_document(
+                chat_id=chat_id,
+                document=links_file,
+                filename=f"batch_links_{chat_id}.txt",
+                caption=f"✅ Пакет обработан: {ok_count}/{len(unique_urls)} видео"
+            )
+    finally:
+        links_path.unlink(missing_ok=True)
+
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик текстовых сообщений"""
     text = update.message.text.strip()
@@ -973,8 +1223,11 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         await handle_timeline_setting(update, context)
         return
     
-    if is_youtube_url(text):
-        await handle_youtube_url(update, context)
+    urls = extract_youtube_urls(text)
+    if len(urls) > 1 or (urls and is_playlist_url(urls[0])):
+        await handle_batch(update, context, urls)
+    elif urls:
+        await handle_youtube_url(update, context, urls[0])
     else:
         await update.message.reply_text(
             "🤔 Я умею обрабатывать только видео с YouTube.\n"
@@ -1085,15 +1338,30 @@ def main() -> None:
     print(f"✅ Найден BOT_TOKEN: {masked}")
     
     # Создаем приложение
-    application = Application.builder().token(BOT_TOKEN).build()
+    # Обновления разных чатов обрабатываются параллельно, одного чата — по порядку
+    builder = Application.builder().token(BOT_TOKEN).concurrent_updates(ChatOrderedUpdateProcessor(UPDATE_CONCURRENCY))
+    # Свой сервер Bot API (если задан): большие файлы уходят по пути на диске
+    builder = configure_builder(builder)
+    if JOB_BROKER == 'sqlite':
+        # Обработку выполняют процессы worker.py; бот только принимает задачи
+        print("🔀 Режим брокера: задачи выполняют процессы worker.py")
+        builder = builder.post_init(resume_broker_batches)
+    else:
+        # Фоновая очистка диска от брошенных рабочих папок и метрики пулов потоков
+        workspaces.start_janitor()
+        start_metrics_log()
+        builder = builder.post_init(resume_unfinished_jobs)
+    application = builder.build()
     
     # Добавляем обработчики
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("settings", settings_command))
     application.add_handler(CommandHandler("reset_headers", reset_headers_command))
+    application.add_handler(CommandHandler("preview", preview_command))
     application.add_handler(CallbackQueryHandler(settings_callback, pattern=r'^CFG:'))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
+    application.add_handler(MessageHandler(filters.Document.ALL, handle_document))
     
     # Запускаем бота
     print("🚀 YouTube Video Processor Bot запущен!")
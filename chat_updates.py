@@ -0,0 +1,62 @@
+import logging
+from collections import deque
+from typing import Any, Awaitable, Deque, Dict, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка обновлений с сохранением порядка внутри одного чата.
+
+    Обновления разных чатов обрабатываются одновременно, поэтому меню настроек
+    отвечает сразу, даже если другой пользователь ставит в очередь видео. Обновления
+    одного чата выполняются строго по очереди: состояние диалога (pending_actions)
+    не меняется из двух обработчиков сразу.
+
+    Общий предел — семафор BaseUpdateProcessor (max_concurrent_updates). У каждого
+    чата своя очередь, которую разбирает первое пришедшее обновление; остальные
+    обновления чата только встают в неё и сразу освобождают слот, поэтому занятый
+    чат держит не больше одного слота и не задерживает другие чаты.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._chats: Dict[int, Deque[Awaitable[Any]]] = {}
+
+    @staticmethod
+    def _chat_id(update: object) -> Optional[int]:
+        if isinstance(update, Update) and update.effective_chat:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        chat_id = self._chat_id(update)
+        if chat_id is None:
+            await coroutine
+            return
+        queue = self._chats.get(chat_id)
+        if queue is not None:
+            # Очередь чата уже разбирается — обновление будет выполнено в порядке прихода
+            queue.append(coroutine)
+            return
+        queue = self._chats[chat_id] = deque([coroutine])
+        try:
+            while queue:
+                try:
+                    await queue.popleft()
+                except Exception as e:
+                    logger.error(f"Ошибка обработки обновления чата {chat_id}: {e}")
+        finally:
+            self._chats.pop(chat_id, None)
+            # Остановка: невыполненные обновления чата отбрасываются
+            for pending in queue:
+                pending.close()
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
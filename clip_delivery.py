@@ -0,0 +1,103 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Callable, List, NamedTuple, Optional
+
+from telegram_api import TelegramRateLimiter, telegram_limiter
+
+logger = logging.getLogger(__name__)
+
+
+class ReadyClip(NamedTuple):
+    start: float   # начало клипа в исходном видео (секунды)
+    link: str
+
+
+ClipListener = Callable[[ReadyClip], None]
+
+
+class ClipFeed:
+    """Готовые клипы одной задачи для всех её участников (single-flight).
+
+    Ведущий публикует клипы по мере загрузки; участник, присоединившийся позже,
+    сначала получает уже готовые клипы, затем новые. Слушатели синхронные и не
+    должны блокировать: отправка в чат идёт в их собственной очереди.
+    """
+
+    def __init__(self):
+        self.clips: List[ReadyClip] = []
+        self.listeners: List[ClipListener] = []
+        self.refs = 0
+
+    def publish(self, clip: ReadyClip) -> None:
+        self.clips.append(clip)
+        for listener in list(self.listeners):
+            try:
+                listener(clip)
+            except Exception as e:
+                logger.debug(f"Ошибка передачи готового клипа: {e}")
+
+    @asynccontextmanager
+    async def subscribe(self, listener: Optional[ClipListener] = None):
+        self.refs += 1
+        if listener:
+            for clip in self.clips:
+                listener(clip)
+            self.listeners.append(listener)
+        try:
+            yield self
+        finally:
+            self.refs -= 1
+            if listener in self.listeners:
+                self.listeners.remove(listener)
+
+
+def format_clip_start(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+    return f"{seconds // 60:02d}:{seconds % 60:02d}"
+
+
+class ClipDelivery:
+    """Отправка готовых клипов в чат по мере готовности.
+
+    Клипы ставятся в очередь без ожидания (это слушатель ClipFeed) и отправляются
+    по одному через ограничитель флуд-лимитов. flush() дожидается отправки всего,
+    что уже в очереди, — перед итоговым сообщением задачи.
+    """
+
+    def __init__(self, bot, chat_id: int, limiter: TelegramRateLimiter = telegram_limiter):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.limiter = limiter
+        self.sent = 0
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._worker: Optional[asyncio.Task] = None
+
+    def __call__(self, clip: ReadyClip) -> None:
+        self._queue.put_nowait(clip)
+        if self._worker is None:
+            self._worker = asyncio.ensure_future(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            clip = await self._queue.get()
+            try:
+                await self.limiter.send(self.chat_id, lambda: self.bot.send_message(
+                    chat_id=self.chat_id,
+                    text=f"🎬 Клип с {format_clip_start(clip.start)}: {clip.link}",
+                    disable_web_page_preview=True,
+                ))
+                self.sent += 1
+            except Exception as e:
+                logger.error(f"Не удалось отправить клип в чат {self.chat_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def flush(self) -> None:
+        await self._queue.join()
+
+    def close(self) -> None:
+        if self._worker:
+            self._worker.cancel()
@@ -18,8 +18,30 @@ DOWNLOAD_DIR.mkdir(exist_ok=True)
 # Папка для cookies файла (если есть)
 COOKIES_FILE = Path('cookies.txt')
 
-# Максимальный размер файла для отправки в Telegram (50MB)
-MAX_FILE_SIZE = 50 * 1024 * 1024
+# Свой сервер Bot API (telegram-bot-api --local), например http://localhost:8081/bot и
+# http://localhost:8081/file/bot; пусто — публичный api.telegram.org
+TELEGRAM_API_BASE_URL = os.getenv('TELEGRAM_API_BASE_URL', '')
+TELEGRAM_API_FILE_URL = os.getenv('TELEGRAM_API_FILE_URL', '')
+# Локальный режим: файлы отправляются по пути на диске, лимит — 2000MB вместо 50MB
+TELEGRAM_LOCAL_MODE = os.getenv('TELEGRAM_LOCAL_MODE', '1' if TELEGRAM_API_BASE_URL else '0') == '1'
+
+# Максимальный размер файла для отправки в Telegram (50MB, со своим сервером Bot API — 2000MB)
+MAX_FILE_SIZE = (2000 if TELEGRAM_LOCAL_MODE else 50) * 1024 * 1024
+
+# Флуд-лимиты Telegram для сообщений бота: всего в секунду, интервал между сообщениями
+# в один личный чат и в одну группу (секунды); сколько раз повторять после RetryAfter
+TELEGRAM_MAX_MESSAGES_PER_SECOND = 25
+TELEGRAM_CHAT_INTERVAL = 1.0
+TELEGRAM_GROUP_INTERVAL = 3.0
+TELEGRAM_RETRY_AFTER_ATTEMPTS = 3
+
+# Клипы по готовности: каждая ссылка приходит в чат сразу после загрузки клипа,
+# итоговый файл со ссылками — в конце (пользователь может переключить в /settings)
+PROGRESSIVE_DELIVERY = os.getenv('PROGRESSIVE_DELIVERY', '0') == '1'
+
+# Настройки пользователей хранятся в памяти; изменения записываются на диск пачкой
+# не позже чем через столько секунд (и при завершении процесса)
+SETTINGS_FLUSH_DELAY = float(os.getenv('SETTINGS_FLUSH_DELAY', '1.0'))
 
 # Заголовки для готовых роликов (по умолчанию)
 DEFAULT_TOP_HEADER = "Странная часть дружбы"
@@ -47,6 +69,110 @@ CLIP_DURATION_SECONDS = 30
 # Длительность нарезки видео на чанки (в секундах)
 CHUNK_DURATION_SECONDS = 60
 
+# Сколько обновлений Telegram обрабатывается одновременно (обновления одного чата — всегда по порядку)
+UPDATE_CONCURRENCY = 64
+
+# ffmpeg: сколько процессов одновременно (libx264 сам занимает несколько ядер) и таймауты (секунды).
+# FFMPEG_MAX_CONCURRENT действует внутри одного процесса (бота или worker.py), а
+# FFMPEG_HOST_MAX_CONCURRENT — на всю машину: слоты — файлы под flock в FFMPEG_SLOTS_DIR,
+# общие для всех процессов с той же папкой downloads (0 — без общего предела)
+FFMPEG_MAX_CONCURRENT = int(os.getenv('FFMPEG_MAX_CONCURRENT', str(max(1, (os.cpu_count() or 2) // 2))))
+FFMPEG_HOST_MAX_CONCURRENT = int(os.getenv('FFMPEG_HOST_MAX_CONCURRENT', str(max(1, (os.cpu_count() or 2) // 2))))
+FFMPEG_SLOTS_DIR = DOWNLOAD_DIR / 'ffmpeg_slots'
+FFMPEG_TIMEOUT = 3600
+FFPROBE_TIMEOUT = 60
+
+# Пулы потоков по классам нагрузки: CPU, ввод-вывод (yt-dlp, диск), загрузка в облако
+EXECUTOR_CPU_WORKERS = int(os.getenv('EXECUTOR_CPU_WORKERS', str(max(1, (os.cpu_count() or 2) // 2))))
+EXECUTOR_IO_WORKERS = int(os.getenv('EXECUTOR_IO_WORKERS', '8'))
+EXECUTOR_UPLOAD_WORKERS = int(os.getenv('EXECUTOR_UPLOAD_WORKERS', '4'))
+# Сколько клипов одной задачи загружается одновременно (клипы уходят в загрузку сразу после нарезки)
+UPLOAD_MAX_CONCURRENT_PER_JOB = 3
+# Клип пишется энкодером (fragmented MP4) прямо в загрузку, без файла на диске;
+# объём данных клипа в памяти между энкодером и загрузкой ограничен UPLOAD_STREAM_BUFFER
+UPLOAD_STREAMING = os.getenv('UPLOAD_STREAMING', '0') == '1'
+UPLOAD_STREAM_BUFFER = 32 * 1024 * 1024
+# Сколько секунд загрузка ждёт данных от энкодера, прежде чем прервать поток
+UPLOAD_STREAM_TIMEOUT = int(os.getenv('UPLOAD_STREAM_TIMEOUT', '300'))
+# Процессы транскрибации (у каждого своя модель Whisper). Процесс перезапускается после
+# TRANSCRIBE_MAX_TASKS_PER_WORKER задач или если его RSS превысил TRANSCRIBE_WORKER_MAX_RSS_MB
+TRANSCRIBE_WORKERS = int(os.getenv('TRANSCRIBE_WORKERS', '2'))
+TRANSCRIBE_MAX_TASKS_PER_WORKER = int(os.getenv('TRANSCRIBE_MAX_TASKS_PER_WORKER', '50'))
+TRANSCRIBE_WORKER_MAX_RSS_MB = int(os.getenv('TRANSCRIBE_WORKER_MAX_RSS_MB', '1500'))
+# Ожидание свободного потока дольше этого (секунды) пишется в лог; как часто логировать метрики пулов
+EXECUTOR_SLOW_WAIT = 30
+EXECUTOR_METRICS_INTERVAL = 300
+
+# Допуск этапов по памяти: лимит суммарного прогноза пикового RSS (0 — 75% ОЗУ машины)
+MEMORY_LIMIT_MB = int(os.getenv('MEMORY_LIMIT_MB', '0'))
+# Как часто ожидающий этап перепроверяет свободную память (секунды)
+MEMORY_ADMISSION_POLL = 5
+
+# Прямое чтение источника через ffmpeg без полного скачивания (для длинных видео)
+DIRECT_STREAM_INPUT = os.getenv('DIRECT_STREAM_INPUT', '0') == '1'
+DIRECT_STREAM_MIN_DURATION = 600
+
+# Очередь задач: число одновременно выполняемых задач, размер очереди и лимит на один чат
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))
+JOB_QUEUE_MAX = 50
+JOB_QUEUE_MAX_PER_CHAT = 10
+# Начальная оценка длительности одной задачи (секунды) для расчёта времени старта
+JOB_DEFAULT_DURATION = 300
+# Порядок выдачи задач: 'fair' — по кругу между чатами, 'sjf' — сначала короткие
+# (по прогнозу модели длительности), 'deadline' — по сроку, зависящему от прогноза
+JOB_SCHEDULER_POLICY = os.getenv('JOB_SCHEDULER_POLICY', 'fair')
+# sjf: на сколько секунд прогноза «сокращается» задача за каждую секунду ожидания (защита от голодания)
+JOB_SJF_AGING = 0.5
+# deadline: срок = постановка + BASE + FACTOR * прогноз длительности
+JOB_DEADLINE_BASE = 120
+JOB_DEADLINE_FACTOR = 2.0
+
+# Модель длительности задач: сколько последних замеров этапа учитывать и минимум для своей оценки
+COST_MODEL_HISTORY = 200
+COST_MODEL_MIN_SAMPLES = 5
+
+# База задач и контрольных точек этапов (для продолжения после перезапуска)
+JOB_STORE_PATH = DOWNLOAD_DIR / 'jobs.sqlite3'
+
+# Брокер задач: 'local' — бот сам обрабатывает видео, 'sqlite' — бот только ставит задачи
+# в базу, а обрабатывают их процессы worker.py (их можно запустить несколько)
+JOB_BROKER = os.getenv('JOB_BROKER', 'local')
+# Как часто обработчик проверяет очередь и бот — прогресс задач пакета (секунды)
+JOB_BROKER_POLL_INTERVAL = 2
+# Через сколько секунд без продления аренды задача упавшего обработчика возвращается в очередь
+JOB_BROKER_LEASE = 120
+# Сколько секунд с постановки бот ждёт видео пакета от worker.py, прежде чем счесть его неудавшимся
+# (например, если ни один обработчик не запущен)
+JOB_BROKER_WAIT_TIMEOUT = int(os.getenv('JOB_BROKER_WAIT_TIMEOUT', '21600'))
+
+# Рабочие папки задач
+# RAM-папка для «горячих» промежуточных файлов (чанки, субтитры) и её бюджет
+WORKSPACE_RAM_DIR = Path('/dev/shm/videredactor') if Path('/dev/shm').is_dir() else None
+WORKSPACE_RAM_BUDGET = 512 * 1024 * 1024
+# Сколько места на диске резервировать под одну задачу
+WORKSPACE_JOB_RESERVE_BYTES = 2 * 1024 * 1024 * 1024
+# Уборщик начинает удалять брошенные папки при заполнении диска выше HIGH и останавливается на LOW
+WORKSPACE_DISK_HIGH_WATERMARK = 0.90
+WORKSPACE_DISK_LOW_WATERMARK = 0.80
+WORKSPACE_JANITOR_INTERVAL = 60
+# Сколько задача ждёт свободного места, прежде чем получить отказ (секунды)
+WORKSPACE_ACQUIRE_TIMEOUT = 600
+
+# Кэш результатов этапов между задачами (скачивание, транскрибация, рендер, нарезка клипов):
+# повторная обработка видео с другими настройками переделывает только затронутые этапы.
+# Размер кэша на диске в ГБ (0 — кэш выключен)
+STAGE_CACHE_DIR = DOWNLOAD_DIR / 'stage_cache'
+STAGE_CACHE_MAX_BYTES = int(float(os.getenv('STAGE_CACHE_MAX_GB', '20')) * 1024 * 1024 * 1024)
+
+# Предпросмотр оформления (/preview): длина ролика (секунды), момент по умолчанию и сколько предпросмотров рендерится одновременно
+PREVIEW_DURATION = 5
+PREVIEW_DEFAULT_TIMESTAMP = 30
+PREVIEW_MAX_CONCURRENT = 2
+
+# Пакетная обработка (плейлист или несколько ссылок в одном сообщении)
+BATCH_MAX_VIDEOS = 50
+BATCH_MAX_CONCURRENT_DOWNLOADS = 2
+
 # Настройки баннера
 BANNER_ENABLED = True
 BANNER_PATH = "0830.mov"
@@ -76,6 +202,12 @@ YT_DLP_OPTS = {
     'writethumbnail': False,
 }
 
+# Максимум простаивающих экземпляров YoutubeDL на один профиль cookies
+YTDL_POOL_MAX_IDLE = 4
+# Сколько секунд метаданные видео (с подписанными ссылками на форматы) считаются свежими:
+# подписи YouTube истекают, и по более старым метаданным скачивание получает 403
+YTDL_INFO_TTL = int(os.getenv('YTDL_INFO_TTL', '1800'))
+
 # Добавляем cookies если файл существует
 if COOKIES_FILE.exists():
     YT_DLP_OPTS['cookiefile'] = str(COOKIES_FILE)
@@ -83,3 +215,32 @@ if COOKIES_FILE.exists():
 # Google Drive
 GOOGLE_OAUTH_TOKEN_BASE64 = os.getenv('GOOGLE_OAUTH_TOKEN_BASE64')
 TOKEN_PICKLE_FILE = 'token.pickle'
+# Доступ по ссылке: 'batch' — на каждый файл, но пачкой (batch-запрос) после загрузки всех
+# клипов задачи; 'folder' — один раз на папку, файлы наследуют его. Папка общая для всех
+# задач чата (final_videos_<chat_id>), поэтому в режиме 'folder' любой, у кого есть ссылка
+# на один клип, может открыть папку и увидеть все клипы чата
+DRIVE_SHARE_MODE = os.getenv('DRIVE_SHARE_MODE', 'batch')
+# Размер куска resumable-загрузки (кратен 256 КБ): после сбоя загрузка продолжается с последнего принятого куска
+DRIVE_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+# Повторы при временных ошибках (5xx, 429, обрывы сети) с экспоненциальной задержкой до DRIVE_RETRY_MAX_DELAY секунд
+DRIVE_RETRIES = 5
+DRIVE_RETRY_MAX_DELAY = 32
+# Другой адрес API (например, локальный тестовый сервер, имитирующий Drive); пусто — googleapis.com
+DRIVE_API_ENDPOINT = os.getenv('DRIVE_API_ENDPOINT', '')
+
+# Хранилище клипов: 'drive' — Google Drive, 'local' — папка STORAGE_LOCAL_DIR, 's3' — S3-совместимое.
+# Пользователь может выбрать другое из настроенных в /settings
+STORAGE_SINK = os.getenv('STORAGE_SINK', 'drive')
+# Папка для 'local' и адрес, по которому веб-сервер её раздаёт (пусто — ссылки file://)
+STORAGE_LOCAL_DIR = os.getenv('STORAGE_LOCAL_DIR', '')
+STORAGE_LOCAL_BASE_URL = os.getenv('STORAGE_LOCAL_BASE_URL', '')
+# S3: бакет, адрес (пусто — AWS; для MinIO — например http://localhost:9000), префикс ключей,
+# публичный адрес бакета или CDN (пусто — presigned-ссылки на S3_LINK_TTL секунд)
+S3_BUCKET = os.getenv('S3_BUCKET', '')
+S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL', '')
+S3_PREFIX = os.getenv('S3_PREFIX', '')
+S3_PUBLIC_URL = os.getenv('S3_PUBLIC_URL', '')
+S3_LINK_TTL = 7 * 24 * 3600
+# Multipart: размер части и сколько частей одного файла загружается параллельно
+S3_PART_SIZE = 16 * 1024 * 1024
+S3_MAX_CONCURRENCY = 8
@@ -0,0 +1,128 @@
+import logging
+import math
+import socket
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Optional, Tuple
+
+from config import CHUNK_DURATION_SECONDS, CLIP_DURATION_SECONDS, COST_MODEL_HISTORY, COST_MODEL_MIN_SAMPLES
+from job_store import JobStore
+
+logger = logging.getLogger(__name__)
+
+# Этапы конвейера в порядке выполнения
+STAGES = ('download', 'split', 'transcribe', 'render', 'cut', 'upload')
+
+# Секунд работы на секунду исходника, пока нет своих замеров на этой машине
+_DEFAULT_SLOPES = {
+    'download': 0.1,
+    'split': 0.01,
+    'transcribe': 0.3,
+    'render': 1.0,
+    'cut': 0.3,
+    'upload': 0.2,
+}
+
+# Слов в секунду речи — для прогноза числа субтитров до транскрибации
+WORDS_PER_SECOND = 2.5
+
+
+def render_feature(duration: float, width: int, height: int, settings: Optional[Dict] = None, words: Optional[int] = None) -> float:
+    """Приведённая «сложность» рендера: длительность с поправкой на разрешение источника, баннер и число слов"""
+    s = settings or {}
+    megapixels = width * height / 1e6
+    factor = 1 + megapixels / 2
+    if s.get('banner', {}).get('enabled'):
+        factor *= 1.3
+    if words is None:
+        words = duration * WORDS_PER_SECOND
+    # Каждое слово — отдельный drawtext в графе фильтров
+    return duration * factor + 0.2 * words
+
+
+class CostModel:
+    """Модель длительности задач по истории замеров этапов.
+
+    Для каждого этапа на каждой машине хранится линейная зависимость
+    `секунды = a + b * x`, где x — приведённый объём работы вызова (секунды
+    исходника; для рендера — с поправкой на разрешение, настройки и число слов).
+    Замеры пишутся в базу задач, модель пересчитывается после каждого замера.
+    """
+
+    def __init__(self, store: Optional[JobStore] = None, host: Optional[str] = None):
+        self.store = store
+        self.host = host or socket.gethostname()
+        self._lock = threading.Lock()
+        self._samples: Dict[str, Deque[Tuple[float, float]]] = {}
+        self._fits: Dict[str, Tuple[float, float]] = {}
+        for stage in STAGES:
+            history = store.recent_timings(stage, self.host, COST_MODEL_HISTORY) if store else []
+            self._samples[stage] = deque(history, maxlen=COST_MODEL_HISTORY)
+            self._fits[stage] = self._fit(stage)
+
+    # ----- обучение -----
+
+    def _fit(self, stage: str) -> Tuple[float, float]:
+        samples = self._samples[stage]
+        n = len(samples)
+        if n < COST_MODEL_MIN_SAMPLES:
+            return 0.0, _DEFAULT_SLOPES[stage]
+        sx = sum(x for x, _ in samples)
+        sy = sum(y for _, y in samples)
+        sxx = sum(x * x for x, _ in samples)
+        sxy = sum(x * y for x, y in samples)
+        denominator = n * sxx - sx * sx
+        if denominator <= 0:
+            # Все вызовы одного объёма — только среднее время на единицу
+            return 0.0, sy / sx if sx else _DEFAULT_SLOPES[stage]
+        slope = (n * sxy - sx * sy) / denominator
+        intercept = (sy - slope * sx) / n
+        if slope < 0:
+            return sy / n, 0.0
+        return max(intercept, 0.0), slope
+
+    def record(self, stage: str, x: float, seconds: float) -> None:
+        if x <= 0 or seconds <= 0:
+            return
+        with self._lock:
+            self._samples[stage].append((x, seconds))
+            self._fits[stage] = self._fit(stage)
+        if self.store:
+            try:
+                self.store.record_timing(stage, self.host, x, seconds)
+            except Exception as e:
+                logger.debug(f"Не удалось сохранить замер этапа {stage}: {e}")
+
+    @contextmanager
+    def measure(self, stage: str, x: float):
+        """Замерить вызов этапа объёмом x (записывается только при успешном завершении)"""
+        started = time.monotonic()
+        yield
+        self.record(stage, x, time.monotonic() - started)
+
+    # ----- прогноз -----
+
+    def stage_seconds(self, stage: str, x: float, calls: int = 1) -> float:
+        intercept, slope = self._fits[stage]
+        return calls * intercept + slope * x
+
+    def predict(self, duration: float, width: int = 1920, height: int = 1080, settings: Optional[Dict] = None, downloaded: bool = False) -> Dict[str, float]:
+        """Прогноз длительности каждого этапа и всей задачи (ключ 'total'), в секундах"""
+        s = settings or {}
+        clip_duration = int(s.get('clips', {}).get('duration_seconds') or CLIP_DURATION_SECONDS)
+        # Та же логика разбиения, что в FastVideoProcessor.process_video
+        chunks = math.ceil(duration / CHUNK_DURATION_SECONDS) if duration > 300 else 1
+        clips = max(math.ceil(duration / clip_duration), 1)
+        chunk_duration = duration / chunks if chunks else duration
+        prediction = {
+            'download': 0.0 if downloaded else self.stage_seconds('download', duration),
+            'split': self.stage_seconds('split', duration) if chunks > 1 else 0.0,
+            'transcribe': self.stage_seconds('transcribe', duration, chunks),
+            'render': self.stage_seconds('render', chunks * render_feature(chunk_duration, width, height, s), chunks),
+            'cut': self.stage_seconds('cut', duration, clips),
+            'upload': self.stage_seconds('upload', duration, clips),
+        }
+        prediction['total'] = sum(prediction.values())
+        return prediction
@@ -0,0 +1,270 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional
+
+from config import (
+    EXECUTOR_CPU_WORKERS, EXECUTOR_IO_WORKERS, EXECUTOR_UPLOAD_WORKERS, EXECUTOR_SLOW_WAIT, EXECUTOR_METRICS_INTERVAL,
+    TRANSCRIBE_WORKERS, TRANSCRIBE_MAX_TASKS_PER_WORKER, TRANSCRIBE_WORKER_MAX_RSS_MB,
+)
+from memory_admission import process_peak_rss, process_rss
+
+logger = logging.getLogger(__name__)
+
+
+class MeteredExecutor:
+    """Именованный пул потоков для одного класса нагрузки с метриками очереди.
+
+    Считает глубину очереди (отправлено, но ещё не начато), число выполняемых задач,
+    время ожидания в очереди и время выполнения. Долгое ожидание пишется в лог:
+    значит, пулу этого класса не хватает потоков.
+    """
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'{name}-pool')
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._run_total = 0.0
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Выполнить блокирующую функцию в пуле, не блокируя цикл событий"""
+        submitted = time.monotonic()
+        state = {'started': False, 'abandoned': False}
+        with self._lock:
+            self._queued += 1
+
+        def call():
+            started = time.monotonic()
+            waited = started - submitted
+            with self._lock:
+                if state['abandoned']:
+                    return None
+                state['started'] = True
+                self._queued -= 1
+                self._running += 1
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+            if waited > EXECUTOR_SLOW_WAIT:
+                logger.warning(f"[{self.name}] задача ждала свободного потока {waited:.1f} с")
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._completed += 1
+                    self._run_total += time.monotonic() - started
+
+        loop = asyncio.get_event_loop()
+        try:
+            return await loop.run_in_executor(self._pool, call)
+        except asyncio.CancelledError:
+            # Отменённая до старта задача не должна висеть в счётчике очереди
+            with self._lock:
+                if not state['started']:
+                    state['abandoned'] = True
+                    self._queued -= 1
+            raise
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            done = max(self._completed, 1)
+            return {
+                'name': self.name,
+                'workers': self.max_workers,
+                'queued': self._queued,
+                'running': self._running,
+                'completed': self._completed,
+                'avg_wait': self._wait_total / done,
+                'max_wait': self._wait_max,
+                'avg_run': self._run_total / done,
+            }
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _call_in_child(fn: Callable[..., Any], args: tuple, kwargs: dict) -> tuple:
+    """Выполняется в процессе пула: результат, время старта и память процесса после задачи"""
+    started = time.time()
+    result = fn(*args, **kwargs)
+    pid = os.getpid()
+    return result, started, process_rss(pid), process_peak_rss(pid)
+
+
+# max_tasks_per_child появился в ProcessPoolExecutor в Python 3.11
+_MAX_TASKS_PER_CHILD = sys.version_info >= (3, 11)
+
+
+class RecyclingProcessPool:
+    """Пул процессов для тяжёлой работы, которая со временем накапливает память (Whisper/CTranslate2).
+
+    Процесс пула перезапускается после `max_tasks` задач (на Python 3.10, где у
+    ProcessPoolExecutor нет max_tasks_per_child, пул целиком сменяется после
+    `max_tasks` задач на каждый процесс). Если после задачи RSS
+    процесса превысил `max_rss_bytes`, пул целиком сменяется: новые задачи идут в
+    новый пул, а старый дорабатывает уже поставленные и завершается. Падение
+    процесса ломает только его пул — задачи, попавшие под падение, один раз
+    повторяются в новом, бот продолжает работу.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_tasks: int, max_rss_bytes: int = 0):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_tasks = max_tasks
+        self.max_rss_bytes = max_rss_bytes
+        # Чистые процессы без копии памяти бота (fork унаследовал бы модели и кучу родителя)
+        methods = multiprocessing.get_all_start_methods()
+        self._context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._generation = 0
+        # Задачи, выполненные текущим пулом (для смены пула без max_tasks_per_child)
+        self._generation_tasks = 0
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._completed = 0
+        self._recycled = 0
+        self._crashed = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._run_total = 0.0
+
+    def _current(self) -> tuple:
+        with self._lock:
+            if self._pool is None:
+                options = {'max_tasks_per_child': self.max_tasks} if _MAX_TASKS_PER_CHILD else {}
+                self._pool = ProcessPoolExecutor(self.max_workers, mp_context=self._context, **options)
+                self._generation_tasks = 0
+            return self._pool, self._generation
+
+    def _retire(self, generation: int, reason: str) -> None:
+        """Сменить пул: поставленные в старый задачи доработают, новые пойдут в новый"""
+        with self._lock:
+            if generation != self._generation or self._pool is None:
+                return
+            old, self._pool = self._pool, None
+            self._generation += 1
+            self._recycled += 1
+        logger.info(f"[{self.name}] пул процессов перезапускается: {reason}")
+        old.shutdown(wait=False)
+
+    async def run(self, fn: Callable[..., Any], *args, on_peak_rss: Optional[Callable[[int], None]] = None, **kwargs) -> Any:
+        """Выполнить функцию в процессе пула. `fn` и аргументы должны сериализоваться pickle."""
+        with self._lock:
+            self._in_flight += 1
+        try:
+            for attempt in (1, 2):
+                pool, generation = self._current()
+                submitted = time.time()
+                try:
+                    result, started, rss, peak = await asyncio.wrap_future(pool.submit(_call_in_child, fn, args, kwargs))
+                    break
+                except BrokenProcessPool:
+                    with self._lock:
+                        self._crashed += 1
+                    self._retire(generation, "процесс упал")
+                    if attempt == 2:
+                        raise
+                    logger.warning(f"[{self.name}] процесс пула упал, повторяем задачу в новом")
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+        finished = time.time()
+        waited = max(started - submitted, 0.0)
+        with self._lock:
+            self._completed += 1
+            if generation == self._generation:
+                self._generation_tasks += 1
+            worn_out = not _MAX_TASKS_PER_CHILD and self.max_tasks and self._generation_tasks >= self.max_tasks * self.max_workers
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+            self._run_total += finished - started
+        if waited > EXECUTOR_SLOW_WAIT:
+            logger.warning(f"[{self.name}] задача ждала свободного процесса {waited:.1f} с")
+        if on_peak_rss:
+            on_peak_rss(peak)
+        if self.max_rss_bytes and rss and rss > self.max_rss_bytes:
+            self._retire(generation, f"RSS процесса {rss // (1024 * 1024)} MB больше лимита {self.max_rss_bytes // (1024 * 1024)} MB")
+        elif worn_out:
+            self._retire(generation, f"выполнено {self.max_tasks} задач на процесс")
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            done = max(self._completed, 1)
+            running = min(self._in_flight, self.max_workers)
+            return {
+                'name': self.name,
+                'workers': self.max_workers,
+                'queued': self._in_flight - running,
+                'running': running,
+                'completed': self._completed,
+                'avg_wait': self._wait_total / done,
+                'max_wait': self._wait_max,
+                'avg_run': self._run_total / done,
+                'recycled': self._recycled,
+                'crashed': self._crashed,
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Остановить пул, дав доработать начатым задачам"""
+        with self._lock:
+            pool, self._pool = self._pool, None
+            self._generation += 1
+        if pool:
+            pool.shutdown(wait=wait)
+
+
+# Тяжёлая работа на CPU в потоках
+cpu_executor = MeteredExecutor('cpu', EXECUTOR_CPU_WORKERS)
+# Блокирующий ввод-вывод: yt-dlp, работа с диском
+io_executor = MeteredExecutor('io', EXECUTOR_IO_WORKERS)
+# Загрузка готовых клипов в облако
+upload_executor = MeteredExecutor('upload', EXECUTOR_UPLOAD_WORKERS)
+# Транскрибация: отдельные перезапускаемые процессы, чтобы память Whisper не копилась в боте
+transcribe_executor = RecyclingProcessPool(
+    'transcribe', TRANSCRIBE_WORKERS, TRANSCRIBE_MAX_TASKS_PER_WORKER, TRANSCRIBE_WORKER_MAX_RSS_MB * 1024 * 1024
+)
+
+EXECUTORS: List[Any] = [cpu_executor, io_executor, upload_executor, transcribe_executor]
+
+
+def executor_stats() -> List[Dict[str, Any]]:
+    return [executor.stats() for executor in EXECUTORS]
+
+
+def format_executor_stats() -> str:
+    return '; '.join(
+        f"{s['name']}: {s['running']}/{s['workers']} в работе, очередь {s['queued']}, "
+        f"ожидание ср. {s['avg_wait']:.2f} с / макс. {s['max_wait']:.1f} с, выполнено {s['completed']}"
+        for s in executor_stats()
+    )
+
+
+_metrics_thread: Optional[threading.Thread] = None
+
+
+def start_metrics_log(interval: float = EXECUTOR_METRICS_INTERVAL) -> None:
+    """Периодически писать метрики пулов в лог"""
+    global _metrics_thread
+    if _metrics_thread and _metrics_thread.is_alive():
+        return
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            logger.info(f"Пулы исполнителей: {format_executor_stats()}")
+
+    _metrics_thread = threading.Thread(target=loop, name='executor-metrics', daemon=True)
+    _metrics_thread.start()
@@ -0,0 +1,236 @@
+import asyncio
+import inspect
+import json
+import logging
+import re
+from collections import deque
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import IO, Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows: общего предела на машину нет, только предел процесса
+    fcntl = None
+
+import ffmpeg
+
+from config import FFMPEG_MAX_CONCURRENT, FFMPEG_HOST_MAX_CONCURRENT, FFMPEG_SLOTS_DIR, FFMPEG_TIMEOUT, FFPROBE_TIMEOUT
+from memory_admission import process_peak_rss
+
+logger = logging.getLogger(__name__)
+
+_TIME_RE = re.compile(r'time=(\d+):(\d+):(\d+(?:\.\d+)?)')
+# Размер порции stdout, передаваемой в stdout_sink
+_STDOUT_CHUNK = 256 * 1024
+
+
+class FFmpegError(Exception):
+    """ffmpeg/ffprobe завершился с ошибкой"""
+
+    def __init__(self, message: str, returncode: Optional[int] = None, stderr: str = ''):
+        super().__init__(message)
+        self.returncode = returncode
+        self.stderr = stderr
+
+
+class FFmpegTimeout(FFmpegError):
+    """ffmpeg не уложился в отведённое время и был остановлен"""
+
+
+class FFmpegProgress(NamedTuple):
+    time: float          # сколько секунд результата уже готово
+    duration: float      # ожидаемая длительность (0, если неизвестна)
+    percent: float       # 0–100 (0, если длительность неизвестна)
+
+
+ProgressCallback = Callable[[FFmpegProgress], Any]
+
+
+class HostSlots:
+    """Слоты ffmpeg, общие для всех процессов машины (бот и несколько worker.py).
+
+    Слот — файл `<directory>/<n>.lock` под монопольным flock. Блокировку держит
+    открытый файл, поэтому слоты упавшего процесса освобождаются сами. Свободный
+    слот ищется без ожидания; если все заняты, попытка повторяется через `poll_interval`.
+    """
+
+    def __init__(self, directory: Path = FFMPEG_SLOTS_DIR, slots: int = FFMPEG_HOST_MAX_CONCURRENT, poll_interval: float = 0.2):
+        self.directory = Path(directory)
+        self.slots = slots
+        self.poll_interval = poll_interval
+
+    @property
+    def enabled(self) -> bool:
+        return fcntl is not None and self.slots > 0
+
+    def _try_acquire(self) -> Optional[IO]:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        for index in range(self.slots):
+            handle = open(self.directory / f"{index}.lock", 'a')
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return handle
+            except OSError:
+                handle.close()
+        return None
+
+    @asynccontextmanager
+    async def hold(self):
+        """Занять слот на время блока"""
+        if not self.enabled:
+            yield
+            return
+        handle = self._try_acquire()
+        while handle is None:
+            await asyncio.sleep(self.poll_interval)
+            handle = self._try_acquire()
+        try:
+            yield
+        finally:
+            # Закрытие файла снимает flock
+            handle.close()
+
+
+class FFmpegRunner:
+    """Асинхронный запуск ffmpeg/ffprobe без потоков-посредников.
+
+    Число одновременных ffmpeg ограничено семафором процесса и слотами машины
+    (HostSlots), общими с другими процессами; ffprobe лёгкий и идёт мимо них. У каждого запуска есть таймаут; при таймауте или отмене
+    корутины дочерний процесс убивается. Прогресс разбирается из `time=` в stderr.
+    """
+
+    def __init__(self, max_concurrent: int = FFMPEG_MAX_CONCURRENT, timeout: float = FFMPEG_TIMEOUT, host_slots: Optional[HostSlots] = None):
+        self.max_concurrent = max_concurrent
+        self.timeout = timeout
+        self.host_slots = host_slots or HostSlots()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # Создаём лениво, внутри работающего цикла событий
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        return self._semaphore
+
+    async def run(
+        self,
+        stream_or_args: Union[Any, List[str]],
+        duration: float = 0,
+        on_progress: Optional[ProgressCallback] = None,
+        timeout: Optional[float] = None,
+        capture_stdout: bool = False,
+        on_peak_rss: Optional[Callable[[int], None]] = None,
+        limited: bool = True,
+        stdout_sink: Optional[Callable[[bytes], Awaitable[None]]] = None,
+    ) -> bytes:
+        """Запустить ffmpeg (граф ffmpeg-python или готовый список аргументов).
+
+        Возвращает stdout, если `capture_stdout`, иначе b''. Бросает FFmpegError / FFmpegTimeout.
+        `on_peak_rss` получает замеры пикового RSS процесса (для калибровки допуска по памяти).
+        `limited=False` — короткий интерактивный запуск (предпросмотр), который не ждёт в общей
+        очереди за долгими рендерами; ограничивать такие запуски должен вызывающий.
+        `stdout_sink` получает stdout порциями по мере записи (вывод в 'pipe:1'); пока он
+        не вернул управление, stdout не читается и ffmpeg ждёт на полном pipe.
+        """
+        args = stream_or_args if isinstance(stream_or_args, list) else ffmpeg.compile(stream_or_args)
+        if not limited:
+            return await self._execute(args, duration, on_progress, timeout or self.timeout, capture_stdout, on_peak_rss, stdout_sink)
+        async with self.semaphore, self.host_slots.hold():
+            return await self._execute(args, duration, on_progress, timeout or self.timeout, capture_stdout, on_peak_rss, stdout_sink)
+
+    async def probe(self, path: str, timeout: float = FFPROBE_TIMEOUT) -> Dict[str, Any]:
+        """ffprobe в формате JSON (как ffmpeg.probe)"""
+        args = ['ffprobe', '-v', 'error', '-show_format', '-show_streams', '-of', 'json', str(path)]
+        out = await self._execute(args, 0, None, timeout, True)
+        return json.loads(out.decode('utf-8', errors='ignore'))
+
+    async def _execute(self, args: List[str], duration: float, on_progress: Optional[ProgressCallback], timeout: float, capture_stdout: bool, on_peak_rss: Optional[Callable[[int], None]] = None, stdout_sink: Optional[Callable[[bytes], Awaitable[None]]] = None) -> bytes:
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE if capture_stdout or stdout_sink else asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        stderr_tail: deque = deque(maxlen=20)
+
+        async def read_stdout() -> bytes:
+            if stdout_sink:
+                while True:
+                    chunk = await process.stdout.read(_STDOUT_CHUNK)
+                    if not chunk:
+                        return b''
+                    await stdout_sink(chunk)
+            return await process.stdout.read() if capture_stdout else b''
+
+        async def read_stderr() -> None:
+            buffer = b''
+            while True:
+                chunk = await process.stderr.read(4096)
+                if not chunk:
+                    break
+                # Строки статистики ffmpeg разделены '\r', обычные сообщения — '\n'
+                *lines, buffer = re.split(rb'[\r\n]', buffer + chunk)
+                for raw in lines:
+                    line = raw.decode('utf-8', errors='ignore').strip()
+                    if line:
+                        stderr_tail.append(line)
+                        await self._report(line, duration, on_progress)
+            if buffer.strip():
+                stderr_tail.append(buffer.decode('utf-8', errors='ignore').strip())
+
+        async def communicate():
+            out, _ = await asyncio.gather(read_stdout(), read_stderr())
+            return out, await process.wait()
+
+        async def sample_rss() -> None:
+            # VmHWM — пик RSS с момента запуска; после выхода процесса он недоступен, поэтому опрашиваем
+            while process.returncode is None:
+                peak = process_peak_rss(process.pid)
+                if peak:
+                    on_peak_rss(peak)
+                await asyncio.sleep(0.5)
+
+        sampler = asyncio.ensure_future(sample_rss()) if on_peak_rss else None
+        try:
+            out, returncode = await asyncio.wait_for(communicate(), timeout)
+        except asyncio.TimeoutError:
+            await self._kill(process)
+            raise FFmpegTimeout(f"{args[0]} остановлен по таймауту ({timeout:.0f} с)", stderr='\n'.join(stderr_tail))
+        except BaseException:
+            # Отмена задачи (или ошибка колбэка): процесс не должен пережить корутину
+            await self._kill(process)
+            raise
+        finally:
+            if sampler:
+                sampler.cancel()
+        if returncode != 0:
+            stderr = '\n'.join(stderr_tail)
+            raise FFmpegError(f"{args[0]} завершился с кодом {returncode}: {stderr[-300:]}", returncode, stderr)
+        return out
+
+    @staticmethod
+    async def _report(line: str, duration: float, on_progress: Optional[ProgressCallback]) -> None:
+        if not on_progress:
+            return
+        match = _TIME_RE.search(line)
+        if not match:
+            return
+        h, m, s = match.groups()
+        current = int(h) * 3600 + int(m) * 60 + float(s)
+        percent = min(current / duration * 100, 100.0) if duration else 0.0
+        try:
+            result = on_progress(FFmpegProgress(current, duration, percent))
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            logger.debug(f"Ошибка обработчика прогресса ffmpeg: {e}")
+
+    @staticmethod
+    async def _kill(process: asyncio.subprocess.Process) -> None:
+        if process.returncode is None:
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+            await process.wait()
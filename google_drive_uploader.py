@@ -1,78 +1,296 @@
 import base64
+import logging
 import os
 import pickle
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+import httplib2
 from google.auth.transport.requests import Request
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
-from config import GOOGLE_OAUTH_TOKEN_BASE64, TOKEN_PICKLE_FILE
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaFileUpload, MediaUpload
+from config import (
+    GOOGLE_OAUTH_TOKEN_BASE64, TOKEN_PICKLE_FILE, DRIVE_SHARE_MODE, DRIVE_UPLOAD_CHUNK_SIZE,
+    DRIVE_RETRIES, DRIVE_RETRY_MAX_DELAY, DRIVE_API_ENDPOINT,
+)
+from executors import upload_executor
+
+logger = logging.getLogger(__name__)
 
 SCOPES = ['https://www.googleapis.com/auth/drive']
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+ANYONE_READER = {'type': 'anyone', 'role': 'reader'}
+# Ограничение Drive API на число запросов в одном batch
+BATCH_LIMIT = 100
 
-def get_gdrive_service():
-    creds = None
-    if os.path.exists(TOKEN_PICKLE_FILE):
-        with open(TOKEN_PICKLE_FILE, 'rb') as token:
-            creds = pickle.load(token)
-
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
+_TRANSIENT_STATUSES = {408, 429, 500, 502, 503, 504}
+_FILE_ID_PATTERNS = [
+    re.compile(r"/file/d/([a-zA-Z0-9_-]+)"),
+    re.compile(r"[?&]id=([a-zA-Z0-9_-]+)"),
+]
+
+
+def is_transient(error: BaseException) -> bool:
+    """Временная ошибка, после которой имеет смысл повторить запрос"""
+    if isinstance(error, HttpError):
+        if error.resp.status in _TRANSIENT_STATUSES:
+            return True
+        return error.resp.status == 403 and b'ratelimitexceeded' in (error.content or b'').lower()
+    return isinstance(error, (OSError, httplib2.HttpLib2Error))
+
+
+def backoff_delay(attempt: int) -> float:
+    """Экспоненциальная задержка со случайным разбросом перед повтором номер `attempt`"""
+    return min(2 ** attempt, DRIVE_RETRY_MAX_DELAY) * random.uniform(0.5, 1.0)
+
+
+def drive_file_id(link: str) -> Optional[str]:
+    """ID файла из ссылки Google Drive (просмотр или прямое скачивание)"""
+    for pattern in _FILE_ID_PATTERNS:
+        m = pattern.search(link or '')
+        if m:
+            return m.group(1)
+    return None
+
+
+class DriveUploader:
+    """Долгоживущий клиент Google Drive для загрузки клипов.
+
+    Учётные данные читаются из token.pickle один раз и обновляются только по
+    истечении срока (под блокировкой, с записью обратно в файл). У каждого потока
+    пула загрузок свой клиент API: httplib2 внутри него не потокобезопасен. ID папок
+    кэшируются по имени, папка ищется и создаётся один раз под блокировкой этого имени.
+    Время каждого вызова API накапливается в stats().
+
+    Файлы грузятся resumable-сессиями кусками по DRIVE_UPLOAD_CHUNK_SIZE; при временной
+    ошибке загрузка после паузы продолжается с последнего принятого сервером байта.
+    Доступ по ссылке открывается на папку (файлы его наследуют) или пачкой на файлы.
+    Адрес API и учётные данные можно подменить — например, для локального тестового сервера.
+    """
+
+    def __init__(self, token_file: str = TOKEN_PICKLE_FILE, api_endpoint: str = DRIVE_API_ENDPOINT, share_mode: str = DRIVE_SHARE_MODE, credentials=None):
+        self.token_file = token_file
+        self.api_endpoint = api_endpoint
+        self.share_mode = share_mode
+        self._creds = credentials
+        self._creds_lock = threading.Lock()
+        self._local = threading.local()
+        self._folders: Dict[str, str] = {}
+        self._folder_locks: Dict[str, threading.Lock] = {}
+        self._folders_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._latency: Dict[str, Dict[str, float]] = {}
+
+    # ----- учётные данные и клиент -----
+
+    def _load_credentials(self):
+        if os.path.exists(self.token_file):
+            with open(self.token_file, 'rb') as token:
+                creds = pickle.load(token)
+            if creds and (creds.valid or creds.refresh_token):
+                return creds
+        if GOOGLE_OAUTH_TOKEN_BASE64:
+            creds = pickle.loads(base64.b64decode(GOOGLE_OAUTH_TOKEN_BASE64))
         else:
-            if GOOGLE_OAUTH_TOKEN_BASE64:
-                token_data = base64.b64decode(GOOGLE_OAUTH_TOKEN_BASE64)
-                with open(TOKEN_PICKLE_FILE, 'wb') as token:
-                    token.write(token_data)
-                with open(TOKEN_PICKLE_FILE, 'rb') as token:
-                    creds = pickle.load(token)
-            else:
-                # This part should not be reached if the token is in .env
-                # It's a fallback to the old flow.
-                flow = InstalledAppFlow.from_client_secrets_file(
-                    'credentials.json', SCOPES)
-                creds = flow.run_local_server(port=0)
+            # Запасной вариант: интерактивная авторизация (токен обычно задан в .env)
+            flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
+            creds = flow.run_local_server(port=0)
+        self._save_credentials(creds)
+        return creds
 
-        with open(TOKEN_PICKLE_FILE, 'wb') as token:
+    def _save_credentials(self, creds) -> None:
+        with open(self.token_file, 'wb') as token:
             pickle.dump(creds, token)
 
-    return build('drive', 'v3', credentials=creds)
+    def credentials(self):
+        """Действующие учётные данные; обновляются, только если срок истёк"""
+        with self._creds_lock:
+            if self._creds is None:
+                with self._timed('load_credentials'):
+                    self._creds = self._load_credentials()
+            if not self._creds.valid:
+                if getattr(self._creds, 'refresh_token', None):
+                    with self._timed('refresh_token'):
+                        self._creds.refresh(Request())
+                    self._save_credentials(self._creds)
+                else:
+                    self._creds = self._load_credentials()
+            return self._creds
+
+    def service(self):
+        """Клиент Drive API текущего потока"""
+        creds = self.credentials()
+        if getattr(self._local, 'creds', None) is not creds:
+            with self._timed('build_client'):
+                client_options = {'api_endpoint': self.api_endpoint} if self.api_endpoint else None
+                self._local.service = build('drive', 'v3', credentials=creds, cache_discovery=False, client_options=client_options)
+            self._local.creds = creds
+        return self._local.service
+
+    # ----- папки -----
+
+    def folder_id(self, folder_name: str) -> str:
+        """ID папки по имени (из кэша; при первом обращении — поиск или создание)"""
+        cached = self._folders.get(folder_name)
+        if cached:
+            return cached
+        with self._folders_lock:
+            lock = self._folder_locks.setdefault(folder_name, threading.Lock())
+        with lock:
+            cached = self._folders.get(folder_name)
+            if cached:
+                return cached
+            service = self.service()
+            escaped = folder_name.replace('\\', '\\\\').replace("'", "\\'")
+            query = f"mimeType='{FOLDER_MIME_TYPE}' and name='{escaped}' and trashed=false"
+            with self._timed('find_folder'):
+                response = service.files().list(q=query, spaces='drive', fields='files(id, name)').execute(num_retries=DRIVE_RETRIES)
+            if response.get('files'):
+                folder_id = response['files'][0]['id']
+            else:
+                with self._timed('create_folder'):
+                    folder = service.files().create(body={'name': folder_name, 'mimeType': FOLDER_MIME_TYPE}, fields='id').execute(num_retries=DRIVE_RETRIES)
+                folder_id = folder['id']
+            if self.share_mode == 'folder':
+                # Один вызов на папку вместо вызова на каждый клип: файлы наследуют доступ папки
+                with self._timed('share_folder'):
+                    service.permissions().create(fileId=folder_id, body=ANYONE_READER).execute(num_retries=DRIVE_RETRIES)
+            self._folders[folder_name] = folder_id
+            return folder_id
+
+    def forget_folder(self, folder_name: str) -> None:
+        self._folders.pop(folder_name, None)
+
+    # ----- загрузка -----
+
+    def upload(self, file_path: str, folder_name: str) -> Optional[str]:
+        """Загрузить файл в папку, открыть доступ по ссылке и вернуть webViewLink"""
+        file = self.upload_file(file_path, folder_name)
+        if self.share_mode != 'folder':
+            self.share_files([file['id']])
+        return file.get('webViewLink')
+
+    def upload_file(self, file_path: str, folder_name: str) -> Dict[str, Any]:
+        """Загрузить файл в папку (без отдельной настройки доступа); возвращает id и webViewLink"""
+        media = MediaFileUpload(file_path, resumable=True, chunksize=DRIVE_UPLOAD_CHUNK_SIZE)
+        return self._upload_media(os.path.basename(file_path), media, folder_name)
+
+    def upload_stream(self, media: MediaUpload, name: str, folder_name: str) -> Dict[str, Any]:
+        """Загрузить в папку данные из потока (например, PipeMediaUpload) под именем `name`"""
+        return self._upload_media(name, media, folder_name)
+
+    def _upload_media(self, name: str, media: MediaUpload, folder_name: str) -> Dict[str, Any]:
+        started = time.monotonic()
+        try:
+            file = self._create_file(name, media, self.folder_id(folder_name))
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
+            # Папку удалили вручную — кэш устарел, ищем или создаём заново.
+            # 404 приходит при открытии сессии, до чтения данных, поэтому тот же источник можно отправить снова
+            logger.info(f"Папка {folder_name} не найдена на Google Drive, создаём заново")
+            self.forget_folder(folder_name)
+            file = self._create_file(name, media, self.folder_id(folder_name))
+        logger.info(f"Загружен {name} (ID {file['id']}) за {time.monotonic() - started:.1f} с")
+        return file
+
+    def _create_file(self, name: str, media: MediaUpload, folder_id: str) -> Dict[str, Any]:
+        request = self.service().files().create(body={'name': name, 'parents': [folder_id]}, media_body=media, fields='id, webViewLink')
+        response = None
+        attempt = 0
+        with self._timed('upload_file'):
+            while response is None:
+                try:
+                    # После сбоя тот же запрос сначала спрашивает у сервера, сколько байт принято, и продолжает с них
+                    _, response = request.next_chunk()
+                    attempt = 0
+                except Exception as e:
+                    if not is_transient(e) or attempt >= DRIVE_RETRIES:
+                        raise
+                    attempt += 1
+                    delay = backoff_delay(attempt)
+                    logger.warning(f"Сбой загрузки {name}: {e}; продолжаем через {delay:.1f} с ({attempt}/{DRIVE_RETRIES})")
+                    time.sleep(delay)
+        return response
+
+    def share_files(self, file_ids: List[str]) -> None:
+        """Открыть доступ по ссылке к файлам batch-запросами (до BATCH_LIMIT файлов за запрос)"""
+        if not file_ids:
+            return
+        service = self.service()
+        failed: Dict[str, Exception] = {}
+
+        def on_response(request_id: str, _response, exception: Optional[Exception]) -> None:
+            if exception is not None:
+                failed[request_id] = exception
+
+        for start in range(0, len(file_ids), BATCH_LIMIT):
+            batch = service.new_batch_http_request(callback=on_response)
+            for file_id in file_ids[start:start + BATCH_LIMIT]:
+                batch.add(service.permissions().create(fileId=file_id, body=ANYONE_READER), request_id=file_id)
+            with self._timed('share_batch'):
+                self._with_retries(batch.execute, 'share_batch')
+        # Отдельные неудачи внутри пачки повторяем поштучно
+        for file_id, error in failed.items():
+            logger.warning(f"Не удалось открыть доступ к {file_id} в пачке ({error}), повторяем отдельно")
+            with self._timed('set_permission'):
+                service.permissions().create(fileId=file_id, body=ANYONE_READER).execute(num_retries=DRIVE_RETRIES)
+
+    @staticmethod
+    def _with_retries(call: Callable[[], Any], operation: str) -> Any:
+        for attempt in range(DRIVE_RETRIES + 1):
+            try:
+                return call()
+            except Exception as e:
+                if not is_transient(e) or attempt == DRIVE_RETRIES:
+                    raise
+                delay = backoff_delay(attempt + 1)
+                logger.warning(f"Сбой {operation}: {e}; повтор через {delay:.1f} с")
+                time.sleep(delay)
+
+    # ----- метрики -----
+
+    @contextmanager
+    def _timed(self, operation: str):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            with self._stats_lock:
+                stat = self._latency.setdefault(operation, {'calls': 0, 'total': 0.0, 'max': 0.0})
+                stat['calls'] += 1
+                stat['total'] += elapsed
+                stat['max'] = max(stat['max'], elapsed)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Число вызовов, среднее и максимальное время (секунды) по каждой операции API"""
+        with self._stats_lock:
+            return {op: {'calls': s['calls'], 'avg': s['total'] / s['calls'], 'max': s['max']} for op, s in self._latency.items()}
+
+    def format_stats(self) -> str:
+        return '; '.join(f"{op}: {s['calls']} выз., ср. {s['avg']:.2f} с, макс. {s['max']:.1f} с" for op, s in self.stats().items())
+
+
+drive_uploader = DriveUploader()
+
+
+def get_gdrive_service():
+    """Клиент Drive API текущего потока (совместимость со старым кодом)"""
+    return drive_uploader.service()
 
 def upload_to_drive(file_path, folder_name):
-    service = get_gdrive_service()
-
-    # Check if folder exists, create if not
-    folder_id = None
-    query = f"mimeType='application/vnd.google-apps.folder' and name='{folder_name}' and trashed=false"
-    response = service.files().list(q=query, spaces='drive', fields='files(id, name)').execute()
-    if not response.get('files'):
-        file_metadata = {
-            'name': folder_name,
-            'mimeType': 'application/vnd.google-apps.folder'
-        }
-        folder = service.files().create(body=file_metadata, fields='id').execute()
-        folder_id = folder.get('id')
-    else:
-        folder_id = response.get('files')[0].get('id')
-
-    # Upload the file
-    file_metadata = {
-        'name': os.path.basename(file_path),
-        'parents': [folder_id]
-    }
-    media = MediaFileUpload(file_path, resumable=True)
-    print(f"Uploading {os.path.basename(file_path)} to Google Drive...")
-    file = service.files().create(body=file_metadata, media_body=media, fields='id, webViewLink').execute()
-    file_id = file.get('id')
-    print(f"File ID: {file_id}")
-
-    # Set permissions to anyone with the link
-    permission = {
-        'type': 'anyone',
-        'role': 'reader'
-    }
-    service.permissions().create(fileId=file_id, body=permission).execute()
-
-    return file.get('webViewLink')
+    return drive_uploader.upload(file_path, folder_name)
+
+async def upload_to_drive_async(file_path, folder_name):
+    """upload_to_drive в пуле потоков для загрузок, не блокируя цикл событий"""
+    return await upload_executor.run(upload_to_drive, file_path, folder_name)
 
 if __name__ == '__main__':
     # Example usage:
@@ -81,3 +299,4 @@ if __name__ == '__main__':
         f.write("This is a test file.")
     upload_to_drive("test_upload.txt", "Test Folder")
     os.remove("test_upload.txt")
+    print(drive_uploader.format_stats())
@@ -0,0 +1,230 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+from config import (
+    JOB_WORKERS, JOB_QUEUE_MAX, JOB_QUEUE_MAX_PER_CHAT, JOB_DEFAULT_DURATION,
+    JOB_SCHEDULER_POLICY, JOB_SJF_AGING, JOB_DEADLINE_BASE, JOB_DEADLINE_FACTOR,
+)
+
+logger = logging.getLogger(__name__)
+
+PositionCallback = Callable[[int, float], Awaitable[None]]
+
+POLICIES = ('fair', 'sjf', 'deadline')
+
+
+class QueueFull(Exception):
+    """Очередь задач переполнена (общий лимит или лимит чата)"""
+
+    def __init__(self, message: str, per_chat: bool = False):
+        super().__init__(message)
+        self.per_chat = per_chat
+
+
+class Job:
+    _ids = itertools.count(1)
+
+    def __init__(self, chat_id: int, factory: Callable[[], Awaitable[Any]], on_position: Optional[PositionCallback] = None, cost: Optional[float] = None):
+        self.id = next(self._ids)
+        self.chat_id = chat_id
+        self.factory = factory
+        self.on_position = on_position
+        # Прогноз длительности (секунды); None — неизвестен, берётся средняя
+        self.cost = cost
+        self.enqueued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.future: asyncio.Future = asyncio.get_event_loop().create_future()
+        self._last_notified: Optional[int] = None
+
+
+class JobScheduler:
+    """Ограниченная очередь задач с фиксированным числом слотов и справедливостью между чатами.
+
+    Задачи разных чатов выдаются по кругу (round-robin), поэтому десять ссылок от
+    одного пользователя не задерживают остальных. Ожидающим сообщается позиция в
+    очереди и оценка времени старта по прогнозу длительности задач.
+
+    Политики 'sjf' и 'deadline' выдают задачи по прогнозу длительности, чтобы
+    короткие видео не ждали за многочасовыми: 'sjf' — сначала самые короткие
+    (с поправкой на время ожидания), 'deadline' — по ближайшему сроку, который
+    тем дальше, чем длиннее задача. Лимиты на чат действуют при любой политике.
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, max_queue: int = JOB_QUEUE_MAX, max_per_chat: int = JOB_QUEUE_MAX_PER_CHAT, policy: str = JOB_SCHEDULER_POLICY):
+        if policy not in POLICIES:
+            logger.warning(f"Неизвестная политика очереди {policy!r}, используется 'fair'")
+            policy = 'fair'
+        self.policy = policy
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_per_chat = max_per_chat
+        self._queues: 'OrderedDict[int, Deque[Job]]' = OrderedDict()
+        self._running: Dict[int, Job] = {}
+        self._avg_duration = float(JOB_DEFAULT_DURATION)
+        self._wakeup: Optional[asyncio.Event] = None
+        self._space_freed: Optional[asyncio.Event] = None
+        self._worker_tasks: List[asyncio.Task] = []
+
+    # ----- постановка в очередь -----
+
+    def queued_count(self, chat_id: Optional[int] = None) -> int:
+        if chat_id is not None:
+            return len(self._queues.get(chat_id, ()))
+        return sum(len(q) for q in self._queues.values())
+
+    def submit(self, chat_id: int, factory: Callable[[], Awaitable[Any]], on_position: Optional[PositionCallback] = None, cost: Optional[float] = None) -> Job:
+        """Поставить задачу в очередь. Бросает QueueFull, если очередь заполнена."""
+        self._ensure_workers()
+        if self.queued_count() >= self.max_queue:
+            raise QueueFull("Очередь задач заполнена")
+        running_for_chat = sum(1 for job in self._running.values() if job.chat_id == chat_id)
+        if self.queued_count(chat_id) + running_for_chat >= self.max_per_chat:
+            raise QueueFull("Слишком много задач от одного чата", per_chat=True)
+        job = Job(chat_id, factory, on_position, cost)
+        self._queues.setdefault(chat_id, deque()).append(job)
+        self._wakeup.set()
+        self._notify_positions()
+        return job
+
+    async def run(self, chat_id: int, factory: Callable[[], Awaitable[Any]], on_position: Optional[PositionCallback] = None, cost: Optional[float] = None) -> Any:
+        """Поставить задачу в очередь и дождаться её результата"""
+        job = self.submit(chat_id, factory, on_position, cost)
+        return await job.future
+
+    async def run_when_possible(self, chat_id: int, factory: Callable[[], Awaitable[Any]], on_position: Optional[PositionCallback] = None, cost: Optional[float] = None) -> Any:
+        """Как run(), но при заполненной очереди ждёт места вместо отказа (для пакетов)"""
+        while True:
+            try:
+                job = self.submit(chat_id, factory, on_position, cost)
+                break
+            except QueueFull:
+                self._space_freed.clear()
+                await self._space_freed.wait()
+        return await job.future
+
+    # ----- порядок и оценки -----
+
+    def _duration(self, job: Job) -> float:
+        return job.cost if job.cost is not None else self._avg_duration
+
+    def _priority(self, job: Job, now: float) -> float:
+        if self.policy == 'sjf':
+            # Старение: долго ждущая длинная задача постепенно обгоняет новые короткие
+            return self._duration(job) - JOB_SJF_AGING * (now - job.enqueued_at)
+        return job.enqueued_at + JOB_DEADLINE_BASE + JOB_DEADLINE_FACTOR * self._duration(job)
+
+    def _dispatch_order(self) -> List[Job]:
+        """Порядок, в котором задачи будут выданы слотам"""
+        if self.policy != 'fair':
+            now = time.monotonic()
+            return sorted((job for q in self._queues.values() for job in q), key=lambda job: (self._priority(job, now), job.id))
+        # По кругу между чатами
+        queues = [list(q) for q in self._queues.values()]
+        order = []
+        for round_jobs in itertools.zip_longest(*queues):
+            order.extend(job for job in round_jobs if job is not None)
+        return order
+
+    def position(self, job: Job) -> int:
+        """Позиция задачи в очереди (1 — следующая), 0 — уже выполняется или завершена"""
+        for index, queued in enumerate(self._dispatch_order(), 1):
+            if queued is job:
+                return index
+        return 0
+
+    def _estimated_starts(self) -> Dict[int, float]:
+        """Оценка (в секундах от текущего момента) времени старта каждой ожидающей задачи"""
+        now = time.monotonic()
+        slots = [max(self._duration(job) - (now - job.started_at), 0.0) for job in self._running.values() if job.started_at]
+        slots += [0.0] * max(self.workers - len(slots), 0)
+        starts = {}
+        for job in self._dispatch_order():
+            slots.sort()
+            start = slots[0]
+            starts[job.id] = start
+            slots[0] = start + self._duration(job)
+        return starts
+
+    def estimated_start(self, job: Job) -> float:
+        return self._estimated_starts().get(job.id, 0.0)
+
+    def _notify_positions(self) -> None:
+        starts = self._estimated_starts()
+        for index, job in enumerate(self._dispatch_order(), 1):
+            if job.on_position and job._last_notified != index:
+                job._last_notified = index
+                asyncio.ensure_future(self._safe_notify(job, index, starts.get(job.id, 0.0)))
+
+    @staticmethod
+    async def _safe_notify(job: Job, position: int, eta: float) -> None:
+        try:
+            await job.on_position(position, eta)
+        except Exception as e:
+            logger.debug(f"Ошибка уведомления о позиции задачи {job.id}: {e}")
+
+    # ----- выполнение -----
+
+    def _ensure_workers(self) -> None:
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+            self._space_freed = asyncio.Event()
+        self._worker_tasks = [t for t in self._worker_tasks if not t.done()]
+        while len(self._worker_tasks) < self.workers:
+            self._worker_tasks.append(asyncio.ensure_future(self._worker(len(self._worker_tasks))))
+
+    def _next_job(self) -> Optional[Job]:
+        if self.policy != 'fair':
+            for job in self._dispatch_order():
+                queue = self._queues[job.chat_id]
+                queue.remove(job)
+                if not queue:
+                    del self._queues[job.chat_id]
+                if not job.future.cancelled():
+                    return job
+            return None
+        for chat_id in list(self._queues):
+            queue = self._queues[chat_id]
+            job = queue.popleft()
+            # Чат уходит в конец круга; пустую очередь удаляем
+            del self._queues[chat_id]
+            if queue:
+                self._queues[chat_id] = queue
+            if job.future.cancelled():
+                continue
+            return job
+        return None
+
+    async def _worker(self, slot: int) -> None:
+        while True:
+            job = self._next_job()
+            if job is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            job.started_at = time.monotonic()
+            self._running[job.id] = job
+            self._space_freed.set()
+            self._notify_positions()
+            logger.info(f"Слот {slot}: задача {job.id} (чат {job.chat_id}) запущена, ждала {job.started_at - job.enqueued_at:.0f} с")
+            try:
+                result = await job.factory()
+                if not job.future.done():
+                    job.future.set_result(result)
+            except asyncio.CancelledError:
+                if not job.future.done():
+                    job.future.cancel()
+                raise
+            except Exception as e:
+                logger.error(f"Задача {job.id} завершилась с ошибкой: {e}")
+                if not job.future.done():
+                    job.future.set_exception(e)
+            finally:
+                self._running.pop(job.id, None)
+                self._space_freed.set()
+                elapsed = time.monotonic() - job.started_at
+                # Скользящее среднее длительности для оценки времени старта
+                self._avg_duration = 0.8 * self._avg_duration + 0.2 * elapsed
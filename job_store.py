@@ -0,0 +1,266 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from config import JOB_STORE_PATH
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    settings TEXT NOT NULL,
+    flight_key TEXT NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    message_id INTEGER,
+    worker TEXT,
+    heartbeat_at REAL,
+    progress TEXT,
+    result TEXT,
+    batch_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status);
+CREATE TABLE IF NOT EXISTS stages (
+    flight_key TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    item TEXT NOT NULL,
+    artefact TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (flight_key, stage, item)
+);
+CREATE TABLE IF NOT EXISTS stage_timings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    stage TEXT NOT NULL,
+    host TEXT NOT NULL,
+    x REAL NOT NULL,
+    seconds REAL NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS stage_timings_stage ON stage_timings(stage, host);
+"""
+
+# Колонки, добавленные после первой версии схемы (для уже существующих баз)
+_JOB_COLUMNS = {
+    'message_id': 'INTEGER',
+    'worker': 'TEXT',
+    'heartbeat_at': 'REAL',
+    'progress': 'TEXT',
+    'result': 'TEXT',
+    'batch_id': 'INTEGER',
+}
+
+# Статусы задач
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class JobCheckpoint:
+    """Контрольные точки этапов одной задачи (скачивание, нарезка, транскрибация и т. д.).
+
+    Этапы привязаны к ключу single-flight, а не к чату: после перезапуска любой из
+    участников, ставший ведущим, продолжит с последнего завершённого этапа.
+    """
+
+    def __init__(self, store: 'JobStore', flight_key: str):
+        self.store = store
+        self.flight_key = flight_key
+
+    def get(self, stage: str, item: str = '') -> Any:
+        return self.store._get_stage(self.flight_key, stage, item)
+
+    def done(self, stage: str, artefact: Any, item: str = '') -> None:
+        self.store._put_stage(self.flight_key, stage, item, artefact)
+
+    def clear(self) -> None:
+        self.store._clear_stages(self.flight_key)
+
+
+class JobStore:
+    """SQLite-хранилище задач и их этапов для продолжения работы после перезапуска.
+
+    Служит и брокером для процессов worker.py: обработчик атомарно забирает задачу
+    из очереди, продлевает аренду, пока работает, и записывает прогресс и результат.
+    Задачи упавшего обработчика возвращаются в очередь по истечении аренды.
+    """
+
+    def __init__(self, db_path: Path = JOB_STORE_PATH):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # timeout: базу одновременно используют бот и процессы worker.py
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(_SCHEMA)
+        existing = {row['name'] for row in self._conn.execute('PRAGMA table_info(jobs)')}
+        for column, column_type in _JOB_COLUMNS.items():
+            if column not in existing:
+                self._conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} {column_type}')
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        with self._lock:
+            return self._conn.execute(sql, params)
+
+    def _query(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    # ----- задачи -----
+
+    @staticmethod
+    def _to_job(row: sqlite3.Row) -> Dict[str, Any]:
+        job = dict(row)
+        job['settings'] = json.loads(job['settings'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def create_job(self, chat_id: int, url: str, settings: Dict[str, Any], flight_key: str, message_id: Optional[int] = None, batch_id: Optional[int] = None) -> int:
+        """Записать задачу. `message_id` — статусное сообщение, в которое обработчик пишет прогресс;
+        `batch_id` — пакет, к которому относится видео (статусное сообщение пакета)."""
+        now = time.time()
+        cur = self._execute(
+            'INSERT INTO jobs (chat_id, url, settings, flight_key, status, created_at, updated_at, message_id, batch_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (chat_id, url, json.dumps(settings, ensure_ascii=False), flight_key, QUEUED, now, now, message_id, batch_id),
+        )
+        return cur.lastrowid
+
+    def set_status(self, job_id: int, status: str, error: Optional[str] = None, result: Any = None) -> None:
+        self._execute(
+            'UPDATE jobs SET status = ?, error = ?, result = ?, updated_at = ? WHERE id = ?',
+            (status, error, json.dumps(result, ensure_ascii=False) if result is not None else None, time.time(), job_id),
+        )
+
+    def set_progress(self, job_id: int, text: str) -> None:
+        self._execute('UPDATE jobs SET progress = ?, updated_at = ? WHERE id = ?', (text, time.time(), job_id))
+
+    def get_job(self, job_id: int) -> Optional[Dict[str, Any]]:
+        rows = self._query('SELECT * FROM jobs WHERE id = ?', (job_id,))
+        return self._to_job(rows[0]) if rows else None
+
+    def count_active(self, chat_id: Optional[int] = None) -> int:
+        """Число задач в очереди и в работе (всего или для одного чата)"""
+        if chat_id is None:
+            rows = self._query('SELECT COUNT(*) AS n FROM jobs WHERE status IN (?, ?)', (QUEUED, RUNNING))
+        else:
+            rows = self._query('SELECT COUNT(*) AS n FROM jobs WHERE status IN (?, ?) AND chat_id = ?', (QUEUED, RUNNING, chat_id))
+        return rows[0]['n']
+
+    def last_url(self, chat_id: int) -> Optional[str]:
+        """Ссылка из последней задачи чата"""
+        rows = self._query('SELECT url FROM jobs WHERE chat_id = ? ORDER BY id DESC LIMIT 1', (chat_id,))
+        return rows[0]['url'] if rows else None
+
+    def unfinished_jobs(self) -> List[Dict[str, Any]]:
+        rows = self._query('SELECT * FROM jobs WHERE status IN (?, ?) ORDER BY id', (QUEUED, RUNNING))
+        return [self._to_job(row) for row in rows]
+
+    def batch_jobs(self, chat_id: int, batch_id: int) -> List[Dict[str, Any]]:
+        """Все видео пакета в порядке постановки (и готовые, и незавершённые)"""
+        rows = self._query('SELECT * FROM jobs WHERE chat_id = ? AND batch_id = ? ORDER BY id', (chat_id, batch_id))
+        return [self._to_job(row) for row in rows]
+
+    # ----- брокер для worker.py -----
+
+    def claim_job(self, worker: str) -> Optional[Dict[str, Any]]:
+        """Атомарно забрать следующую задачу из очереди.
+
+        Первыми идут задачи чатов, у которых сейчас меньше всего задач в работе,
+        поэтому один пользователь с десятком ссылок не занимает все обработчики.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._conn.execute(
+                    'SELECT id FROM jobs AS j WHERE status = ? ORDER BY '
+                    '(SELECT COUNT(*) FROM jobs AS r WHERE r.chat_id = j.chat_id AND r.status = ?), id LIMIT 1',
+                    (QUEUED, RUNNING),
+                ).fetchone()
+                if row is None:
+                    self._conn.execute('COMMIT')
+                    return None
+                self._conn.execute(
+                    'UPDATE jobs SET status = ?, worker = ?, heartbeat_at = ?, updated_at = ? WHERE id = ?',
+                    (RUNNING, worker, now, now, row['id']),
+                )
+                claimed = self._conn.execute('SELECT * FROM jobs WHERE id = ?', (row['id'],)).fetchone()
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+        return self._to_job(claimed)
+
+    def heartbeat(self, worker: str) -> None:
+        """Продлить аренду всех задач, которые выполняет обработчик"""
+        self._execute('UPDATE jobs SET heartbeat_at = ? WHERE worker = ? AND status = ?', (time.time(), worker, RUNNING))
+
+    def requeue_stale(self, lease_seconds: float) -> int:
+        """Вернуть в очередь задачи, аренду которых давно не продлевали (обработчик упал)"""
+        cur = self._execute(
+            'UPDATE jobs SET status = ?, worker = NULL, updated_at = ? WHERE status = ? AND worker IS NOT NULL AND heartbeat_at < ?',
+            (QUEUED, time.time(), RUNNING, time.time() - lease_seconds),
+        )
+        return cur.rowcount
+
+    def release_claims(self, worker: str) -> int:
+        """Вернуть в очередь задачи обработчика при его штатной остановке"""
+        cur = self._execute(
+            'UPDATE jobs SET status = ?, worker = NULL, updated_at = ? WHERE worker = ? AND status = ?',
+            (QUEUED, time.time(), worker, RUNNING),
+        )
+        return cur.rowcount
+
+    # ----- этапы -----
+
+    def checkpoint(self, flight_key: str) -> JobCheckpoint:
+        return JobCheckpoint(self, flight_key)
+
+    def _get_stage(self, flight_key: str, stage: str, item: str) -> Any:
+        rows = self._query(
+            'SELECT artefact FROM stages WHERE flight_key = ? AND stage = ? AND item = ?', (flight_key, stage, item)
+        )
+        return json.loads(rows[0]['artefact']) if rows else None
+
+    def _put_stage(self, flight_key: str, stage: str, item: str, artefact: Any) -> None:
+        self._execute(
+            'INSERT OR REPLACE INTO stages (flight_key, stage, item, artefact, updated_at) VALUES (?, ?, ?, ?, ?)',
+            (flight_key, stage, item, json.dumps(artefact, ensure_ascii=False), time.time()),
+        )
+
+    def stage_artefacts(self, flight_key_prefix: str, stage: str) -> List[Any]:
+        """Результаты этапа у всех задач, ключ которых начинается с префикса (например, ID видео)"""
+        rows = self._query(
+            'SELECT artefact FROM stages WHERE substr(flight_key, 1, ?) = ? AND stage = ? ORDER BY updated_at DESC',
+            (len(flight_key_prefix), flight_key_prefix, stage),
+        )
+        return [json.loads(row['artefact']) for row in rows]
+
+    def _clear_stages(self, flight_key: str) -> None:
+        self._execute('DELETE FROM stages WHERE flight_key = ?', (flight_key,))
+
+    # ----- замеры этапов для модели длительности -----
+
+    def record_timing(self, stage: str, host: str, x: float, seconds: float) -> None:
+        self._execute(
+            'INSERT INTO stage_timings (stage, host, x, seconds, created_at) VALUES (?, ?, ?, ?, ?)',
+            (stage, host, x, seconds, time.time()),
+        )
+
+    def recent_timings(self, stage: str, host: str, limit: int) -> List[tuple]:
+        """Последние замеры этапа на машине: пары (объём работы, секунды), от старых к новым"""
+        rows = self._query(
+            'SELECT x, seconds FROM stage_timings WHERE stage = ? AND host = ? ORDER BY id DESC LIMIT ?',
+            (stage, host, limit),
+        )
+        return [(row['x'], row['seconds']) for row in reversed(rows)]
@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+from config import MEMORY_LIMIT_MB, MEMORY_ADMISSION_POLL
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+
+def _read_status_kb(pid, field: str) -> Optional[int]:
+    """Поле из /proc/<pid>/status в байтах (только Linux; None, если недоступно)"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def process_peak_rss(pid: int) -> Optional[int]:
+    """Пиковый RSS процесса (VmHWM)"""
+    return _read_status_kb(pid, 'VmHWM')
+
+
+def process_rss(pid: int) -> Optional[int]:
+    """Текущий RSS процесса (VmRSS)"""
+    return _read_status_kb(pid, 'VmRSS')
+
+
+def _available_memory() -> Optional[int]:
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _default_limit() -> int:
+    try:
+        total = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        total = 4096 * MB
+    return int(total * 0.75)
+
+
+class Ticket:
+    """Допуск этапа к выполнению; в него записывается измеренный пик памяти"""
+
+    def __init__(self, stage: str, estimate: int, base_estimate: int):
+        self.stage = stage
+        self.estimate = estimate
+        self.base_estimate = base_estimate
+        self.peak: Optional[int] = None
+
+    def record_peak(self, peak_bytes: Optional[int]) -> None:
+        if peak_bytes:
+            self.peak = max(self.peak or 0, peak_bytes)
+
+
+class MemoryAdmission:
+    """Допуск этапов обработки по прогнозу пикового потребления памяти.
+
+    Каждый этап (скачивание, нарезка, транскрибация, рендер, резка клипов) перед
+    стартом резервирует свою оценку пикового RSS. Если сумма резервов превысит лимит
+    или в системе не хватает свободной памяти, этап ждёт завершения других. Оценка
+    строится по разрешению, длительности и настройкам и подправляется коэффициентом,
+    который обучается на измеренных пиках прошлых запусков.
+    """
+
+    def __init__(self, limit_bytes: Optional[int] = None):
+        self.limit = limit_bytes or (MEMORY_LIMIT_MB * MB if MEMORY_LIMIT_MB else _default_limit())
+        self._reserved = 0
+        self._running = 0
+        self._factors: Dict[str, float] = {}
+        self._condition: Optional[asyncio.Condition] = None
+
+    # ----- оценка -----
+
+    def estimate(self, stage: str, width: int = 1920, height: int = 1080, duration: float = 0, settings: Optional[Dict] = None, subtitles: int = 0) -> Ticket:
+        """Прогноз пикового RSS этапа (с поправкой по прошлым замерам)"""
+        s = settings or {}
+        frame = width * height * 3 // 2            # кадр yuv420p источника
+        out_frame = 1080 * 1920 * 3 // 2            # кадр вертикального видео
+        if stage == 'render':
+            # Декодер + gblur/scale по полному кадру, lookahead x264 по выходным кадрам, drawtext на каждое слово
+            base = 150 * MB + frame * 24 + out_frame * 60 + subtitles * 512 * 1024
+            if s.get('banner', {}).get('enabled'):
+                base += frame * 16
+        elif stage == 'cut':
+            base = 100 * MB + out_frame * 60
+        elif stage == 'split':
+            base = 60 * MB
+        elif stage == 'pcm':
+            # PCM приходит в память бота: int16 из ffmpeg + float32 для Whisper
+            base = 60 * MB + int(duration * 16000 * 6)
+        elif stage == 'transcribe':
+            base = 250 * MB + int(duration * 16000 * 4)
+        elif stage == 'download':
+            base = 250 * MB
+        else:
+            base = 100 * MB
+        factor = self._factors.get(stage, 1.0)
+        return Ticket(stage, int(base * factor), base)
+
+    def _calibrate(self, ticket: Ticket) -> None:
+        if not ticket.peak or not ticket.base_estimate:
+            return
+        ratio = ticket.peak / ticket.base_estimate
+        previous = self._factors.get(ticket.stage, 1.0)
+        # Скользящее среднее с запасом 20% сверху, в разумных пределах
+        self._factors[ticket.stage] = min(max(0.8 * previous + 0.2 * ratio * 1.2, 0.25), 4.0)
+        logger.debug(f"Память этапа {ticket.stage}: прогноз {ticket.estimate / MB:.0f} MB, пик {ticket.peak / MB:.0f} MB")
+
+    # ----- допуск -----
+
+    def _fits(self, size: int) -> bool:
+        if self._running == 0:
+            # Единственный этап допускаем всегда, даже если оценка больше лимита
+            return True
+        if self._reserved + size > self.limit:
+            return False
+        available = _available_memory()
+        return available is None or size <= available
+
+    @asynccontextmanager
+    async def admit(self, ticket: Ticket, measure_self: bool = False):
+        """Дождаться допуска этапа; `measure_self` — этап выполняется в этом процессе (замер по RSS бота)"""
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            waited = False
+            while not self._fits(ticket.estimate):
+                if not waited:
+                    logger.info(f"Этап {ticket.stage} ждёт памяти: нужно {ticket.estimate / MB:.0f} MB, занято {self._reserved / MB:.0f} из {self.limit / MB:.0f} MB")
+                    waited = True
+                try:
+                    # Свободная память меняется и вне бота, поэтому перепроверяем периодически
+                    await asyncio.wait_for(self._condition.wait(), MEMORY_ADMISSION_POLL)
+                except asyncio.TimeoutError:
+                    pass
+            self._reserved += ticket.estimate
+            self._running += 1
+        sampler = asyncio.ensure_future(self._sample_self(ticket)) if measure_self else None
+        try:
+            yield ticket
+        finally:
+            if sampler:
+                sampler.cancel()
+            self._calibrate(ticket)
+            async with self._condition:
+                self._reserved -= ticket.estimate
+                self._running -= 1
+                self._condition.notify_all()
+
+    @staticmethod
+    async def _sample_self(ticket: Ticket) -> None:
+        baseline = _read_status_kb('self', 'VmRSS')
+        if baseline is None:
+            return
+        while True:
+            await asyncio.sleep(0.5)
+            current = _read_status_kb('self', 'VmRSS')
+            if current is not None:
+                ticket.record_peak(current - baseline)
+
+    def stats(self) -> Dict[str, float]:
+        return {'limit': self.limit, 'reserved': self._reserved, 'running': self._running, **{f'factor_{k}': v for k, v in self._factors.items()}}
@@ -0,0 +1,109 @@
+import asyncio
+import threading
+from typing import Optional
+
+from googleapiclient.http import MediaUpload
+
+from config import DRIVE_UPLOAD_CHUNK_SIZE, UPLOAD_STREAM_BUFFER, UPLOAD_STREAM_TIMEOUT
+
+
+class PipeMediaUpload(MediaUpload):
+    """Источник resumable-загрузки из потока байт неизвестной длины (stdout энкодера).
+
+    Пишет в буфер асинхронный производитель (`await write(data)`), читает поток
+    загрузки через getbytes(). Буфер ограничен `max_buffer` байтами: когда он полон,
+    write() ждёт, ffmpeg упирается в полный pipe и притормаживает. Байты до последнего
+    запрошенного смещения выбрасываются — сервер их уже подтвердил, а после сбоя
+    загрузка продолжается не раньше этого места. Короткий ответ getbytes() означает
+    конец потока (так googleapiclient узнаёт итоговый размер). Если за `timeout` секунд
+    производитель не дал нужных данных, getbytes() прерывает поток, чтобы не занимать
+    поток загрузки вечно.
+    """
+
+    def __init__(self, mimetype: str = 'video/mp4', chunksize: int = DRIVE_UPLOAD_CHUNK_SIZE, max_buffer: int = UPLOAD_STREAM_BUFFER, timeout: float = UPLOAD_STREAM_TIMEOUT):
+        self._mimetype = mimetype
+        self._timeout = timeout
+        self._chunksize = chunksize
+        # Нужен хотя бы один полный кусок плюс запас, чтобы производитель не ждал каждый кусок
+        self._max_buffer = max(max_buffer, 2 * chunksize)
+        self._buffer = bytearray()
+        self._offset = 0  # смещение в потоке первого байта буфера
+        self._closed = False
+        self._error: Optional[BaseException] = None
+        self._cond = threading.Condition()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._space: Optional[asyncio.Event] = None
+
+    # ----- интерфейс MediaUpload (поток загрузки) -----
+
+    def chunksize(self) -> int:
+        return self._chunksize
+
+    def mimetype(self) -> str:
+        return self._mimetype
+
+    def size(self) -> Optional[int]:
+        return None
+
+    def resumable(self) -> bool:
+        return True
+
+    def has_stream(self) -> bool:
+        return False
+
+    def getbytes(self, begin: int, length: int) -> bytes:
+        with self._cond:
+            if begin < self._offset:
+                raise IOError(f"Поток уже отдан с {self._offset} байта, повтор с {begin} невозможен")
+            del self._buffer[:begin - self._offset]
+            self._offset = begin
+            self._wake_writer()
+            ready = self._cond.wait_for(
+                lambda: len(self._buffer) >= length or self._closed or self._error is not None,
+                self._timeout,
+            )
+            if not ready:
+                self._error = TimeoutError(f"Нет данных от энкодера дольше {self._timeout} с")
+                self._wake_writer()
+            if self._error is not None:
+                raise self._error
+            return bytes(self._buffer[:length])
+
+    def to_json(self) -> str:
+        raise NotImplementedError('Поток из pipe нельзя сериализовать')
+
+    # ----- производитель (цикл событий) -----
+
+    async def write(self, data: bytes) -> None:
+        """Добавить данные; ждёт, пока в буфере не появится место"""
+        if self._space is None:
+            self._loop = asyncio.get_running_loop()
+            self._space = asyncio.Event()
+        while True:
+            with self._cond:
+                if self._error is not None:
+                    raise self._error
+                if len(self._buffer) < self._max_buffer:
+                    self._buffer += data
+                    self._cond.notify_all()
+                    return
+                self._space.clear()
+            await self._space.wait()
+
+    def close(self) -> None:
+        """Конец потока: загрузка дочитает буфер и завершится"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def abort(self, error: BaseException) -> None:
+        """Прервать обе стороны: getbytes() и write() бросят `error`"""
+        with self._cond:
+            if self._error is None:
+                self._error = error
+            self._cond.notify_all()
+            self._wake_writer()
+
+    def _wake_writer(self) -> None:
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._space.set)
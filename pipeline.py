@@ -0,0 +1,402 @@
+import asyncio
+import logging
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from telegram.constants import ParseMode
+from telegram.error import BadRequest
+
+from config import DOWNLOAD_DIR, COOKIES_FILE, MAX_FILE_SIZE, PROGRESSIVE_DELIVERY, DEFAULT_TOP_HEADER, DEFAULT_BOTTOM_HEADER, DIRECT_STREAM_INPUT, DIRECT_STREAM_MIN_DURATION
+from youtube_downloader import YouTubeDownloader
+from video_processor_fast import FastVideoProcessor
+from user_settings import get_value, settings_fingerprint
+from single_flight import SingleFlight
+from workspace import WorkspaceManager, Workspace, WorkspaceUnavailable
+from job_store import JobStore, JobCheckpoint, RUNNING, DONE, FAILED
+from cost_model import CostModel
+from clip_delivery import ClipDelivery, ClipFeed
+from stage_cache import StageRun, stage_cache
+
+logger = logging.getLogger(__name__)
+
+# Конвейер обработки видео: общий для бота (режим JOB_BROKER=local) и процессов worker.py
+
+# База задач: контрольные точки этапов, продолжение после перезапуска и брокер для worker.py
+job_store = JobStore()
+# Модель длительности этапов, обучается на замерах из базы задач
+cost_model = CostModel(job_store)
+
+# Инициализация загрузчика и процессора
+downloader = YouTubeDownloader(DOWNLOAD_DIR, COOKIES_FILE)
+processor = FastVideoProcessor(DOWNLOAD_DIR / 'temp', cost_model=cost_model)
+# Рабочие папки задач (внутри папки временных файлов процессора)
+workspaces = WorkspaceManager(processor.temp_dir)
+
+# Объединение одинаковых одновременных задач между чатами
+job_flight = SingleFlight('job')
+download_flight = SingleFlight('download')
+# Готовые клипы выполняемых задач (для выдачи по готовности всем участникам задачи)
+clip_feeds: Dict[tuple, ClipFeed] = {}
+
+# Регулярное выражение для YouTube URL
+YOUTUBE_URL_PATTERN = re.compile(
+    r'(https?://)?(www\.)?(youtube|youtu|youtube-nocookie)\.(com|be)/'
+    r'(watch\?v=|embed/|v/|.+\?v=)?([^&=%\?]{11})'
+)
+
+DEFAULT_TIMELINE = 30
+
+
+class DownloadError(Exception):
+    """Видео не удалось скачать"""
+
+
+def extract_video_id(url: str) -> Optional[str]:
+    """Достать ID видео из YouTube URL"""
+    m = YOUTUBE_URL_PATTERN.search(url)
+    return m.group(6) if m else None
+
+def format_eta(seconds: float) -> str:
+    """Человекочитаемая оценка времени"""
+    if seconds < 60:
+        return "меньше минуты"
+    minutes = int(round(seconds / 60))
+    if minutes < 60:
+        return f"~{minutes} мин"
+    return f"~{minutes // 60} ч {minutes % 60:02d} мин"
+
+def predict_job(info: Optional[Dict], settings: dict, downloaded: bool = False) -> Optional[Dict[str, float]]:
+    """Прогноз длительности этапов по метаданным видео (yt-dlp или resolve_stream)"""
+    if not info or not info.get('duration'):
+        return None
+    return cost_model.predict(
+        float(info['duration']), int(info.get('width') or 1920), int(info.get('height') or 1080), settings, downloaded=downloaded
+    )
+
+async def estimate_job(url: str, chat_id: int, settings: dict) -> Optional[float]:
+    """Прогноз полной длительности задачи в секундах (None, если метаданные недоступны)"""
+    prediction = predict_job(await downloader.get_video_info(url, chat_id), settings)
+    return prediction['total'] if prediction else None
+
+def _with_eta(report, prediction: Optional[Dict[str, float]]):
+    """Дописывать к сообщениям о прогрессе оставшееся по прогнозу время"""
+    if not prediction:
+        return report
+    started = time.monotonic()
+
+    async def report_eta(text: str) -> None:
+        remaining = prediction['total'] - (time.monotonic() - started)
+        await report(f"{text}\n\n⏱ <b>Осталось примерно:</b> {format_eta(remaining) if remaining > 0 else 'почти готово'}")
+
+    return report_eta
+
+async def _run_video_job(url: str, chat_id: int, settings: dict, report, workspace: Workspace, checkpoint: JobCheckpoint, download_limit: Optional[asyncio.Semaphore] = None, allow_zip: bool = True, on_clip=None, stages: Optional[StageRun] = None) -> Optional[str]:
+    """Скачивание и обработка одного видео. Выполняется ведущим участником single-flight.
+
+    `stages` — кэш этапов задачи: этапы, входы и настройки которых не менялись, не выполняются.
+    """
+    top_header = get_value(settings, 'headers.top', DEFAULT_TOP_HEADER)
+    bottom_header = get_value(settings, 'headers.bottom', DEFAULT_BOTTOM_HEADER)
+    timeline = int(get_value(settings, 'clips.duration_seconds', DEFAULT_TIMELINE))
+    video_id = extract_video_id(url) or url
+
+    # Метаданные из сети запрашиваются один раз: их уже мог получить прогноз перед очередью
+    # (get_video_info помнит их YTDL_INFO_TTL секунд), дальше они передаются прямому потоку и скачиванию
+    remote_info = None
+    if DIRECT_STREAM_INPUT:
+        # Длинные источники читаем по прямым ссылкам, без полной локальной копии
+        remote_info = await downloader.get_video_info(url, chat_id)
+        source = await downloader.resolve_stream(url, chat_id, info=remote_info)
+        if source and source['duration'] >= DIRECT_STREAM_MIN_DURATION:
+            report = _with_eta(report, predict_job(source, settings, downloaded=True))
+            await report("🎤 <b>Этап 3/5:</b> Создание вертикальных видео с субтитрами (прямой поток)...")
+            return await processor.process_stream(source, chat_id, top_header, bottom_header, segment_duration=timeline, settings=settings, workspace=workspace, checkpoint=checkpoint, allow_zip=allow_zip, on_clip=on_clip, stages=stages, source_key=video_id)
+
+    cached_path = checkpoint.get('download')
+    downloaded = bool(cached_path and os.path.exists(cached_path))
+    download_key = stages.key('download', video_id) if stages else None
+    if not downloaded and download_key:
+        # Это видео уже скачивалось для другой задачи
+        cached_path = await stages.restore('download', download_key, workspace.path / 'source.mp4')
+        downloaded = bool(cached_path)
+    # Метаданные нужны и для прогноза, и самому скачиванию — запрашиваем один раз
+    if downloaded:
+        info = await processor.get_video_info(cached_path)
+    else:
+        info = remote_info or await downloader.get_video_info(url, chat_id)
+    report = _with_eta(report, predict_job(info, settings, downloaded=downloaded))
+
+    await report("📥 <b>Этап 1/5:</b> Скачивание видео...")
+
+    async def download(_report):
+        if downloaded:
+            return cached_path
+        async def admitted_download():
+            # yt-dlp со склейкой дорожек через ffmpeg тоже проходит допуск по памяти
+            async with processor.memory.admit(processor.memory.estimate('download')):
+                started = time.monotonic()
+                path = await downloader.download_video(url, chat_id, info=info)
+                if path and info and info.get('duration'):
+                    cost_model.record('download', float(info['duration']), time.monotonic() - started)
+                if path and download_key:
+                    await stages.store('download', download_key, path)
+                return path
+
+        if download_limit is None:
+            return await admitted_download()
+        async with download_limit:
+            return await admitted_download()
+
+    # Скачивание общее для всех чатов с тем же видео, даже если настройки отличаются
+    async with download_flight.join(
+        video_id,
+        download,
+        cleanup=lambda path: downloader.cleanup_file(path) if path else None,
+    ) as file_path:
+        if not file_path:
+            raise DownloadError("Не удалось скачать видео. Возможно, видео недоступно или слишком большое.")
+        checkpoint.done('download', file_path)
+
+        await report("🎞️ <b>Этап 2/5:</b> Анализ и нарезка на чанки...")
+
+        await report("🎤 <b>Этап 3/5:</b> Создание вертикальных видео с субтитрами...")
+
+        return await processor.process_video(file_path, chat_id, top_header, bottom_header, segment_duration=timeline, settings=settings, workspace=workspace, checkpoint=checkpoint, allow_zip=allow_zip, on_clip=on_clip, stages=stages, source_key=video_id)
+
+async def preview_source(url: str, chat_id: int, workdir: Path):
+    """Источник для предпросмотра: уже скачанный файл этого видео или прямые ссылки без скачивания.
+
+    Рабочие файлы задач удаляются после неё, поэтому скачанное видео берётся из кэша
+    этапов (ссылкой в `workdir`, чтобы очистка кэша не задела рендер предпросмотра).
+    """
+    video_id = extract_video_id(url)
+    if video_id:
+        stages = stage_cache.run(None)
+        if stages:
+            path = await stages.restore('download', stages.key('download', video_id), workdir / 'source.mp4')
+            if path:
+                return path
+        for path in job_store.stage_artefacts(f"{video_id}:", 'download'):
+            if path and os.path.exists(path):
+                return path
+    return await downloader.resolve_stream(url, chat_id)
+
+def progressive_delivery(settings: dict) -> bool:
+    """Присылать клипы по готовности (результат задачи тогда всегда ссылками)"""
+    return bool(get_value(settings, 'delivery.progressive', PROGRESSIVE_DELIVERY))
+
+def video_job_key(url: str, settings: dict, links_only: bool = False) -> tuple:
+    """Ключ single-flight задачи: (ID видео, отпечаток настроек и вида результата)"""
+    fingerprint = settings_fingerprint(settings)
+    # Результат «только ссылки» (пакеты) отличается от обычного, где небольшой результат приходит архивом
+    return (extract_video_id(url) or url, f"{fingerprint}:links" if links_only else fingerprint)
+
+def flight_key_str(url: str, settings: dict, links_only: bool = False) -> str:
+    """Ключ задачи в виде строки для базы задач"""
+    video_id, fingerprint = video_job_key(url, settings, links_only)
+    return f"{video_id}:{fingerprint}"
+
+def links_only_key(flight_key: str) -> bool:
+    """Результат задачи — только ссылки (по ключу, сохранённому в базе задач)"""
+    return flight_key.endswith(':links')
+
+@asynccontextmanager
+async def join_video_job(url: str, chat_id: int, settings: dict, on_progress=None, download_limit: Optional[asyncio.Semaphore] = None, links_only: bool = False, on_clip=None, flight_key: Optional[str] = None):
+    """Запустить обработку видео или присоединиться к такой же выполняемой задаче.
+
+    Одинаковое видео с одинаковыми настройками обрабатывается один раз для всех чатов.
+    Результат — ZIP с клипами, если он небольшой, иначе файл со ссылками; `links_only` —
+    всегда ссылки. `on_clip` получает каждый загруженный клип сразу (ReadyClip).
+    `flight_key` — ключ, сохранённый в базе задач при постановке: по нему находятся
+    контрольные точки задачи после перезапуска.
+    Используется как `async with join_video_job(...) as result_path:`.
+    """
+    key = video_job_key(url, settings, links_only)
+    video_id, fingerprint = key
+    feed = clip_feeds.setdefault(key, ClipFeed())
+    acquired = []
+
+    async def run(report):
+        # Контрольные точки этапов общие для всех участников с тем же ключом
+        checkpoint = job_store.checkpoint(flight_key or flight_key_str(url, settings, links_only))
+        existing = checkpoint.get('workspace')
+        # Рабочую папку получает только ведущий; ждём, если на диске мало места
+        workspace = await workspaces.acquire(chat_id, f"{video_id}_{fingerprint[:10]}", existing=Path(existing) if existing else None)
+        checkpoint.done('workspace', str(workspace.path))
+        acquired.append((workspace, checkpoint))
+        stages = stage_cache.run(settings)
+        try:
+            return await _run_video_job(url, chat_id, settings, report, workspace, checkpoint, download_limit, allow_zip=not links_only, on_clip=feed.publish, stages=stages)
+        except asyncio.CancelledError:
+            # Остановка бота: оставляем файлы и контрольные точки, чтобы продолжить после перезапуска
+            acquired.remove((workspace, checkpoint))
+            workspaces.detach(workspace)
+            raise
+        except BaseException:
+            acquired.remove((workspace, checkpoint))
+            workspace.release()
+            checkpoint.clear()
+            raise
+        finally:
+            if stages and (stages.skipped or stages.ran):
+                logger.info(f"Кэш этапов, видео {video_id}: {stages.summary()}")
+
+    def cleanup(_result) -> None:
+        for workspace, checkpoint in acquired:
+            workspace.release()
+            checkpoint.clear()
+
+    try:
+        async with feed.subscribe(on_clip), job_flight.join(key, run, on_progress=on_progress, cleanup=cleanup) as result_path:
+            yield result_path
+    finally:
+        if feed.refs == 0 and clip_feeds.get(key) is feed:
+            del clip_feeds[key]
+
+def read_links(result_path: Optional[str]) -> List[str]:
+    """Ссылки на клипы из файла результата (пустой список, если ссылок нет)"""
+    if not result_path or not result_path.endswith('.txt'):
+        return []
+    with open(result_path, 'r', encoding='utf-8') as f:
+        return [line for line in f.read().splitlines() if line.strip()]
+
+async def collect_links(url: str, chat_id: int, settings: dict, on_progress=None, download_limit: Optional[asyncio.Semaphore] = None, flight_key: Optional[str] = None) -> List[str]:
+    """Обработать видео пакета и вернуть ссылки на клипы без отправки в чат"""
+    async with join_video_job(url, chat_id, settings, on_progress=on_progress, download_limit=download_limit, links_only=True, flight_key=flight_key) as result_path:
+        # Читаем ссылки до освобождения задачи: после этого временные файлы удаляются
+        return read_links(result_path)
+
+async def execute_job(bot, job_id: int, chat_id: int, url: str, settings: dict, status_message, flight_key: Optional[str] = None) -> None:
+    """Выполнить задачу из базы задач и отправить результат в чат, обновляя статусное сообщение.
+
+    `flight_key` — ключ задачи из базы (при продолжении после перезапуска).
+    """
+    async def show_progress(text: str) -> None:
+        job_store.set_progress(job_id, text)
+        try:
+            await status_message.edit_text(text, parse_mode=ParseMode.HTML)
+        except BadRequest:
+            pass
+
+    timeline = int(get_value(settings, 'clips.duration_seconds', DEFAULT_TIMELINE))
+
+    job_store.set_status(job_id, RUNNING)
+    # Клипы по готовности: ссылки приходят в чат сразу, итоговый файл со ссылками — в конце
+    progressive = progressive_delivery(settings)
+    links_only = links_only_key(flight_key) if flight_key else progressive
+    delivery = ClipDelivery(bot, chat_id) if progressive else None
+    try:
+        async with join_video_job(url, chat_id, settings, on_progress=show_progress, links_only=links_only, on_clip=delivery, flight_key=flight_key) as archive_path:
+            links = read_links(archive_path)
+            if delivery:
+                await delivery.flush()
+            await deliver_result(bot, chat_id, status_message, archive_path, timeline)
+        job_store.set_status(job_id, DONE if archive_path else FAILED, result=links)
+
+    except DownloadError as e:
+        job_store.set_status(job_id, FAILED, str(e))
+        await status_message.edit_text(f"❌ {e}")
+    except WorkspaceUnavailable as e:
+        job_store.set_status(job_id, FAILED, str(e))
+        await status_message.edit_text("❌ Сейчас на сервере не хватает места на диске. Попробуйте позже.")
+    except Exception as e:
+        logger.error(f"Ошибка обработки видео: {e}")
+        job_store.set_status(job_id, FAILED, str(e))
+        await status_message.edit_text(
+            "❌ Произошла ошибка при обработке видео. Попробуйте позже.\n\n"
+            f"Детали ошибки: {str(e)[:100]}..."
+        )
+    finally:
+        if delivery:
+            delivery.close()
+
+async def deliver_result(bot, chat_id: int, status_message, archive_path: Optional[str], timeline: int) -> None:
+    """Отправить результат обработки в чат"""
+    if not archive_path:
+        await status_message.edit_text(
+            "❌ Не удалось обработать видео. Попробуйте другое видео."
+        )
+        return
+
+    if archive_path.endswith('.txt'):
+        await status_message.edit_text(
+            "☁️ <b>Этап 4/5:</b> Загрузка на Google Drive...",
+            parse_mode=ParseMode.HTML
+        )
+        with open(archive_path, 'rb') as links_file:
+            await bot.send_document(
+                chat_id=chat_id,
+                document=links_file,
+                filename=f"uploaded_links_{chat_id}.txt",
+                caption="✅ Ссылки на все клипы загружены!"
+            )
+        await status_message.edit_text(
+            "✅ <b>Этап 5/5:</b> Готово!",
+            parse_mode=ParseMode.HTML
+        )
+        await status_message.delete()
+    elif archive_path.endswith('.zip'):
+        await status_message.edit_text(
+            "📦 <b>Этап 4/5:</b> Финальная нарезка и архивация...",
+            parse_mode=ParseMode.HTML
+        )
+
+        await status_message.edit_text(
+            f"📤 <b>Этап 5/5:</b> Отправка архива...",
+            parse_mode=ParseMode.HTML
+        )
+        
+        file_size = processor.get_file_size(archive_path)
+        
+        if file_size > MAX_FILE_SIZE:
+            await bot.send_message(
+                chat_id=chat_id,
+                text=f"⚠️ Архив слишком большой ({file_size / (1024*1024):.1f} MB) для отправки в Telegram.\n\n" 
+                     f"Он сохранен в кеше проекта по пути: {archive_path}"
+            )
+        else:
+            caption = f"✅ Готовый архив с видео\n"
+            caption += f"📦 Все видео нарезаны на {timeline}-секундные клипы\n"
+            caption += "🚀 Готово к публикации!"
+
+            # Путь, а не открытый файл: со своим сервером Bot API (локальный режим) файл не загружается повторно
+            await bot.send_document(
+                chat_id=chat_id,
+                document=Path(archive_path).resolve(),
+                filename=f"final_videos_{chat_id}.zip",
+                caption=caption
+            )
+        
+        await status_message.delete() 
+        
+        final_message = f"🎉 <b>Обработка завершена!</b>\n\n"
+        final_message += f"📊 <b>Результат:</b>\n"
+        final_message += f"• Создан ZIP-архив с короткими видео\n"
+        final_message += f"• Формат: 9:16 (вертикальный)\n"
+        final_message += f"• Субтитры: Анимированные по словам\n\n"
+        final_message += f"🚀 Готово к публикации в соцсетях!"
+        
+        await bot.send_message(
+            chat_id=chat_id,
+            text=final_message,
+            parse_mode=ParseMode.HTML
+        )
+    else: # It's a message from the google drive uploader
+        await status_message.edit_text(
+            "☁️ <b>Этап 4/5:</b> Загрузка на Google Drive...",
+            parse_mode=ParseMode.HTML
+        )
+        await bot.send_message(
+            chat_id=chat_id,
+            text=archive_path,
+            parse_mode=ParseMode.HTML
+        )
+        await status_message.edit_text(
+            "✅ <b>Этап 5/5:</b> Готово!",
+            parse_mode=ParseMode.HTML
+        )
+        await status_message.delete()
@@ -0,0 +1,84 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+ProgressCallback = Callable[[str], Awaitable[None]]
+
+
+class _Call:
+    def __init__(self, cleanup: Optional[Callable[[Any], None]]):
+        self.task: Optional[asyncio.Task] = None
+        self.refs = 0
+        self.listeners: List[ProgressCallback] = []
+        self.last_progress: Optional[str] = None
+        self.cleanup = cleanup
+
+
+class SingleFlight:
+    """Объединение одинаковых одновременных задач.
+
+    Первый участник с данным ключом (ведущий) запускает задачу, остальные (ведомые)
+    присоединяются к ней, получают тот же результат и те же сообщения о прогрессе.
+    Функция очистки ведущего вызывается, когда результат отпустит последний участник.
+    """
+
+    def __init__(self, name: str = 'flight'):
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    async def _report(self, call: _Call, text: str) -> None:
+        call.last_progress = text
+        for listener in list(call.listeners):
+            try:
+                await listener(text)
+            except Exception as e:
+                logger.debug(f"[{self.name}] Ошибка отправки прогресса: {e}")
+
+    @asynccontextmanager
+    async def join(
+        self,
+        key: Hashable,
+        factory: Callable[[ProgressCallback], Awaitable[Any]],
+        on_progress: Optional[ProgressCallback] = None,
+        cleanup: Optional[Callable[[Any], None]] = None,
+    ):
+        """Присоединиться к задаче `key` или запустить её через `factory(report)`."""
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(cleanup)
+            self._calls[key] = call
+            call.task = asyncio.ensure_future(factory(lambda text: self._report(call, text)))
+        else:
+            logger.info(f"[{self.name}] Присоединяемся к выполняемой задаче {key}")
+        call.refs += 1
+        if on_progress:
+            call.listeners.append(on_progress)
+            if call.last_progress:
+                try:
+                    await on_progress(call.last_progress)
+                except Exception as e:
+                    logger.debug(f"[{self.name}] Ошибка отправки прогресса: {e}")
+        try:
+            # shield: отмена одного участника не должна отменять задачу для остальных
+            yield await asyncio.shield(call.task)
+        finally:
+            call.refs -= 1
+            if on_progress in call.listeners:
+                call.listeners.remove(on_progress)
+            if call.refs == 0:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+                if not call.task.done():
+                    # Результат больше никому не нужен
+                    call.task.cancel()
+                elif call.cleanup and not call.task.cancelled() and call.task.exception() is None:
+                    try:
+                        call.cleanup(call.task.result())
+                    except Exception as e:
+                        logger.error(f"[{self.name}] Ошибка очистки результата {key}: {e}")
@@ -0,0 +1,237 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import uuid
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from config import STAGE_CACHE_DIR, STAGE_CACHE_MAX_BYTES
+from executors import io_executor
+from user_settings import settings_fingerprint
+
+logger = logging.getLogger(__name__)
+
+
+class StageSpec(NamedTuple):
+    title: str                  # название для отчёта о пропущенных этапах
+    settings: Tuple[str, ...]   # поддеревья настроек, от которых зависит результат этапа
+    version: int = 1            # поднять при изменении кода этапа, чтобы старые результаты не использовались
+
+
+# Этапы конвейера и их зависимости от настроек. Входы этапа (исходник, окно, ключ
+# предыдущего этапа) передаются в StageRun.key(), поэтому ключ рендера меняется вместе
+# с ключом транскрибации, а ключ нарезки — вместе с ключом рендера.
+STAGES: Dict[str, StageSpec] = {
+    'download': StageSpec('скачивание', ()),
+    # Звук прямого потока извлекается только для Whisper: отдельной записи у него нет,
+    # он пропускается вместе с транскрибацией своего окна
+    'audio': StageSpec('извлечение звука', ()),
+    'transcribe': StageSpec('транскрибация', ()),
+    'render': StageSpec('рендер', ('headers', 'subtitles', 'layout', 'banner', 'background_music')),
+    'cut': StageSpec('нарезка клипов', ('clips.duration_seconds',)),
+}
+
+
+def file_stamp(path: Optional[str]) -> Optional[Tuple[str, int, float]]:
+    """Отпечаток входного файла (музыка, баннер): замена файла по тому же пути меняет ключ этапа"""
+    if not path:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return str(path), stat.st_size, stat.st_mtime
+
+
+def link_or_copy(source: str, target: Path) -> None:
+    """Жёсткая ссылка (на той же файловой системе) или копия"""
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+class StageCache:
+    """Результаты этапов конвейера на диске, общие для всех задач и процессов.
+
+    Запись лежит в `<root>/<этап>/<ключ>`: файл (скачанное видео, рендер, клип) или JSON
+    (субтитры). Ключ — хеш входов этапа и нужных ему поддеревьев настроек, поэтому
+    задача с изменённой длительностью клипа заново режет клипы, но берёт готовые рендер,
+    транскрибацию и скачивание. Записи публикуются атомарно; файлы кладутся жёсткой
+    ссылкой и так же выдаются в рабочую папку задачи, чтобы удаление в задаче не
+    задевало кэш. Сверх `max_bytes` удаляются записи, которые дольше всего не читались.
+    Объём кэша считается нарастающим итогом (каталог обходится один раз при первой
+    записи и затем только при очистке), поэтому запись не сканирует весь кэш; записи
+    других процессов учитываются при очередной очистке.
+    """
+
+    def __init__(self, root: Path = STAGE_CACHE_DIR, max_bytes: int = STAGE_CACHE_MAX_BYTES):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total: Optional[int] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def run(self, settings: Optional[Dict[str, Any]]) -> Optional['StageRun']:
+        """Этапы одной задачи с её настройками (None, если кэш выключен)"""
+        return StageRun(self, settings or {}) if self.enabled else None
+
+    def _entry(self, stage: str, key: str, suffix: str = '') -> Path:
+        return self.root / stage / f"{key}{suffix}"
+
+    def restore(self, stage: str, key: str, target: Path) -> Optional[str]:
+        """Выдать файл из кэша по пути `target` (None, если записи нет)"""
+        target = Path(target)
+        entry = self._entry(stage, key)
+        if not entry.exists():
+            return None
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.unlink(missing_ok=True)
+        try:
+            link_or_copy(str(entry), target)
+            os.utime(entry)
+        except FileNotFoundError:
+            # Запись удалили между проверкой и ссылкой (очистка кэша в другом процессе)
+            return None
+        return str(target)
+
+    def store(self, stage: str, key: str, path: str) -> None:
+        """Положить в кэш готовый файл этапа"""
+        entry = self._entry(stage, key)
+        self._publish(entry, lambda partial: link_or_copy(path, partial))
+
+    def get_json(self, stage: str, key: str) -> Any:
+        entry = self._entry(stage, key, '.json')
+        try:
+            with open(entry, 'r', encoding='utf-8') as f:
+                value = json.load(f)
+            os.utime(entry)
+            return value
+        except (OSError, ValueError):
+            return None
+
+    def put_json(self, stage: str, key: str, value: Any) -> None:
+        def write(partial: Path) -> None:
+            with open(partial, 'w', encoding='utf-8') as f:
+                json.dump(value, f, ensure_ascii=False)
+
+        self._publish(self._entry(stage, key, '.json'), write)
+
+    def _publish(self, entry: Path, write) -> None:
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        partial = entry.with_name(f".{entry.name}.{uuid.uuid4().hex[:8]}.part")
+        try:
+            write(partial)
+            size = partial.stat().st_size
+            try:
+                # Запись по тому же ключу заменяется: её объём уходит из итога
+                size -= entry.stat().st_size
+            except OSError:
+                pass
+            os.replace(partial, entry)
+        finally:
+            partial.unlink(missing_ok=True)
+        with self._lock:
+            if self._total is None:
+                # Первая запись процесса: объём уже лежащего на диске (вместе с этой записью)
+                self._total = sum(size for _, size, _ in self._scan())
+            else:
+                self._total += size
+            over = self._total > self.max_bytes
+        if over:
+            self.trim()
+
+    def _scan(self) -> List[Tuple[float, int, Path]]:
+        entries = []
+        for path in self.root.glob('*/*'):
+            if path.name.startswith('.'):
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def trim(self) -> None:
+        """Удалить давно не использованные записи, пока кэш не уложится в max_bytes"""
+        with self._lock:
+            entries = self._scan()
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                total -= size
+                logger.info(f"Кэш этапов: удалена запись {path.parent.name}/{path.name} ({size / 1024 / 1024:.1f} МБ)")
+            self._total = total
+
+
+class StageRun:
+    """Кэш этапов глазами одной задачи: ключи с её настройками и учёт выполненного и пропущенного"""
+
+    def __init__(self, cache: StageCache, settings: Dict[str, Any]):
+        self.cache = cache
+        self.settings = settings
+        self.skipped: Counter = Counter()
+        self.ran: Counter = Counter()
+
+    def key(self, stage: str, *inputs: Any) -> str:
+        spec = STAGES[stage]
+        payload = json.dumps(
+            [stage, spec.version, inputs, settings_fingerprint(self.settings, *spec.settings) if spec.settings else ''],
+            sort_keys=True, ensure_ascii=False, default=str,
+        )
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    def skip(self, stage: str) -> None:
+        self.skipped[stage] += 1
+
+    def done(self, stage: str) -> None:
+        self.ran[stage] += 1
+
+    async def restore(self, stage: str, key: str, target: Path) -> Optional[str]:
+        path = await io_executor.run(self.cache.restore, stage, key, target)
+        if path:
+            self.skip(stage)
+        return path
+
+    async def store(self, stage: str, key: str, path: str) -> None:
+        self.done(stage)
+        try:
+            await io_executor.run(self.cache.store, stage, key, path)
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить результат этапа {stage} в кэш: {e}")
+
+    async def get_json(self, stage: str, key: str) -> Any:
+        value = await io_executor.run(self.cache.get_json, stage, key)
+        if value is not None:
+            self.skip(stage)
+        return value
+
+    async def put_json(self, stage: str, key: str, value: Any) -> None:
+        self.done(stage)
+        try:
+            await io_executor.run(self.cache.put_json, stage, key, value)
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить результат этапа {stage} в кэш: {e}")
+
+    def summary(self) -> str:
+        """Что взято из кэша и что выполнено заново, например «пропущено: скачивание, рендер ×3»"""
+        def describe(counts: Counter) -> str:
+            return ', '.join(
+                STAGES[stage].title + (f" ×{n}" if n > 1 else '')
+                for stage, n in counts.items()
+            ) or 'ничего'
+
+        return f"пропущено: {describe(self.skipped)}; выполнено: {describe(self.ran)}"
+
+
+stage_cache = StageCache()
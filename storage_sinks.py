@@ -0,0 +1,218 @@
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional
+from urllib.parse import quote
+
+from config import (
+    STORAGE_SINK, STORAGE_LOCAL_DIR, STORAGE_LOCAL_BASE_URL,
+    S3_BUCKET, S3_ENDPOINT_URL, S3_PREFIX, S3_PUBLIC_URL, S3_PART_SIZE, S3_MAX_CONCURRENCY, S3_LINK_TTL,
+)
+from google_drive_uploader import DriveUploader, drive_file_id, drive_uploader
+from user_settings import get_value
+
+logger = logging.getLogger(__name__)
+
+
+class StoredFile(NamedTuple):
+    id: str      # идентификатор в хранилище (ID файла, путь, ключ объекта)
+    link: str    # прямая ссылка для скачивания
+
+
+class StorageSink:
+    """Хранилище готовых клипов.
+
+    Методы синхронные и вызываются из пула потоков upload_executor. `upload_stream`
+    есть только у хранилищ с `supports_streaming` (источник — PipeMediaUpload).
+    `finalize` вызывается один раз со всеми ссылками задачи перед их выдачей.
+    `job` — метка задачи: имена клипов (clip_0_0.mp4) повторяются из задачи в задачу,
+    и хранилища с адресацией по пути кладут клипы каждой задачи отдельно, чтобы новая
+    задача не подменила файлы по уже выданным ссылкам.
+    """
+
+    name = ''
+    supports_streaming = False
+
+    def upload_file(self, path: str, folder: str, job: str = '') -> StoredFile:
+        raise NotImplementedError
+
+    def upload_stream(self, media: Any, name: str, folder: str, job: str = '') -> StoredFile:
+        raise NotImplementedError(f"Хранилище {self.name} не принимает поток")
+
+    def finalize(self, links: List[str]) -> None:
+        pass
+
+
+class DriveSink(StorageSink):
+    """Google Drive (DriveUploader): resumable-загрузка, доступ по ссылке на папку или пачкой.
+
+    Каждая загрузка — новый файл со своим ID, поэтому метка задачи не нужна.
+    """
+
+    name = 'drive'
+    supports_streaming = True
+
+    def __init__(self, uploader: DriveUploader = drive_uploader):
+        self.uploader = uploader
+
+    def upload_file(self, path: str, folder: str, job: str = '') -> StoredFile:
+        return self._stored(self.uploader.upload_file(path, folder))
+
+    def upload_stream(self, media: Any, name: str, folder: str, job: str = '') -> StoredFile:
+        return self._stored(self.uploader.upload_stream(media, name, folder))
+
+    def finalize(self, links: List[str]) -> None:
+        if self.uploader.share_mode != 'folder':
+            # Ссылки из контрольных точек тоже: после перезапуска доступ мог быть не открыт (повтор безвреден)
+            self.uploader.share_files([file_id for file_id in map(drive_file_id, links) if file_id])
+
+    @staticmethod
+    def _stored(file: Dict[str, Any]) -> StoredFile:
+        return StoredFile(file['id'], f"https://drive.google.com/uc?export=download&id={file['id']}")
+
+
+class LocalSink(StorageSink):
+    """Папка на диске, например раздаваемая веб-сервером.
+
+    Клип публикуется атомарно (запись во временный файл и переименование); на той же
+    файловой системе вместо копирования делается жёсткая ссылка. Ссылка — base_url + путь
+    относительно корня или file://, если base_url не задан.
+    """
+
+    name = 'local'
+
+    def __init__(self, root: Path, base_url: str = ''):
+        self.root = Path(root)
+        self.base_url = base_url.rstrip('/')
+
+    def upload_file(self, path: str, folder: str, job: str = '') -> StoredFile:
+        relative = Path(folder, job, os.path.basename(path))
+        target = self.root / relative
+        target.parent.mkdir(parents=True, exist_ok=True)
+        partial = target.with_name(target.name + '.part')
+        partial.unlink(missing_ok=True)
+        try:
+            os.link(path, partial)
+        except OSError:
+            shutil.copyfile(path, partial)
+        os.replace(partial, target)
+        return StoredFile(relative.as_posix(), self._link(relative, target))
+
+    def _link(self, relative: Path, target: Path) -> str:
+        if self.base_url:
+            return f"{self.base_url}/{quote(relative.as_posix())}"
+        return target.resolve().as_uri()
+
+
+class S3Sink(StorageSink):
+    """S3-совместимое хранилище (AWS S3, MinIO и т. п.) через boto3.
+
+    Файлы больше `part_size` загружаются multipart: части по `part_size` уходят
+    параллельно в `concurrency` потоков. Ссылка — S3_PUBLIC_URL + ключ (публичный бакет
+    или CDN) либо presigned URL на `link_ttl` секунд. Учётные данные — стандартные для
+    boto3 (AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY, профиль и т. д.).
+    """
+
+    name = 's3'
+
+    def __init__(self, bucket: str, endpoint_url: str = '', prefix: str = '', public_url: str = '',
+                 part_size: int = S3_PART_SIZE, concurrency: int = S3_MAX_CONCURRENCY, link_ttl: int = S3_LINK_TTL):
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url or None
+        self.prefix = prefix.strip('/')
+        self.public_url = public_url.rstrip('/')
+        self.part_size = part_size
+        self.concurrency = concurrency
+        self.link_ttl = link_ttl
+        self._client = None
+        self._transfer_config = None
+        self._lock = threading.Lock()
+
+    def client(self):
+        """Клиент boto3 (потокобезопасен, создаётся один раз)"""
+        with self._lock:
+            if self._client is None:
+                try:
+                    import boto3
+                    from boto3.s3.transfer import TransferConfig
+                except ImportError:
+                    raise RuntimeError("Для STORAGE_SINK=s3 установите boto3: pip install boto3")
+                self._client = boto3.session.Session().client('s3', endpoint_url=self.endpoint_url)
+                self._transfer_config = TransferConfig(
+                    multipart_threshold=self.part_size, multipart_chunksize=self.part_size,
+                    max_concurrency=self.concurrency, use_threads=True,
+                )
+            return self._client
+
+    def upload_file(self, path: str, folder: str, job: str = '') -> StoredFile:
+        key = '/'.join(part for part in (self.prefix, folder, job, os.path.basename(path)) if part)
+        client = self.client()
+        started = time.monotonic()
+        client.upload_file(path, self.bucket, key, ExtraArgs={'ContentType': 'video/mp4'}, Config=self._transfer_config)
+        elapsed = time.monotonic() - started
+        size = os.path.getsize(path)
+        logger.info(f"Загружен {key} в S3: {size / 1024 / 1024:.1f} МБ за {elapsed:.1f} с ({size / 1024 / 1024 / max(elapsed, 1e-6):.1f} МБ/с)")
+        return StoredFile(key, self._link(key))
+
+    def _link(self, key: str) -> str:
+        if self.public_url:
+            return f"{self.public_url}/{quote(key)}"
+        return self.client().generate_presigned_url('get_object', Params={'Bucket': self.bucket, 'Key': key}, ExpiresIn=self.link_ttl)
+
+
+_sinks: Dict[str, StorageSink] = {}
+_sinks_lock = threading.Lock()
+
+
+def available_sinks() -> List[str]:
+    """Хранилища, настроенные в этом развёртывании"""
+    names = ['drive']
+    if STORAGE_LOCAL_DIR:
+        names.append('local')
+    if S3_BUCKET:
+        names.append('s3')
+    return names
+
+
+def _create(name: str) -> StorageSink:
+    if name == 'local':
+        return LocalSink(Path(STORAGE_LOCAL_DIR), STORAGE_LOCAL_BASE_URL)
+    if name == 's3':
+        return S3Sink(S3_BUCKET, S3_ENDPOINT_URL, S3_PREFIX, S3_PUBLIC_URL)
+    return DriveSink()
+
+
+def get_sink(name: Optional[str] = None) -> StorageSink:
+    """Хранилище по имени (по умолчанию STORAGE_SINK); ненастроенное заменяется на Google Drive"""
+    name = name or STORAGE_SINK
+    if name not in available_sinks():
+        logger.warning(f"Хранилище '{name}' не настроено, используем Google Drive")
+        name = 'drive'
+    with _sinks_lock:
+        if name not in _sinks:
+            _sinks[name] = _create(name)
+        return _sinks[name]
+
+
+def sink_for(settings: Optional[Dict[str, Any]]) -> StorageSink:
+    """Хранилище, выбранное пользователем в настройках (или STORAGE_SINK)"""
+    return get_sink(get_value(settings or {}, 'storage.sink', STORAGE_SINK))
+
+
+if __name__ == '__main__':
+    # Замер скорости загрузки: python storage_sinks.py <drive|local|s3> <файл> [повторы]
+    # (для S3 можно направить S3_ENDPOINT_URL на локальный MinIO)
+    logging.basicConfig(level=logging.INFO)
+    sink = get_sink(sys.argv[1])
+    path = sys.argv[2]
+    repeats = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+    size = os.path.getsize(path)
+    for attempt in range(repeats):
+        started = time.monotonic()
+        stored = sink.upload_file(path, 'storage_benchmark')
+        elapsed = time.monotonic() - started
+        print(f"{sink.name}: {size / 1024 / 1024:.1f} МБ за {elapsed:.2f} с — {size / 1024 / 1024 / elapsed:.1f} МБ/с ({stored.link})")
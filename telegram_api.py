@@ -0,0 +1,88 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+from telegram.error import RetryAfter
+from telegram.ext import ApplicationBuilder
+
+from config import (
+    TELEGRAM_API_BASE_URL, TELEGRAM_API_FILE_URL, TELEGRAM_LOCAL_MODE,
+    TELEGRAM_MAX_MESSAGES_PER_SECOND, TELEGRAM_CHAT_INTERVAL, TELEGRAM_GROUP_INTERVAL, TELEGRAM_RETRY_AFTER_ATTEMPTS,
+)
+
+logger = logging.getLogger(__name__)
+
+# Подключение к Bot API: публичный api.telegram.org или свой сервер telegram-bot-api.
+# В локальном режиме файл передаётся серверу путём (file://) и не загружается повторно;
+# сервер должен видеть ту же файловую систему, что и бот/обработчик.
+
+
+def bot_options() -> Dict[str, Any]:
+    """Параметры telegram.Bot для выбранного сервера Bot API"""
+    options: Dict[str, Any] = {}
+    if TELEGRAM_API_BASE_URL:
+        options['base_url'] = TELEGRAM_API_BASE_URL
+    if TELEGRAM_API_FILE_URL:
+        options['base_file_url'] = TELEGRAM_API_FILE_URL
+    if TELEGRAM_LOCAL_MODE:
+        options['local_mode'] = True
+    return options
+
+
+def configure_builder(builder: ApplicationBuilder) -> ApplicationBuilder:
+    """Те же параметры для Application.builder()"""
+    for name, value in bot_options().items():
+        builder = getattr(builder, name)(value)
+    return builder
+
+
+class TelegramRateLimiter:
+    """Ограничение частоты сообщений бота под флуд-лимиты Telegram.
+
+    Сообщения одного чата уходят по очереди и не чаще `chat_interval` (в группах —
+    `group_interval`), всех чатов вместе — не больше `per_second` в секунду. Если
+    Telegram всё же ответил RetryAfter, чат ждёт указанное время и сообщение повторяется.
+    """
+
+    def __init__(self, per_second: float = TELEGRAM_MAX_MESSAGES_PER_SECOND, chat_interval: float = TELEGRAM_CHAT_INTERVAL,
+                 group_interval: float = TELEGRAM_GROUP_INTERVAL, attempts: int = TELEGRAM_RETRY_AFTER_ATTEMPTS):
+        self.min_gap = 1.0 / per_second
+        self.chat_interval = chat_interval
+        self.group_interval = group_interval
+        self.attempts = attempts
+        self._next_global = 0.0
+        self._next_chat: Dict[int, float] = {}
+        self._chat_locks: Dict[int, asyncio.Lock] = {}
+
+    async def send(self, chat_id: int, call: Callable[[], Awaitable[Any]]) -> Any:
+        """Выполнить `call()` (отправку в чат `chat_id`), когда это позволяют лимиты"""
+        lock = self._chat_locks.setdefault(chat_id, asyncio.Lock())
+        async with lock:
+            for attempt in range(1, self.attempts + 1):
+                await self._wait_turn(chat_id)
+                try:
+                    return await call()
+                except RetryAfter as e:
+                    retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else float(e.retry_after)
+                    logger.warning(f"Флуд-лимит Telegram в чате {chat_id}: ждём {retry_after:.0f} с ({attempt}/{self.attempts})")
+                    self._next_chat[chat_id] = asyncio.get_running_loop().time() + retry_after
+                    if attempt == self.attempts:
+                        raise
+
+    async def _wait_turn(self, chat_id: int) -> None:
+        loop = asyncio.get_running_loop()
+        delay = self._next_chat.get(chat_id, 0.0) - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        # Общий лимит: места в секунде раздаются по порядку обращения
+        now = loop.time()
+        slot = max(now, self._next_global)
+        self._next_global = slot + self.min_gap
+        if slot > now:
+            await asyncio.sleep(slot - now)
+        interval = self.group_interval if chat_id < 0 else self.chat_interval
+        self._next_chat[chat_id] = loop.time() + interval
+
+
+# Общий ограничитель процесса (бота или обработчика)
+telegram_limiter = TelegramRateLimiter()
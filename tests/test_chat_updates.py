@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('telegram')
+
+from chat_updates import ChatOrderedUpdateProcessor
+
+
+class FakeUpdate:
+    def __init__(self, chat_id: int, name: str):
+        self.chat_id = chat_id
+        self.name = name
+
+
+@pytest.fixture
+def processor(monkeypatch):
+    monkeypatch.setattr(ChatOrderedUpdateProcessor, '_chat_id', staticmethod(lambda update: update.chat_id))
+    return ChatOrderedUpdateProcessor(max_concurrent_updates=2)
+
+
+def test_updates_of_one_chat_run_in_order(processor):
+    async def main():
+        done = []
+
+        async def handle(name: str, delay: float) -> None:
+            await asyncio.sleep(delay)
+            done.append(name)
+
+        await asyncio.gather(*(
+            processor.process_update(FakeUpdate(1, name), handle(name, delay))
+            for name, delay in (('first', 0.03), ('second', 0.0), ('third', 0.01))
+        ))
+        # Обработчики чата, вставшие в очередь, завершаются вместе с её разбором
+        while processor._chats:
+            await asyncio.sleep(0.01)
+        return done
+
+    assert asyncio.run(main()) == ['first', 'second', 'third']
+
+
+def test_busy_chat_does_not_block_other_chats(processor):
+    async def main():
+        gate = asyncio.Event()
+        done = []
+
+        async def slow(name: str) -> None:
+            await gate.wait()
+            done.append(name)
+
+        async def fast(name: str) -> None:
+            done.append(name)
+
+        # Пять обновлений занятого чата при двух слотах: слот держит только первое
+        busy = [asyncio.ensure_future(processor.process_update(FakeUpdate(1, f"slow{i}"), slow(f"slow{i}"))) for i in range(5)]
+        await asyncio.sleep(0.01)
+        await asyncio.wait_for(processor.process_update(FakeUpdate(2, 'other'), fast('other')), 1)
+        gate.set()
+        await asyncio.gather(*busy)
+        while processor._chats:
+            await asyncio.sleep(0.01)
+        return done
+
+    done = asyncio.run(main())
+    assert done[0] == 'other'
+    assert done[1:] == [f"slow{i}" for i in range(5)]
+
+
+def test_failed_update_does_not_stop_chat_queue(processor):
+    async def main():
+        done = []
+
+        async def broken() -> None:
+            raise RuntimeError('обработчик упал')
+
+        async def handle() -> None:
+            done.append('next')
+
+        await asyncio.gather(
+            processor.process_update(FakeUpdate(1, 'broken'), broken()),
+            processor.process_update(FakeUpdate(1, 'next'), handle()),
+        )
+        return done
+
+    assert asyncio.run(main()) == ['next']
@@ -0,0 +1,110 @@
+import asyncio
+import os
+import re
+import shutil
+import subprocess
+import threading
+from functools import partial
+from http import HTTPStatus
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+_RANGE_RE = re.compile(r'bytes=(\d+)-(\d*)$')
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Раздача файлов с ответом 206 на `Range: bytes=a-b`; запрошенные диапазоны записываются в server.ranges"""
+
+    def send_head(self):
+        match = _RANGE_RE.match(self.headers.get('Range', ''))
+        if not match:
+            self.server.ranges.append(None)
+            return super().send_head()
+        path = self.translate_path(self.path)
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return None
+        size = os.fstat(f.fileno()).st_size
+        start = int(match.group(1))
+        end = min(int(match.group(2) or size - 1), size - 1)
+        if start >= size:
+            f.close()
+            self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            self.send_header('Content-Range', f'bytes */{size}')
+            self.end_headers()
+            return None
+        self.server.ranges.append((start, end))
+        f.seek(start)
+        self.send_response(HTTPStatus.PARTIAL_CONTENT)
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        return _Slice(f, end - start + 1)
+
+    def end_headers(self):
+        if 'Range' not in self.headers:
+            self.send_header('Accept-Ranges', 'bytes')
+        super().end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _Slice:
+    """Файл, читаемый не дальше `length` байт (copyfile в SimpleHTTPRequestHandler читает до конца)"""
+
+    def __init__(self, f, length: int):
+        self.f = f
+        self.left = length
+
+    def read(self, size: int = -1) -> bytes:
+        size = self.left if size < 0 else min(size, self.left)
+        data = self.f.read(size)
+        self.left -= len(data)
+        return data
+
+    def close(self) -> None:
+        self.f.close()
+
+
+@pytest.fixture
+def media_server(tmp_path):
+    """Локальный сервер с sample.mp4 (5 с, moov в начале файла); адрес — server.url"""
+    if not shutil.which('ffmpeg'):
+        pytest.skip('ffmpeg не установлен')
+    sample = tmp_path / 'sample.mp4'
+    subprocess.run(
+        ['ffmpeg', '-v', 'error', '-f', 'lavfi', '-i', 'testsrc=duration=5:size=160x120:rate=10',
+         '-f', 'lavfi', '-i', 'sine=duration=5', '-c:v', 'mpeg4', '-c:a', 'aac',
+         '-movflags', '+faststart', '-y', str(sample)],
+        check=True,
+    )
+    server = ThreadingHTTPServer(('127.0.0.1', 0), partial(RangeRequestHandler, directory=str(tmp_path)))
+    server.ranges = []
+    server.url = f"http://127.0.0.1:{server.server_port}/sample.mp4"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_ffmpeg_reads_window_with_range_requests(media_server):
+    ffmpeg = pytest.importorskip('ffmpeg')
+    from ffmpeg_runner import FFmpegRunner
+
+    runner = FFmpegRunner(max_concurrent=1)
+    # Как окно в process_stream: -ss до входа, ffmpeg перематывает по HTTP, а не читает файл с начала
+    options = {'reconnect': 1, 'reconnect_streamed': 1, 'reconnect_delay_max': 5}
+    stream = ffmpeg.input(media_server.url, ss=3, t=1, **options).output('pipe:1', format='s16le', ac=1, ar=16000)
+    pcm = asyncio.run(runner.run(stream, capture_stdout=True, limited=False))
+
+    # 1 секунда моно 16 кГц, 16 бит
+    assert abs(len(pcm) - 32000) <= 3200
+    assert any(start > 0 for start, _ in filter(None, media_server.ranges))
+
@@ -0,0 +1,25 @@
+import asyncio
+import os
+
+import pytest
+
+import executors
+from executors import RecyclingProcessPool
+
+
+@pytest.mark.parametrize('max_tasks_per_child', [True, False])
+def test_process_pool_recycles_workers(monkeypatch, max_tasks_per_child):
+    # False — путь Python 3.10: без max_tasks_per_child пул сменяется целиком
+    monkeypatch.setattr(executors, '_MAX_TASKS_PER_CHILD', max_tasks_per_child)
+    pool = RecyclingProcessPool('test', max_workers=1, max_tasks=2)
+
+    async def main():
+        return [await pool.run(os.getpid) for _ in range(4)]
+
+    try:
+        pids = asyncio.run(main())
+    finally:
+        pool.shutdown()
+    assert pids[0] == pids[1]
+    assert pids[1] != pids[2]
+    assert pids[2] == pids[3]
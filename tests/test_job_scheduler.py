@@ -0,0 +1,119 @@
+import asyncio
+
+from job_scheduler import JobScheduler, QueueFull
+
+
+async def _noop() -> None:
+    pass
+
+
+async def _busy_scheduler(policy: str, max_per_chat: int = 10) -> JobScheduler:
+    """Планировщик с одним слотом, занятым бесконечной задачей: остальные ждут в очереди"""
+    scheduler = JobScheduler(workers=1, max_queue=10, max_per_chat=max_per_chat, policy=policy)
+    scheduler.submit(0, asyncio.Event().wait)
+    await asyncio.sleep(0)
+    return scheduler
+
+
+def _queued_order(scheduler: JobScheduler, jobs: dict) -> list:
+    return sorted(jobs, key=lambda name: scheduler.position(jobs[name]))
+
+
+def test_fair_policy_alternates_chats():
+    async def main():
+        scheduler = await _busy_scheduler('fair')
+        jobs = {
+            'a1': scheduler.submit(1, _noop),
+            'a2': scheduler.submit(1, _noop),
+            'a3': scheduler.submit(1, _noop),
+            'b1': scheduler.submit(2, _noop),
+        }
+        return _queued_order(scheduler, jobs)
+
+    assert asyncio.run(main()) == ['a1', 'b1', 'a2', 'a3']
+
+
+def test_sjf_policy_prefers_short_jobs():
+    async def main():
+        scheduler = await _busy_scheduler('sjf')
+        jobs = {
+            'long': scheduler.submit(1, _noop, cost=3000),
+            'short': scheduler.submit(2, _noop, cost=60),
+            'medium': scheduler.submit(3, _noop, cost=600),
+        }
+        return _queued_order(scheduler, jobs)
+
+    assert asyncio.run(main()) == ['short', 'medium', 'long']
+
+
+def test_sjf_unknown_cost_uses_average_duration():
+    async def main():
+        scheduler = await _busy_scheduler('sjf')
+        jobs = {
+            'unknown': scheduler.submit(1, _noop),
+            'short': scheduler.submit(2, _noop, cost=scheduler._avg_duration / 2),
+        }
+        return _queued_order(scheduler, jobs)
+
+    assert asyncio.run(main()) == ['short', 'unknown']
+
+
+def test_deadline_policy_orders_by_deadline():
+    async def main():
+        scheduler = await _busy_scheduler('deadline')
+        jobs = {
+            'long': scheduler.submit(1, _noop, cost=3000),
+            'short': scheduler.submit(1, _noop, cost=10),
+        }
+        # Срок тем дальше, чем длиннее задача
+        jobs['long'].enqueued_at -= 1000
+        return _queued_order(scheduler, jobs)
+
+    assert asyncio.run(main()) == ['short', 'long']
+
+
+def test_unknown_policy_falls_back_to_fair():
+    assert JobScheduler(policy='random').policy == 'fair'
+
+
+def test_per_chat_limit():
+    async def main():
+        scheduler = await _busy_scheduler('fair', max_per_chat=2)
+        scheduler.submit(1, _noop)
+        scheduler.submit(1, _noop)
+        try:
+            scheduler.submit(1, _noop)
+        except QueueFull as e:
+            return e.per_chat
+        return None
+
+    assert asyncio.run(main()) is True
+
+
+def test_jobs_run_in_policy_order():
+    async def main():
+        scheduler = JobScheduler(workers=1, max_queue=10, max_per_chat=10, policy='sjf')
+        started = []
+        gate = asyncio.Event()
+
+        def job(name: str):
+            async def run() -> str:
+                started.append(name)
+                if name == 'blocker':
+                    await gate.wait()
+                return name
+            return run
+
+        blocker = scheduler.submit(1, job('blocker'), cost=1)
+        await asyncio.sleep(0)
+        waiting = [
+            scheduler.submit(2, job('long'), cost=900),
+            scheduler.submit(3, job('short'), cost=30),
+        ]
+        gate.set()
+        results = await asyncio.gather(blocker.future, *(job.future for job in waiting))
+        return started, results
+
+    started, results = asyncio.run(main())
+    assert started == ['blocker', 'short', 'long']
+    assert results == ['blocker', 'long', 'short']
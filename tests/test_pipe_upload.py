@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('googleapiclient')
+
+from pipe_upload import PipeMediaUpload
+
+
+def test_getbytes_returns_written_chunks():
+    async def main():
+        media = PipeMediaUpload(chunksize=4, max_buffer=16, timeout=5)
+        await media.write(b'abcdef')
+        media.close()
+        return media.getbytes(0, 4), media.getbytes(4, 4)
+
+    # Короткий ответ — конец потока
+    assert asyncio.run(main()) == (b'abcd', b'ef')
+
+
+def test_getbytes_waits_for_producer():
+    async def main():
+        media = PipeMediaUpload(chunksize=4, max_buffer=16, timeout=5)
+        loop = asyncio.get_running_loop()
+        reading = loop.run_in_executor(None, media.getbytes, 0, 4)
+        await asyncio.sleep(0.05)
+        assert not reading.done()
+        await media.write(b'ab')
+        await media.write(b'cd')
+        return await reading
+
+    assert asyncio.run(main()) == b'abcd'
+
+
+def test_getbytes_cannot_rewind_past_acknowledged_bytes():
+    async def main():
+        media = PipeMediaUpload(chunksize=4, max_buffer=16, timeout=5)
+        await media.write(b'abcdefgh')
+        media.getbytes(4, 4)
+        with pytest.raises(IOError):
+            media.getbytes(0, 4)
+        # Повтор с последнего подтверждённого места возможен
+        assert media.getbytes(4, 4) == b'efgh'
+
+    asyncio.run(main())
+
+
+def test_writer_waits_for_free_space():
+    async def main():
+        media = PipeMediaUpload(chunksize=4, max_buffer=8, timeout=5)
+        await media.write(b'x' * 8)
+        writing = asyncio.ensure_future(media.write(b'y' * 4))
+        await asyncio.sleep(0.05)
+        assert not writing.done()
+        # Загрузка подтвердила первые 8 байт — место освободилось
+        await asyncio.get_running_loop().run_in_executor(None, media.getbytes, 8, 4)
+        await asyncio.wait_for(writing, 1)
+
+    asyncio.run(main())
+
+
+def test_abort_wakes_reader_and_writer():
+    async def main():
+        media = PipeMediaUpload(chunksize=4, max_buffer=8, timeout=5)
+        loop = asyncio.get_running_loop()
+        reading = loop.run_in_executor(None, media.getbytes, 0, 4)
+        await asyncio.sleep(0.05)
+        media.abort(RuntimeError('энкодер упал'))
+        with pytest.raises(RuntimeError):
+            await reading
+        with pytest.raises(RuntimeError):
+            await media.write(b'data')
+
+    asyncio.run(main())
+
+
+def test_getbytes_times_out_without_data():
+    media = PipeMediaUpload(chunksize=4, max_buffer=8, timeout=0.05)
+    with pytest.raises(TimeoutError):
+        media.getbytes(0, 4)
+    # После таймаута поток прерван и для производителя
+    with pytest.raises(TimeoutError):
+        asyncio.run(media.write(b'late'))
+
+
+def test_stream_cannot_be_serialized():
+    with pytest.raises(NotImplementedError):
+        PipeMediaUpload().to_json()
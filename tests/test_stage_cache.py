@@ -0,0 +1,82 @@
+import os
+
+from stage_cache import StageCache
+
+
+def _write(path, size: int) -> str:
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    return str(path)
+
+
+def test_store_and_restore(tmp_path):
+    cache = StageCache(tmp_path / 'cache', max_bytes=1024)
+    source = _write(tmp_path / 'render.mp4', 100)
+    cache.store('render', 'key', source)
+
+    target = tmp_path / 'job' / 'render.mp4'
+    assert cache.restore('render', 'key', target) == str(target)
+    assert target.read_bytes() == b'x' * 100
+    # Удаление файла в задаче не задевает запись кэша
+    target.unlink()
+    assert cache.restore('render', 'key', tmp_path / 'other.mp4')
+
+
+def test_restore_missing_entry(tmp_path):
+    cache = StageCache(tmp_path / 'cache', max_bytes=1024)
+    assert cache.restore('render', 'missing', tmp_path / 'render.mp4') is None
+
+
+def test_json_entries(tmp_path):
+    cache = StageCache(tmp_path / 'cache', max_bytes=1024)
+    cache.put_json('transcribe', 'key', [{'text': 'привет', 'start': 0.0}])
+    assert cache.get_json('transcribe', 'key') == [{'text': 'привет', 'start': 0.0}]
+    assert cache.get_json('transcribe', 'other') is None
+
+
+def test_trim_evicts_least_recently_used(tmp_path):
+    cache = StageCache(tmp_path / 'cache', max_bytes=350)
+    for age, key in enumerate(('used', 'old', 'new')):
+        cache.store('cut', key, _write(tmp_path / f"{key}.mp4", 100))
+        os.utime(tmp_path / 'cache' / 'cut' / key, (1000 + age, 1000 + age))
+    # Чтение обновляет время использования: 'used' становится самой свежей записью
+    cache.restore('cut', 'used', tmp_path / 'restored.mp4')
+    cache.store('cut', 'newest', _write(tmp_path / 'newest.mp4', 100))
+
+    assert sorted(os.listdir(tmp_path / 'cache' / 'cut')) == ['new', 'newest', 'used']
+    assert cache._total == 300
+
+
+def test_store_trims_only_over_limit(tmp_path, monkeypatch):
+    cache = StageCache(tmp_path / 'cache', max_bytes=1000)
+    source = _write(tmp_path / 'clip.mp4', 100)
+    trims = []
+    monkeypatch.setattr(cache, 'trim', lambda: trims.append(True))
+    for key in ('a', 'b', 'c'):
+        cache.store('cut', key, source)
+    assert trims == []
+    assert cache._total == 300
+
+
+def test_key_depends_only_on_stage_settings(tmp_path):
+    cache = StageCache(tmp_path / 'cache', max_bytes=1024)
+    settings = {'clips': {'duration_seconds': 60}, 'headers': {'top': 'A'}}
+    base = cache.run(settings)
+    longer_clips = cache.run({**settings, 'clips': {'duration_seconds': 30}})
+    other_header = cache.run({**settings, 'headers': {'top': 'B'}})
+
+    assert base.key('cut', 'render') != longer_clips.key('cut', 'render')
+    assert base.key('render', 'source') == longer_clips.key('render', 'source')
+    assert base.key('render', 'source') != other_header.key('render', 'source')
+    assert base.key('download', 'video') == other_header.key('download', 'video')
+
+
+def test_disabled_cache(tmp_path):
+    assert StageCache(tmp_path, max_bytes=0).run({}) is None
+
+
+def test_replacing_entry_is_not_counted_twice(tmp_path):
+    cache = StageCache(tmp_path / 'cache', max_bytes=1000)
+    cache.store('render', 'key', _write(tmp_path / 'first.mp4', 100))
+    cache.store('render', 'key', _write(tmp_path / 'second.mp4', 150))
+    assert cache._total == 150
@@ -0,0 +1,49 @@
+import os
+
+import pytest
+
+pytest.importorskip('googleapiclient')
+pytest.importorskip('google_auth_oauthlib')
+
+from storage_sinks import LocalSink
+
+
+def test_upload_links_file_into_folder(tmp_path):
+    clip = tmp_path / 'clip 1.mp4'
+    clip.write_bytes(b'video')
+    sink = LocalSink(tmp_path / 'public', base_url='https://cdn.example.com/clips/')
+
+    stored = sink.upload_file(str(clip), 'final_videos_1', 'job_a')
+
+    target = tmp_path / 'public' / 'final_videos_1' / 'job_a' / 'clip 1.mp4'
+    assert target.read_bytes() == b'video'
+    assert stored.id == 'final_videos_1/job_a/clip 1.mp4'
+    assert stored.link == 'https://cdn.example.com/clips/final_videos_1/job_a/clip%201.mp4'
+    # На той же файловой системе файл не копируется
+    assert os.path.samefile(clip, target)
+    assert not list(target.parent.glob('*.part'))
+
+
+def test_jobs_do_not_overwrite_each_other(tmp_path):
+    sink = LocalSink(tmp_path / 'public')
+    clip = tmp_path / 'clip_0_0.mp4'
+    clip.write_bytes(b'first job')
+    first = sink.upload_file(str(clip), 'final_videos_1', 'job_a')
+    clip.unlink()
+    clip.write_bytes(b'second job')
+
+    second = sink.upload_file(str(clip), 'final_videos_1', 'job_b')
+
+    assert first.id != second.id
+    assert first.link != second.link
+    # Ссылка, выданная первой задаче, по-прежнему ведёт на её клип
+    assert (tmp_path / 'public' / first.id).read_bytes() == b'first job'
+    assert (tmp_path / 'public' / second.id).read_bytes() == b'second job'
+
+
+def test_finalize_and_streaming(tmp_path):
+    sink = LocalSink(tmp_path)
+    sink.finalize(['file:///clip.mp4'])
+    assert not sink.supports_streaming
+    with pytest.raises(NotImplementedError):
+        sink.upload_stream(None, 'clip.mp4', 'folder')
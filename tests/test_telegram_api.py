@@ -0,0 +1,104 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+
+telegram = pytest.importorskip('telegram')
+
+import telegram_api
+
+TOKEN = '123456:TEST'
+
+
+class StubBotApiHandler(BaseHTTPRequestHandler):
+    """Заглушка сервера Bot API: отвечает на getMe и sendDocument и записывает запросы"""
+
+    def do_POST(self):
+        method = self.path.rsplit('/', 1)[-1]
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        content_type = self.headers.get('Content-Type', '')
+        self.server.calls.append((method, content_type, body))
+        if method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Stub', 'username': 'stub_bot'}
+        else:
+            result = {
+                'message_id': 1, 'date': 0, 'chat': {'id': 42, 'type': 'private'},
+                'document': {'file_id': 'file', 'file_unique_id': 'unique'},
+            }
+        payload = json.dumps({'ok': True, 'result': result}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def bot_api_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubBotApiHandler)
+    server.calls = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _use_server(monkeypatch, server, local_mode: bool) -> None:
+    base = f"http://127.0.0.1:{server.server_port}"
+    monkeypatch.setattr(telegram_api, 'TELEGRAM_API_BASE_URL', f"{base}/bot")
+    monkeypatch.setattr(telegram_api, 'TELEGRAM_API_FILE_URL', f"{base}/file/bot")
+    monkeypatch.setattr(telegram_api, 'TELEGRAM_LOCAL_MODE', local_mode)
+
+
+def _send_document(path) -> None:
+    async def main():
+        async with telegram.Bot(TOKEN, **telegram_api.bot_options()) as bot:
+            await bot.send_document(chat_id=42, document=path.resolve(), filename='final_videos_42.zip')
+
+    asyncio.run(main())
+
+
+def _document_call(server):
+    calls = [call for call in server.calls if call[0] == 'sendDocument']
+    assert len(calls) == 1
+    return calls[0]
+
+
+def test_bot_options_for_local_server(monkeypatch, bot_api_server):
+    _use_server(monkeypatch, bot_api_server, local_mode=True)
+    options = telegram_api.bot_options()
+    assert options['base_url'].endswith('/bot')
+    assert options['base_file_url'].endswith('/file/bot')
+    assert options['local_mode'] is True
+
+
+def test_local_mode_sends_file_path(monkeypatch, bot_api_server, tmp_path):
+    _use_server(monkeypatch, bot_api_server, local_mode=True)
+    archive = tmp_path / 'final_videos_42.zip'
+    archive.write_bytes(b'PK' + b'\0' * 1024)
+
+    _send_document(archive)
+
+    _, content_type, body = _document_call(bot_api_server)
+    # Серверу передаётся путь, сам файл не загружается
+    assert not content_type.startswith('multipart/')
+    params = json.loads(body) if 'json' in content_type else {k: v[0] for k, v in parse_qs(body.decode()).items()}
+    assert params['document'] == archive.resolve().as_uri()
+
+
+def test_public_mode_uploads_file(monkeypatch, bot_api_server, tmp_path):
+    _use_server(monkeypatch, bot_api_server, local_mode=False)
+    archive = tmp_path / 'final_videos_42.zip'
+    archive.write_bytes(b'PK' + b'\0' * 1024)
+
+    _send_document(archive)
+
+    _, content_type, body = _document_call(bot_api_server)
+    assert content_type.startswith('multipart/form-data')
+    assert b'PK' in body
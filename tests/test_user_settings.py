@@ -0,0 +1,84 @@
+import asyncio
+import copy
+import json
+import pickle
+
+import pytest
+
+from user_settings import FrozenDict, SettingsRepository, get_value
+
+
+def _read(repository: SettingsRepository, chat_id: int) -> dict:
+    with open(repository.path(chat_id), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def test_defaults_written_on_first_read(tmp_path):
+    repository = SettingsRepository(tmp_path, flush_delay=60)
+    entry = repository.get(1)
+    assert entry.version == 1
+    # Вне цикла событий запись идёт сразу
+    assert _read(repository, 1) == entry.settings
+
+
+def test_existing_file_is_completed_with_defaults(tmp_path):
+    (tmp_path / '1.json').write_text(json.dumps({'clips': {'duration_seconds': 15}}), encoding='utf-8')
+    settings = SettingsRepository(tmp_path, flush_delay=60).get(1).settings
+    assert get_value(settings, 'clips.duration_seconds') == 15
+    assert 'headers' in settings
+
+
+def test_update_bumps_version_and_keeps_old_snapshot(tmp_path):
+    repository = SettingsRepository(tmp_path, flush_delay=60)
+    before = repository.get(1)
+    after = repository.update(1, {'headers': {'top': 'Новый'}})
+
+    assert after.version == before.version + 1
+    assert get_value(after.settings, 'headers.top') == 'Новый'
+    assert get_value(after.settings, 'headers.bottom') == get_value(before.settings, 'headers.bottom')
+    assert get_value(before.settings, 'headers.top') != 'Новый'
+    assert repository.get(1) is after
+
+
+def test_snapshot_is_read_only(tmp_path):
+    settings = SettingsRepository(tmp_path, flush_delay=60).get(1).settings
+    assert isinstance(settings, FrozenDict)
+    with pytest.raises(TypeError):
+        settings['headers'] = {}
+    with pytest.raises(TypeError):
+        settings['headers']['top'] = 'x'
+    assert copy.deepcopy(settings) == settings
+    assert pickle.loads(pickle.dumps(settings)) == settings
+
+
+def test_writes_are_batched_inside_event_loop(tmp_path):
+    repository = SettingsRepository(tmp_path, flush_delay=60)
+    repository.get(1)
+    written = _read(repository, 1)
+
+    async def main():
+        repository.update(1, {'headers': {'top': 'A'}})
+        repository.update(1, {'headers': {'top': 'B'}})
+        # Запись отложена на flush_delay: файл ещё старый
+        assert _read(repository, 1) == written
+        repository._flush_handle.cancel()
+
+    asyncio.run(main())
+    repository.flush()
+    assert get_value(_read(repository, 1), 'headers.top') == 'B'
+    assert not list(tmp_path.glob('.*.tmp'))
+
+
+def test_flush_after_delay(tmp_path):
+    repository = SettingsRepository(tmp_path, flush_delay=0.01)
+    repository.get(1)
+
+    async def main():
+        repository.update(1, {'clips': {'duration_seconds': 45}})
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if get_value(_read(repository, 1), 'clips.duration_seconds') == 45:
+                return True
+        return False
+
+    assert asyncio.run(main())
@@ -0,0 +1,121 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+yt_dlp = pytest.importorskip('yt_dlp')
+
+from youtube_downloader import YouTubeDownloader, YoutubeDLPool, info_is_fresh
+
+
+class FakeYoutubeDL:
+    def __init__(self, params):
+        self.params = params
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(yt_dlp, 'YoutubeDL', FakeYoutubeDL)
+    return YoutubeDLPool(max_idle_per_key=2)
+
+
+def test_instance_is_reused_for_same_options(pool):
+    opts = {'quiet': True, 'noplaylist': True}
+    with pool.acquire('info', opts) as first:
+        pass
+    with pool.acquire('info', dict(opts)) as second:
+        assert second is first
+
+
+def test_concurrent_calls_get_separate_instances(pool):
+    with pool.acquire('info', {'quiet': True}) as first:
+        with pool.acquire('info', {'quiet': True}) as second:
+            assert second is not first
+
+
+def test_options_are_part_of_the_key(pool):
+    with pool.acquire('playlist', {'extract_flat': 'in_playlist', 'playlistend': 10}) as first:
+        pass
+    with pool.acquire('playlist', {'extract_flat': 'in_playlist', 'playlistend': 50}) as second:
+        assert second is not first
+        assert second.params['playlistend'] == 50
+    with pool.acquire('info', {'extract_flat': 'in_playlist', 'playlistend': 10}) as other_profile:
+        assert other_profile is not first
+
+
+def test_per_call_options_do_not_split_the_pool(pool):
+    with pool.acquire('download', {'format': 'best', 'outtmpl': 'a.%(ext)s'}) as first:
+        pass
+    with pool.acquire('download', {'format': 'best', 'outtmpl': 'b.%(ext)s'}) as second:
+        assert second is first
+
+
+def test_idle_instances_are_bounded(pool):
+    opts = {'quiet': True}
+    with pool.acquire('info', opts) as a, pool.acquire('info', opts) as b, pool.acquire('info', opts) as c:
+        instances = (a, b, c)
+    # В пуле остаются max_idle_per_key экземпляров, лишний закрывается
+    assert sorted(ydl.closed for ydl in instances) == [False, False, True]
+
+
+def test_changed_cookies_discard_instances(pool, tmp_path):
+    cookies = tmp_path / 'cookies.txt'
+    cookies.write_text('# Netscape HTTP Cookie File\n')
+    opts = {'cookiefile': str(cookies)}
+    with pool.acquire('info', opts) as first:
+        pass
+    stat = cookies.stat()
+    os.utime(cookies, (stat.st_atime, stat.st_mtime + 10))
+    with pool.acquire('info', opts) as second:
+        assert second is not first
+    assert first.closed
+    # Закрытие устаревшего экземпляра не должно перезаписать новый файл cookies
+    assert 'cookiefile' not in first.params
+
+
+def test_info_freshness():
+    assert info_is_fresh({'epoch': time.time() - 10}, ttl=60)
+    assert not info_is_fresh({'epoch': time.time() - 120}, ttl=60)
+    assert not info_is_fresh({'title': 'без времени извлечения'}, ttl=60)
+    assert not info_is_fresh(None, ttl=60)
+
+
+class ExtractingYoutubeDL(FakeYoutubeDL):
+    extracted = 0
+    processed = 0
+
+    def extract_info(self, url, download=False):
+        ExtractingYoutubeDL.extracted += 1
+        return {'id': 'abc', 'title': 'Видео', 'epoch': time.time(), 'duration': 900, 'protocol': 'https', 'url': url}
+
+    def process_ie_result(self, info, download=False):
+        ExtractingYoutubeDL.processed += 1
+        return info
+
+    cookiejar = type('CookieJar', (), {'get_cookies_for_url': staticmethod(lambda url: [])})()
+
+
+def test_video_info_is_extracted_once(monkeypatch, tmp_path):
+
+    monkeypatch.setattr(yt_dlp, 'YoutubeDL', ExtractingYoutubeDL)
+    monkeypatch.setattr(ExtractingYoutubeDL, 'extracted', 0)
+    monkeypatch.setattr(ExtractingYoutubeDL, 'processed', 0)
+    downloader = YouTubeDownloader(tmp_path, pool=YoutubeDLPool())
+    url = 'https://www.youtube.com/watch?v=abc'
+
+    async def main():
+        info = await downloader.get_video_info(url)
+        assert await downloader.get_video_info(url) is info
+        return await downloader.resolve_stream(url, info=info)
+
+    source = asyncio.run(main())
+    # Прогноз, повторный запрос и прямой поток — одно извлечение; форматы выбираются из него
+    assert ExtractingYoutubeDL.extracted == 1
+    assert ExtractingYoutubeDL.processed == 1
+    assert source['video_url'] == url
+    assert source['duration'] == 900.0
@@ -0,0 +1,42 @@
+import logging
+import time
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from faster_whisper import WhisperModel
+from tqdm import tqdm
+
+logger = logging.getLogger(__name__)
+
+# Транскрибация в процессе пула executors.transcribe_executor.
+# Модель загружается один раз на процесс и живёт до его перезапуска пулом.
+
+_model: Optional[WhisperModel] = None
+
+
+def _get_model() -> WhisperModel:
+    global _model
+    if _model is None:
+        _model = WhisperModel("base", device="cpu", compute_type="int8")
+        logger.info("Модель Faster-Whisper 'base' загружена в процессе транскрибации (CPU, int8)")
+    return _model
+
+
+def transcribe(source: Union[str, np.ndarray], language: str = 'ru', beam_size: int = 5) -> Tuple[List[Dict], Dict]:
+    """Субтитры по словам из файла или PCM 16 кГц и сведения о распознавании (длительность, язык, время работы)"""
+    model = _get_model()
+    started = time.monotonic()
+    segments, info = model.transcribe(source, word_timestamps=True, language=language, beam_size=beam_size)
+    subtitles = []
+    with tqdm(total=info.duration, desc="🎤 Обработка речи", unit="сек") as pbar:
+        for segment in segments:
+            if segment.words:
+                for word in segment.words:
+                    subtitles.append({'start': word.start, 'end': word.end, 'text': word.word.strip(), 'confidence': word.probability})
+            pbar.update(segment.end - segment.start)
+    return subtitles, {
+        'duration': info.duration,
+        'language': info.language,
+        'language_probability': info.language_probability,
+        'elapsed': time.monotonic() - started,
+    }
@@ -0,0 +1,208 @@
+import asyncio
+import logging
+import time
+from contextlib import suppress
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from config import UPLOAD_MAX_CONCURRENT_PER_JOB
+from cost_model import CostModel
+from executors import upload_executor
+from pipe_upload import PipeMediaUpload
+from storage_sinks import StorageSink, StoredFile, get_sink
+from job_store import JobCheckpoint
+from workspace import Workspace
+
+logger = logging.getLogger(__name__)
+
+
+class UploadStage:
+    """Загрузка клипов задачи в хранилище (StorageSink) по мере нарезки.
+
+    Клип уходит в загрузку сразу после записи, не дожидаясь остальных; одновременно
+    грузится не больше `max_concurrent` клипов задачи (общий предел на машину —
+    потоки upload_executor). Локальный файл клипа удаляется, как только загрузка
+    подтверждена. Ссылки возвращаются в порядке клипов, а не завершения загрузок.
+    Если хранилище принимает поток, клип можно и не записывать на диск: submit_stream()
+    запускает энкодер, чей вывод сразу уходит в загрузку через ограниченный буфер в памяти.
+    Перед выдачей ссылок хранилище получает их все разом (sink.finalize) — например,
+    Google Drive в режиме 'batch' открывает доступ одним batch-запросом.
+
+    С `hold_limit` клипы сначала придерживаются локально: если весь результат уложится
+    в этот объём, его выгоднее отправить в чат одним архивом, минуя облако. Как только
+    прогноз (account_render) или уже накопленные клипы его превышают, стадия переходит
+    к обычной загрузке, отправив и накопленное.
+    """
+
+    def __init__(
+        self, folder_name: str, clip_duration: float, checkpoint: Optional[JobCheckpoint] = None,
+        workspace: Optional[Workspace] = None, cost_model: Optional[CostModel] = None,
+        sink: Optional[StorageSink] = None, max_concurrent: int = UPLOAD_MAX_CONCURRENT_PER_JOB,
+        hold_limit: int = 0, on_clip: Optional[Callable[[Tuple, str], None]] = None, job: str = '',
+    ):
+        self.folder_name = folder_name
+        # Метка задачи в пути клипов (см. StorageSink)
+        self.job = job
+        self.clip_duration = clip_duration
+        self.checkpoint = checkpoint
+        self.workspace = workspace
+        self.cost_model = cost_model
+        self.sink = sink or get_sink()
+        self._limit = asyncio.Semaphore(max_concurrent)
+        self._uploads: Dict[Tuple, asyncio.Task] = {}
+        # Сообщать о каждом загруженном клипе сразу (для выдачи клипов по готовности)
+        self.on_clip = on_clip
+        self.hold_limit = hold_limit
+        self.holding = hold_limit > 0
+        self._held: Dict[Tuple, Path] = {}
+        self._rendered_bytes = 0
+        self._rendered_seconds = 0.0
+
+    @property
+    def can_stream(self) -> bool:
+        """Можно ли сейчас грузить клипы прямо из энкодера (submit_stream)"""
+        return self.sink.supports_streaming and not self.holding
+
+    def uploaded(self, clip_path: Path) -> Optional[str]:
+        """Ссылка на клип, если он уже загружен (например, до перезапуска)"""
+        return self.checkpoint.get('upload', clip_path.name) if self.checkpoint else None
+
+    def submit(self, order: Tuple, clip_path: Path) -> None:
+        """Поставить записанный клип в загрузку; `order` задаёт место ссылки в итоговом списке"""
+        if self.holding:
+            self._held[order] = clip_path
+            if self.held_bytes() > self.hold_limit:
+                logger.info("Клипы не уместятся в архив для Telegram, загружаем в хранилище")
+                self.release()
+            return
+        self._track(order, asyncio.ensure_future(self._upload(clip_path)))
+
+    def account_render(self, size: int, seconds: float, total_seconds: float) -> None:
+        """Учесть готовый рендер: по его битрейту прогнозируется объём всех клипов задачи"""
+        if not self.holding:
+            return
+        self._rendered_bytes += size
+        self._rendered_seconds += seconds
+        projected = self._rendered_bytes / max(self._rendered_seconds, 1.0) * total_seconds
+        if projected > self.hold_limit:
+            logger.info(f"Прогноз объёма клипов {projected / 1024 / 1024:.0f} МБ — больше лимита архива, загружаем в хранилище")
+            self.release()
+
+    def held(self) -> List[Path]:
+        """Придержанные клипы по порядку"""
+        return [self._held[order] for order in sorted(self._held)]
+
+    def held_bytes(self) -> int:
+        return sum(path.stat().st_size for path in self._held.values() if path.exists())
+
+    def release(self) -> None:
+        """Перестать придерживать клипы и отправить накопленные в загрузку"""
+        if not self.holding:
+            return
+        self.holding = False
+        for order, clip_path in sorted(self._held.items()):
+            self.submit(order, clip_path)
+        self._held.clear()
+
+    def submit_stream(self, order: Tuple, name: str, produce: Callable[[Callable[[bytes], Awaitable[None]]], Awaitable[Any]]) -> None:
+        """Загрузить клип `name` прямо из энкодера: `produce(sink)` запускает его и отдаёт вывод в sink"""
+        self._track(order, asyncio.ensure_future(self._upload_stream(name, produce)))
+
+    def _track(self, order: Tuple, task: asyncio.Task) -> None:
+        self._uploads[order] = task
+        if self.on_clip:
+            task.add_done_callback(lambda done: self._announce(order, done))
+
+    def _announce(self, order: Tuple, task: asyncio.Task) -> None:
+        if task.cancelled() or task.exception() is not None or not task.result():
+            return
+        try:
+            self.on_clip(order, task.result())
+        except Exception as e:
+            logger.debug(f"Ошибка уведомления о клипе {order}: {e}")
+
+    async def _upload(self, clip_path: Path) -> Optional[str]:
+        direct_link = self.uploaded(clip_path)
+        if direct_link:
+            self._discard(clip_path)
+            return direct_link
+        async with self._limit:
+            started = time.monotonic()
+            stored = await upload_executor.run(self.sink.upload_file, str(clip_path), self.folder_name, self.job)
+        direct_link = self._confirm(clip_path.name, stored, started)
+        if direct_link:
+            # Загрузка подтверждена — локальная копия больше не нужна
+            self._discard(clip_path)
+        return direct_link
+
+    async def _upload_stream(self, name: str, produce) -> Optional[str]:
+        direct_link = self.checkpoint.get('upload', name) if self.checkpoint else None
+        if direct_link:
+            return direct_link
+        async with self._limit:
+            started = time.monotonic()
+            media = PipeMediaUpload()
+            loop = asyncio.get_running_loop()
+            attached = asyncio.Event()
+
+            def upload_in_thread() -> StoredFile:
+                loop.call_soon_threadsafe(attached.set)
+                return self.sink.upload_stream(media, name, self.folder_name, self.job)
+
+            upload = asyncio.ensure_future(upload_executor.run(upload_in_thread))
+            # Загрузка упала — энкодер не должен вечно ждать места в буфере
+            upload.add_done_callback(lambda task: task.cancelled() or task.exception() is None or media.abort(task.exception()))
+            # Энкодер запускается, только когда загрузка получила поток пула: иначе он
+            # занимает слот ffmpeg, а поток загрузки, ждущий его данных, — место в пуле,
+            # и при заполненных пулах обе стороны ждут друг друга
+            attaching = asyncio.ensure_future(attached.wait())
+            try:
+                try:
+                    await asyncio.wait([upload, attaching], return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    attaching.cancel()
+                if not upload.done():
+                    await produce(media.write)
+                media.close()
+            except BaseException as e:
+                # Энкодер упал или отменён — загрузка не должна ждать данных вечно (и наоборот)
+                media.abort(e)
+                with suppress(BaseException):
+                    await upload
+                raise
+            stored = await upload
+        return self._confirm(name, stored, started)
+
+    def _confirm(self, name: str, stored: StoredFile, started: float) -> Optional[str]:
+        direct_link = stored.link
+        if not direct_link:
+            return None
+        if self.cost_model:
+            self.cost_model.record('upload', self.clip_duration, time.monotonic() - started)
+        if self.checkpoint:
+            self.checkpoint.done('upload', direct_link, item=name)
+        return direct_link
+
+    def _discard(self, clip_path: Path) -> None:
+        if self.workspace:
+            self.workspace.discard(clip_path)
+        else:
+            clip_path.unlink(missing_ok=True)
+
+    async def links(self) -> List[str]:
+        """Дождаться всех загрузок и вернуть ссылки по порядку клипов"""
+        orders = sorted(self._uploads)
+        results = await asyncio.gather(*(self._uploads[order] for order in orders), return_exceptions=True)
+        links = []
+        for order, result in zip(orders, results):
+            if isinstance(result, BaseException):
+                logger.error(f"Ошибка загрузки клипа {order}: {result}")
+            elif result:
+                links.append(result)
+        if links:
+            await upload_executor.run(self.sink.finalize, links)
+        return links
+
+    def cancel(self) -> None:
+        for task in self._uploads.values():
+            task.cancel()
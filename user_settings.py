@@ -1,6 +1,12 @@
+import asyncio
+import atexit
+import hashlib
 import json
+import logging
+import os
+import threading
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, NamedTuple, Optional, Set, Tuple
 
 from config import (
     DEFAULT_TOP_HEADER, DEFAULT_BOTTOM_HEADER,
@@ -10,17 +16,16 @@ from config import (
     BANNER_ENABLED, BANNER_PATH, BANNER_X, BANNER_Y,
     CHROMA_KEY_COLOR, CHROMA_KEY_SIMILARITY, CHROMA_KEY_BLEND,
     BACKGROUND_MUSIC_ENABLED, BACKGROUND_MUSIC_PATH, BACKGROUND_MUSIC_VOLUME,
-    CLIP_DURATION_SECONDS
+    CLIP_DURATION_SECONDS, SETTINGS_FLUSH_DELAY,
 )
+from executors import io_executor
+
+logger = logging.getLogger(__name__)
 
 SETTINGS_DIR = Path('user_settings')
 SETTINGS_DIR.mkdir(exist_ok=True)
 
 
-def _settings_path(chat_id: int) -> Path:
-    return SETTINGS_DIR / f"{chat_id}.json"
-
-
 def _default_settings() -> Dict[str, Any]:
     return {
         "headers": {
@@ -62,39 +67,186 @@ def _default_settings() -> Dict[str, Any]:
     }
 
 
+class FrozenDict(dict):
+    """Неизменяемый dict: снимок настроек, общий для всех читателей.
+
+    Читается и сериализуется (json, pickle) как обычный dict; любое изменение — TypeError.
+    Менять настройки можно только через update_user_settings.
+    """
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("Снимок настроек неизменяем, используйте update_user_settings")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __reduce__(self):
+        return FrozenDict, (dict(self),)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+def freeze(value: Any) -> Any:
+    """Рекурсивно неизменяемая копия: dict -> FrozenDict, list -> tuple"""
+    if isinstance(value, FrozenDict):
+        return value
+    if isinstance(value, dict):
+        return FrozenDict({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+class SettingsEntry(NamedTuple):
+    version: int                 # растёт с каждым изменением настроек чата
+    settings: Dict[str, Any]     # неизменяемый снимок (FrozenDict)
+
+
+class SettingsRepository:
+    """Настройки пользователей: кэш в памяти и отложенная запись на диск.
+
+    Файл чата читается и дополняется значениями по умолчанию один раз, дальше все
+    чтения идут из памяти и возвращают один и тот же неизменяемый снимок. Изменение
+    создаёт новый снимок со следующей версией и помечает чат изменённым; изменённые
+    чаты записываются пачкой через `flush_delay` секунд в пуле io_executor (без цикла
+    событий — сразу). Запись атомарная: временный файл, fsync и переименование.
+    """
+
+    def __init__(self, directory: Path = SETTINGS_DIR, flush_delay: float = SETTINGS_FLUSH_DELAY):
+        self.directory = Path(directory)
+        self.flush_delay = flush_delay
+        self._entries: Dict[int, SettingsEntry] = {}
+        self._dirty: Set[int] = set()
+        self._lock = threading.RLock()
+        # Записи на диск идут по одной: более поздняя запись всегда пишет более новую версию
+        self._write_lock = threading.Lock()
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+
+    def path(self, chat_id: int) -> Path:
+        return self.directory / f"{chat_id}.json"
+
+    def get(self, chat_id: int) -> SettingsEntry:
+        with self._lock:
+            entry = self._entries.get(chat_id)
+            if entry is not None:
+                return entry
+            settings, changed = self._read(chat_id)
+            entry = SettingsEntry(1, freeze(settings))
+            self._entries[chat_id] = entry
+            if changed:
+                self._dirty.add(chat_id)
+        if changed:
+            self._schedule_flush()
+        return entry
+
+    def update(self, chat_id: int, patch: Dict[str, Any]) -> SettingsEntry:
+        current = self.get(chat_id)
+        with self._lock:
+            # Повторно берём запись под блокировкой: между get и merge мог пройти другой update
+            current = self._entries.get(chat_id, current)
+            entry = self._put(chat_id, _deep_merge(current.settings, patch))
+        self._schedule_flush()
+        return entry
+
+    def replace(self, chat_id: int, settings: Dict[str, Any]) -> SettingsEntry:
+        with self._lock:
+            entry = self._put(chat_id, settings)
+        self._schedule_flush()
+        return entry
+
+    def _put(self, chat_id: int, settings: Dict[str, Any]) -> SettingsEntry:
+        current = self._entries.get(chat_id)
+        entry = SettingsEntry(current.version + 1 if current else 1, freeze(settings))
+        self._entries[chat_id] = entry
+        self._dirty.add(chat_id)
+        return entry
+
+    def _read(self, chat_id: int) -> Tuple[Dict[str, Any], bool]:
+        """Настройки из файла, дополненные значениями по умолчанию, и признак, что файл надо переписать"""
+        path = self.path(chat_id)
+        if not path.exists():
+            return _default_settings(), True
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            merged = _deep_merge(_default_settings(), data)
+            return merged, merged != data
+        except Exception as e:
+            logger.warning(f"Повреждённые настройки чата {chat_id}, используем значения по умолчанию: {e}")
+            return _default_settings(), True
+
+    def _schedule_flush(self) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Вне цикла событий (скрипты, worker до запуска) — пишем сразу
+            self.flush()
+            return
+        with self._lock:
+            if self._flush_handle is None:
+                self._flush_handle = loop.call_later(self.flush_delay, self._flush_later)
+
+    def _flush_later(self) -> None:
+        with self._lock:
+            self._flush_handle = None
+        asyncio.ensure_future(io_executor.run(self.flush))
+
+    def flush(self) -> None:
+        """Записать на диск все изменённые настройки"""
+        with self._write_lock:
+            with self._lock:
+                dirty, self._dirty = self._dirty, set()
+                entries = {chat_id: self._entries[chat_id] for chat_id in dirty}
+            for chat_id, entry in entries.items():
+                try:
+                    self._write(chat_id, entry.settings)
+                except OSError as e:
+                    logger.error(f"Не удалось сохранить настройки чата {chat_id}: {e}")
+                    with self._lock:
+                        self._dirty.add(chat_id)
+
+    def _write(self, chat_id: int, settings: Dict[str, Any]) -> None:
+        path = self.path(chat_id)
+        temp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        try:
+            with open(temp, 'w', encoding='utf-8') as f:
+                json.dump(settings, f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp, path)
+        finally:
+            temp.unlink(missing_ok=True)
+
+
+settings_repository = SettingsRepository()
+# Несохранённые изменения записываются и при завершении процесса
+atexit.register(settings_repository.flush)
+
+
 def load_user_settings(chat_id: int) -> Dict[str, Any]:
-    path = _settings_path(chat_id)
-    if not path.exists():
-        settings = _default_settings()
-        save_user_settings(chat_id, settings)
-        return settings
-    try:
-        with open(path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        # ensure missing keys are filled from defaults
-        def_settings = _default_settings()
-        merged = _deep_merge(def_settings, data)
-        if merged != data:
-            save_user_settings(chat_id, merged)
-        return merged
-    except Exception:
-        # fallback to defaults if corrupted
-        settings = _default_settings()
-        save_user_settings(chat_id, settings)
-        return settings
+    """Текущие настройки чата (неизменяемый снимок из кэша)"""
+    return settings_repository.get(chat_id).settings
+
+
+def settings_snapshot(chat_id: int) -> Dict[str, Any]:
+    """Снимок настроек для задачи: не меняется, даже если пользователь изменит настройки во время обработки"""
+    return settings_repository.get(chat_id).settings
+
+
+def settings_version(chat_id: int) -> int:
+    return settings_repository.get(chat_id).version
 
 
 def save_user_settings(chat_id: int, settings: Dict[str, Any]) -> None:
-    path = _settings_path(chat_id)
-    with open(path, 'w', encoding='utf-8') as f:
-        json.dump(settings, f, ensure_ascii=False, indent=2)
+    settings_repository.replace(chat_id, settings)
 
 
 def update_user_settings(chat_id: int, patch: Dict[str, Any]) -> Dict[str, Any]:
-    current = load_user_settings(chat_id)
-    merged = _deep_merge(current, patch)
-    save_user_settings(chat_id, merged)
-    return merged
+    return settings_repository.update(chat_id, patch).settings
 
 
 def get_value(settings: Dict[str, Any], path: str, default: Optional[Any] = None) -> Any:
@@ -107,6 +259,13 @@ def get_value(settings: Dict[str, Any], path: str, default: Optional[Any] = None
     return node
 
 
+def settings_fingerprint(settings: Dict[str, Any], *paths: str) -> str:
+    """Стабильный хеш настроек (или только перечисленных поддеревьев `paths`)."""
+    subset: Any = settings if not paths else {p: get_value(settings, p) for p in paths}
+    payload = json.dumps(subset, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
 def _deep_merge(base: Dict[str, Any], override: Dict[str, Any]) -> Dict[str, Any]:
     result: Dict[str, Any] = dict(base)
     for k, v in override.items():
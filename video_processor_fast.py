@@ -1,21 +1,33 @@
+import asyncio
+import functools
 import os
 import zipfile
-from faster_whisper import WhisperModel
 import ffmpeg
 from pathlib import Path
-from typing import List, Dict, Tuple, Optional
+from typing import Callable, List, Dict, Tuple, Optional
 import logging
-import asyncio
 import json
 import math
-import subprocess
 import tempfile
 import re
 from tqdm import tqdm
 import threading
 import time
-
-from google_drive_uploader import upload_to_drive
+import uuid
+
+from executors import io_executor, transcribe_executor
+from transcription_worker import transcribe
+from ffmpeg_runner import FFmpegRunner, FFmpegError
+from memory_admission import MemoryAdmission
+from cost_model import CostModel, render_feature
+from single_flight import SingleFlight
+from upload_stage import UploadStage
+from storage_sinks import sink_for
+from clip_delivery import ReadyClip
+from workspace import Workspace
+from job_store import JobCheckpoint
+from stage_cache import StageRun, file_stamp
+from user_settings import get_value
 
 from config import (
     FONT_PATH, FONT_SIZE, FONT_COLOR, STROKE_COLOR, STROKE_WIDTH, 
@@ -24,7 +36,8 @@ from config import (
     BANNER_ENABLED, BANNER_PATH, BANNER_X, BANNER_Y, 
     CHROMA_KEY_COLOR, CHROMA_KEY_SIMILARITY, CHROMA_KEY_BLEND,
     BACKGROUND_MUSIC_ENABLED, BACKGROUND_MUSIC_PATH, BACKGROUND_MUSIC_VOLUME,
-    CHUNK_DURATION_SECONDS, CLIP_DURATION_SECONDS
+    CHUNK_DURATION_SECONDS, CLIP_DURATION_SECONDS,
+    PREVIEW_DURATION, PREVIEW_MAX_CONCURRENT, UPLOAD_STREAMING, MAX_FILE_SIZE
 )
 
 from PIL import Image
@@ -33,132 +46,464 @@ import numpy as np
 
 logger = logging.getLogger(__name__)
 
+# Запас на заголовки ZIP на один файл (локальный и центральный заголовки с именем)
+ZIP_ENTRY_OVERHEAD = 256
+
 class FastVideoProcessor:
-    def __init__(self, temp_dir: Path):
+    def __init__(self, temp_dir: Path, ffmpeg_runner: Optional[FFmpegRunner] = None, memory: Optional[MemoryAdmission] = None, cost_model: Optional[CostModel] = None):
         self.temp_dir = temp_dir
         self.temp_dir.mkdir(exist_ok=True)
-        
-        try:
-            self.whisper_model = WhisperModel("base", device="cpu", compute_type="int8")
-            logger.info("Модель Faster-Whisper 'base' успешно загружена (CPU, int8)")
-        except Exception as e:
-            logger.error(f"Ошибка загрузки Faster-Whisper: {e}")
-            self.whisper_model = None
-
-    async def process_video(self, video_path: str, chat_id: int, top_header: str = None, bottom_header: str = None, background_music_path: Optional[str] = None, segment_duration: Optional[int] = None, settings: Optional[Dict] = None) -> Optional[str]:
-        """Основная функция обработки видео"""
+        # Все вызовы ffmpeg/ffprobe идут через общий асинхронный запускатель с лимитом на машину
+        self.ffmpeg = ffmpeg_runner or FFmpegRunner()
+        # Тяжёлые этапы стартуют, только если прогноз памяти укладывается в лимит
+        self.memory = memory or MemoryAdmission()
+        # Замеры длительности этапов для прогноза времени задач
+        self.costs = cost_model or CostModel()
+
+        # Одновременные задачи по одному исходнику (с разными настройками) делят транскрибацию
+        self._subtitles_flight = SingleFlight('subtitles')
+        # Предпросмотры идут мимо общей очереди ffmpeg, поэтому ограничены отдельно
+        self._preview_limit = asyncio.Semaphore(PREVIEW_MAX_CONCURRENT)
+
+    async def process_video(self, video_path: str, chat_id: int, top_header: str = None, bottom_header: str = None, background_music_path: Optional[str] = None, segment_duration: Optional[int] = None, settings: Optional[Dict] = None, workspace: Optional[Workspace] = None, checkpoint: Optional[JobCheckpoint] = None, allow_zip: bool = True, on_clip: Optional[Callable[[ReadyClip], None]] = None, stages: Optional[StageRun] = None, source_key: Optional[str] = None) -> Optional[str]:
+        """Основная функция обработки видео.
+
+        С `stages` и `source_key` (ID видео) готовые результаты этапов берутся из кэша этапов,
+        если их входы и настройки не менялись.
+        """
+        uploads = self.new_upload_stage(chat_id, segment_duration, workspace, checkpoint, allow_zip=allow_zip, settings=settings, on_clip=on_clip)
+        cuts: List[asyncio.Future] = []
         try:
-            chat_dir = self.temp_dir / str(chat_id)
-            chat_dir.mkdir(exist_ok=True)
+            # Рабочая папка задачи отделяет файлы одновременных задач одного чата друг от друга
+            chat_dir = workspace.path if workspace else self.temp_dir / str(chat_id)
+            chat_dir.mkdir(parents=True, exist_ok=True)
             
             video_info = await self.get_video_info(video_path)
             duration = video_info.get('duration', 0)
             
             logger.info(f"Обрабатываем видео длительностью {duration} секунд")
-            
-            if duration > 300:
-                chunks = await self.split_video_into_chunks(video_path, chat_dir)
+
+            chunk_count = math.ceil(duration / CHUNK_DURATION_SECONDS) if duration > 300 else 1
+            keys = [self._chunk_keys(stages, (source_key, 'file', duration), i, chunk_count, chat_id, top_header, bottom_header, background_music_path)
+                    for i in range(chunk_count)]
+            # Готовые рендеры: из контрольных точек задачи или из кэша этапов (оформление не менялось)
+            renders = [await self._finished_render(checkpoint, stages, render_key, i, chat_dir) for i, (_, render_key) in enumerate(keys)]
+
+            if duration > 300 and all(renders):
+                # Все чанки уже отрендерены — нарезка исходника на чанки не нужна
+                chunks = [None] * chunk_count
+            elif duration > 300:
+                chunks = checkpoint.get('split') if checkpoint else None
+                # После перезапуска чанки из RAM могли пропасть — если нужных нет, режем заново
+                pending = [i for i in range(len(chunks or [])) if i >= chunk_count or not renders[i]]
+                if not chunks or any(not os.path.exists(chunks[i]) for i in pending):
+                    chunks = await self.split_video_into_chunks(video_path, chat_dir, workspace=workspace)
+                    if checkpoint:
+                        checkpoint.done('split', chunks)
+                if len(chunks) != chunk_count:
+                    # Нарезка не удалась (видео целиком одним чанком) — ключи чанков к нему не подходят
+                    keys = [(None, None)] * len(chunks)
+                    renders = [None] * len(chunks)
             else:
                 chunks = [video_path]
             
-            processed_videos = []
             for i, chunk_path in enumerate(chunks):
-                logger.info(f"Обрабатываем чанк {i+1}/{len(chunks)}")
-                subtitles = await self.generate_subtitles(chunk_path)
-                vertical_video = await self.create_vertical_video_fast(
-                    chunk_path, subtitles, chat_dir, i, background_music_path, chat_id, top_header, bottom_header, settings=settings
-                )
+                transcribe_key, render_key = keys[i]
+                if self._render_uncacheable(checkpoint, i):
+                    render_key = None
+                vertical_video = renders[i]
+                if vertical_video:
+                    logger.info(f"Чанк {i+1}/{len(chunks)} уже обработан, пропускаем")
+                else:
+                    logger.info(f"Обрабатываем чанк {i+1}/{len(chunks)}")
+                    async with self._subtitles_flight.join(
+                        transcribe_key or (video_path, i, len(chunks)),
+                        lambda _report: self._transcribe_cached(checkpoint, stages, transcribe_key, i, lambda: self.generate_subtitles(chunk_path))
+                    ) as subtitles:
+                        vertical_video = await self.create_vertical_video_fast(
+                            chunk_path, subtitles or [], chat_dir, i, background_music_path, chat_id, top_header, bottom_header, settings=settings,
+                            scratch_dir=workspace.hot_dir if workspace else None
+                        )
+                    if subtitles is None:
+                        # Рендер без субтитров из-за сбоя транскрибации не кэшируем (и клипы из него тоже)
+                        render_key = self._mark_uncacheable(checkpoint, i)
+                    if vertical_video and render_key:
+                        await stages.store('render', render_key, vertical_video)
+                    elif vertical_video and stages:
+                        stages.done('render')
+                    if vertical_video and checkpoint:
+                        checkpoint.done('render', vertical_video, item=str(i))
+                if workspace and chunk_path and chunk_path != video_path:
+                    # Чанк больше не нужен — освобождаем RAM/диск сразу
+                    workspace.discard(chunk_path)
                 if vertical_video:
-                    processed_videos.append(vertical_video)
+                    chunk_seconds = min(CHUNK_DURATION_SECONDS, duration - i * CHUNK_DURATION_SECONDS) if len(chunks) > 1 else duration
+                    uploads.account_render(self.get_file_size(vertical_video), chunk_seconds, duration)
+                    # Клипы чанка режутся и загружаются, пока рендерится следующий
+                    cuts.append(asyncio.ensure_future(self.cut_clips(vertical_video, i, uploads, chat_id, workspace, checkpoint, stages, render_key)))
             
-            if processed_videos:
-                upload_result = await self.cut_and_upload_to_drive(processed_videos, chat_id, clip_duration=segment_duration)
-                return upload_result
+            if cuts:
+                return await self.finish_uploads(uploads, cuts, chat_id, workspace)
             
             return None
         except Exception as e:
             logger.error(f"Ошибка обработки видео: {e}")
             return None
-
-    async def cut_and_upload_to_drive(self, video_paths: List[str], chat_id: int, clip_duration: Optional[int] = None) -> Optional[str]:
-        """Нарезает видео на сегменты, загружает их на Google Drive и возвращает путь к файлу со ссылками."""
+        finally:
+            for cut in cuts:
+                cut.cancel()
+            uploads.cancel()
+
+    async def process_stream(self, source: Dict, chat_id: int, top_header: str = None, bottom_header: str = None, background_music_path: Optional[str] = None, segment_duration: Optional[int] = None, settings: Optional[Dict] = None, workspace: Optional[Workspace] = None, checkpoint: Optional[JobCheckpoint] = None, allow_zip: bool = True, on_clip: Optional[Callable[[ReadyClip], None]] = None, stages: Optional[StageRun] = None, source_key: Optional[str] = None) -> Optional[str]:
+        """Обработка без локальной копии: ffmpeg читает окна источника по прямым ссылкам (-ss на каждый чанк).
+
+        `source` — результат YouTubeDownloader.resolve_stream. На диск пишутся только результаты рендера.
+        `stages` и `source_key` — как в process_video.
+        """
+        uploads = self.new_upload_stage(chat_id, segment_duration, workspace, checkpoint, allow_zip=allow_zip, settings=settings, on_clip=on_clip)
+        cuts: List[asyncio.Future] = []
         try:
-            chat_dir = self.temp_dir / str(chat_id)
-            final_clips_dir = chat_dir / "final_clips"
-            final_clips_dir.mkdir(exist_ok=True)
-            
-            folder_name = f"final_videos_{chat_id}"
-            
-            # Выбор длительности клипа: параметр пользователя или значение по умолчанию из конфигурации
-            actual_clip_duration = clip_duration if clip_duration and clip_duration > 0 else CLIP_DURATION_SECONDS
-            
-            clip_paths = []
-            for i, video_path in enumerate(video_paths):
-                video_info = await self.get_video_info(video_path)
-                total_duration = video_info['duration']
-                num_segments = math.ceil(total_duration / actual_clip_duration)
-                
-                for j in range(num_segments):
-                    start_time = j * actual_clip_duration
-                    output_path = final_clips_dir / f"clip_{i}_{j}.mp4"
-                    
-                    (
-                        ffmpeg.input(video_path, ss=start_time, t=actual_clip_duration)
-                        .output(str(output_path), avoid_negative_ts='make_zero')
-                        .overwrite_output()
-                        .run(quiet=True)
+            chat_dir = workspace.path if workspace else self.temp_dir / str(chat_id)
+            chat_dir.mkdir(parents=True, exist_ok=True)
+
+            duration = source.get('duration', 0)
+            logger.info(f"Обрабатываем поток длительностью {duration} секунд")
+
+            if duration > 300:
+                windows = [(i * CHUNK_DURATION_SECONDS, min(CHUNK_DURATION_SECONDS, duration - i * CHUNK_DURATION_SECONDS))
+                           for i in range(math.ceil(duration / CHUNK_DURATION_SECONDS))]
+            else:
+                windows = [(0, duration)]
+
+            audio_url = source.get('audio_url') or source['video_url']
+            audio_base_options = (source.get('audio_input_options') if source.get('audio_url') else source.get('video_input_options')) or {}
+
+            for i, (start, window) in enumerate(windows):
+                logger.info(f"Обрабатываем окно {i+1}/{len(windows)} ({start:.0f}–{start + window:.0f} с)")
+                video_options = {**(source.get('video_input_options') or {}), 'ss': start, 't': window}
+                audio_options = {**audio_base_options, 'ss': start, 't': window}
+
+                # Окна прямого потока режутся точнее чанков файла — ключи у них свои
+                transcribe_key, render_key = self._chunk_keys(
+                    stages, (source_key, 'stream', source['width'], source['height'], duration), i, len(windows),
+                    chat_id, top_header, bottom_header, background_music_path,
+                )
+                if self._render_uncacheable(checkpoint, i):
+                    render_key = None
+                vertical_video = await self._finished_render(checkpoint, stages, render_key, i, chat_dir, covers=('transcribe', 'audio'))
+                if vertical_video:
+                    uploads.account_render(self.get_file_size(vertical_video), window, duration)
+                    cuts.append(asyncio.ensure_future(self.cut_clips(vertical_video, i, uploads, chat_id, workspace, checkpoint, stages, render_key)))
+                    continue
+
+                async def transcribe_window(audio_options=audio_options):
+                    pcm = await self.extract_audio_pcm(audio_url, audio_options)
+                    if stages:
+                        stages.done('audio')
+                    return await self.generate_subtitles(audio_url, audio=pcm) if pcm is not None else None
+
+                async with self._subtitles_flight.join(
+                    transcribe_key or ('stream', source.get('id') or source['video_url'], i, len(windows)),
+                    lambda _report: self._transcribe_cached(checkpoint, stages, transcribe_key, i, transcribe_window, covers=('audio',))
+                ) as subtitles:
+                    vertical_video = await self.create_vertical_video_fast(
+                        source['video_url'], subtitles or [], chat_dir, i, background_music_path, chat_id, top_header, bottom_header,
+                        settings=settings, input_options=video_options,
+                        audio_source=(audio_url, audio_options) if source.get('audio_url') else None,
+                        source_info={'width': source['width'], 'height': source['height'], 'duration': window},
+                        scratch_dir=workspace.hot_dir if workspace else None,
                     )
-                    clip_paths.append(output_path)
-
-            uploaded_links = []
-            loop = asyncio.get_event_loop()
-            for clip_path in clip_paths:
-                link = await loop.run_in_executor(None, upload_to_drive, str(clip_path), folder_name)
-                if link:
-                    direct_link = self.to_drive_direct_download(link)
-                    uploaded_links.append(direct_link)
-            
+                if subtitles is None:
+                    render_key = self._mark_uncacheable(checkpoint, i)
+                if vertical_video and render_key:
+                    await stages.store('render', render_key, vertical_video)
+                elif vertical_video and stages:
+                    stages.done('render')
+                if vertical_video and checkpoint:
+                    checkpoint.done('render', vertical_video, item=str(i))
+                if vertical_video:
+                    uploads.account_render(self.get_file_size(vertical_video), window, duration)
+                    cuts.append(asyncio.ensure_future(self.cut_clips(vertical_video, i, uploads, chat_id, workspace, checkpoint, stages, render_key)))
+
+            if cuts:
+                return await self.finish_uploads(uploads, cuts, chat_id, workspace)
+
+            return None
+        except Exception as e:
+            logger.error(f"Ошибка обработки потока: {e}")
+            return None
+        finally:
+            for cut in cuts:
+                cut.cancel()
+            uploads.cancel()
+
+    async def extract_audio_pcm(self, source: str, input_options: Optional[Dict] = None) -> Optional[np.ndarray]:
+        """Извлечь звук в PCM 16 кГц моно прямо в память (формат, который принимает Faster-Whisper)"""
+        try:
+            ticket = self.memory.estimate('pcm', duration=float((input_options or {}).get('t', CHUNK_DURATION_SECONDS)))
+            async with self.memory.admit(ticket, measure_self=True):
+                out = await self.ffmpeg.run(
+                    ffmpeg.input(source, **(input_options or {}))
+                    .output('pipe:', format='s16le', acodec='pcm_s16le', ac=1, ar=16000),
+                    capture_stdout=True,
+                )
+                return np.frombuffer(out, np.int16).astype(np.float32) / 32768.0
+        except FFmpegError as e:
+            logger.error(f"Ошибка извлечения звука: {e.stderr[-500:]}")
+            return None
+        except Exception as e:
+            logger.error(f"Ошибка извлечения звука: {e}")
+            return None
+
+    def _checkpointed_file(self, checkpoint: Optional[JobCheckpoint], stage: str, item) -> Optional[str]:
+        """Путь из контрольной точки, если этап завершён и файл на месте"""
+        if not checkpoint:
+            return None
+        path = checkpoint.get(stage, str(item))
+        return path if path and os.path.exists(path) else None
+
+    async def _checkpointed(self, checkpoint: Optional[JobCheckpoint], stage: str, item, factory):
+        """Взять результат этапа из контрольной точки или выполнить этап и сохранить результат"""
+        if checkpoint:
+            cached = checkpoint.get(stage, str(item))
+            if cached is not None:
+                return cached
+        result = await factory()
+        if checkpoint and result:
+            checkpoint.done(stage, result, item=str(item))
+        return result
+
+    def _chunk_keys(self, stages: Optional[StageRun], source: Tuple, index: int, count: int, chat_id: int, top_header: Optional[str], bottom_header: Optional[str], background_music_path: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+        """Ключи кэша этапов для транскрибации и рендера чанка (None, None без кэша)"""
+        if not stages or not source[0]:
+            return None, None
+        transcribe_key = stages.key('transcribe', source, index, count, CHUNK_DURATION_SECONDS)
+        # Файлы музыки, баннера и шрифта могут замениться по тому же пути (повторная загрузка
+        # в чат) — в ключ идут их размер и время изменения
+        music_path = background_music_path or self.get_custom_background_music(chat_id) or get_value(stages.settings, 'background_music.path', BACKGROUND_MUSIC_PATH)
+        banner_path = get_value(stages.settings, 'banner.path', BANNER_PATH)
+        font_path = self.subtitle_font_path(stages.settings)
+        render_key = stages.key('render', transcribe_key, top_header, bottom_header, file_stamp(music_path), file_stamp(banner_path), file_stamp(font_path))
+        return transcribe_key, render_key
+
+    @staticmethod
+    def subtitle_font_path(settings: Optional[Dict]) -> str:
+        """Файл шрифта субтитров из настроек (путь относительно папки бота)"""
+        return (Path(__file__).parent / get_value(settings or {}, 'subtitles.font_path', FONT_PATH)).as_posix()
+
+    @staticmethod
+    def _mark_uncacheable(checkpoint: Optional[JobCheckpoint], index: int) -> None:
+        """Отметить рендер чанка как сделанный после сбоя транскрибации: ни он, ни его клипы не попадут в кэш этапов"""
+        if checkpoint:
+            checkpoint.done('uncacheable', True, item=str(index))
+        return None
+
+    @staticmethod
+    def _render_uncacheable(checkpoint: Optional[JobCheckpoint], index: int) -> bool:
+        return bool(checkpoint and checkpoint.get('uncacheable', str(index)))
+
+    async def _finished_render(self, checkpoint: Optional[JobCheckpoint], stages: Optional[StageRun], render_key: Optional[str], index: int, output_dir: Path, covers: Tuple[str, ...] = ('transcribe',)) -> Optional[str]:
+        """Готовый рендер чанка: из контрольной точки задачи или из кэша этапов.
+
+        `covers` — этапы, нужные только рендеру: при рендере из кэша они тоже пропущены.
+        """
+        path = self._checkpointed_file(checkpoint, 'render', index)
+        if path or not render_key:
+            return path
+        path = await stages.restore('render', render_key, output_dir / f"vertical_{index:03d}.mp4")
+        if path:
+            for stage in covers:
+                stages.skip(stage)
+            if checkpoint:
+                checkpoint.done('render', path, item=str(index))
+        return path
+
+    async def _transcribe_cached(self, checkpoint: Optional[JobCheckpoint], stages: Optional[StageRun], transcribe_key: Optional[str], index: int, factory, covers: Tuple[str, ...] = ()):
+        """Субтитры чанка: из контрольной точки задачи, из кэша этапов или новой транскрибацией.
+
+        `covers` — этапы, которые выполняются только ради транскрибации и пропускаются вместе с ней.
+        """
+        if not transcribe_key:
+            return await self._checkpointed(checkpoint, 'transcribe', index, factory)
+
+        async def cached_or_new():
+            subtitles = await stages.get_json('transcribe', transcribe_key)
+            if subtitles is not None:
+                for stage in covers:
+                    stages.skip(stage)
+                return subtitles
+            subtitles = await factory()
+            # None — сбой транскрибации: его не кэшируем, следующая задача попробует снова
+            if subtitles is not None:
+                await stages.put_json('transcribe', transcribe_key, subtitles)
+            return subtitles
+
+        return await self._checkpointed(checkpoint, 'transcribe', index, cached_or_new)
+
+    def new_upload_stage(self, chat_id: int, clip_duration: Optional[int] = None, workspace: Optional[Workspace] = None, checkpoint: Optional[JobCheckpoint] = None, allow_zip: bool = False, settings: Optional[Dict] = None, on_clip: Optional[Callable[[ReadyClip], None]] = None) -> UploadStage:
+        """Этап загрузки клипов задачи в хранилище пользователя (с `allow_zip` — или архивом в чат, если результат небольшой)"""
+        # Выбор длительности клипа: параметр пользователя или значение по умолчанию из конфигурации
+        actual_clip_duration = clip_duration if clip_duration and clip_duration > 0 else CLIP_DURATION_SECONDS
+
+        def clip_ready(order: Tuple, link: str) -> None:
+            # Клип j рендера чанка i начинается в исходнике с i * CHUNK + j * длительность клипа
+            index, j = order
+            on_clip(ReadyClip(index * CHUNK_DURATION_SECONDS + j * actual_clip_duration, link))
+
+        return UploadStage(
+            f"final_videos_{chat_id}", actual_clip_duration, checkpoint=checkpoint, workspace=workspace,
+            cost_model=self.costs, sink=sink_for(settings),
+            hold_limit=MAX_FILE_SIZE if allow_zip else 0, on_clip=clip_ready if on_clip else None,
+            job=workspace.job_id if workspace else uuid.uuid4().hex[:8],
+        )
+
+    async def cut_clips(self, video_path: str, index: int, uploads: UploadStage, chat_id: int, workspace: Optional[Workspace] = None, checkpoint: Optional[JobCheckpoint] = None, stages: Optional[StageRun] = None, render_key: Optional[str] = None) -> None:
+        """Нарезать рендер чанка на клипы; каждый клип уходит в загрузку сразу после записи.
+
+        С `render_key` клипы этого рендера той же длительности берутся из кэша этапов.
+        """
+        chat_dir = workspace.path if workspace else self.temp_dir / str(chat_id)
+        final_clips_dir = chat_dir / "final_clips"
+        final_clips_dir.mkdir(parents=True, exist_ok=True)
+        clip_duration = uploads.clip_duration
+
+        video_info = await self.get_video_info(video_path)
+        total_duration = video_info['duration']
+        num_segments = math.ceil(total_duration / clip_duration)
+
+        for j in range(num_segments):
+            start_time = j * clip_duration
+            output_path = final_clips_dir / f"clip_{index}_{j}.mp4"
+            cut_key = stages.key('cut', render_key, clip_duration, j) if render_key else None
+            # Уже загруженный или нарезанный до перезапуска клип не режем повторно
+            finished = uploads.uploaded(output_path) or self._checkpointed_file(checkpoint, 'cut', output_path.name)
+            # Тот же клип того же рендера уже нарезан другой задачей
+            if not finished and cut_key and await stages.restore('cut', cut_key, output_path):
+                uploads.submit((index, j), output_path)
+                continue
+            if UPLOAD_STREAMING and uploads.can_stream:
+                # Клип не пишется на диск: вывод энкодера сразу уходит в загрузку (и в кэш не попадает)
+                if stages:
+                    stages.done('cut')
+                uploads.submit_stream((index, j), output_path.name, functools.partial(self._cut_to_pipe, video_path, start_time, clip_duration))
+                continue
+            if not finished:
+                # Путь мог остаться жёсткой ссылкой на запись кэша — ffmpeg не должен писать в неё
+                output_path.unlink(missing_ok=True)
+                async with self.memory.admit(self.memory.estimate('cut', duration=clip_duration)) as ticket:
+                    with self.costs.measure('cut', min(clip_duration, total_duration - start_time)):
+                        await self.ffmpeg.run(
+                            ffmpeg.input(video_path, ss=start_time, t=clip_duration)
+                            .output(str(output_path), avoid_negative_ts='make_zero')
+                            .overwrite_output(),
+                            on_peak_rss=ticket.record_peak,
+                        )
+                if cut_key:
+                    await stages.store('cut', cut_key, str(output_path))
+                elif stages:
+                    stages.done('cut')
+                if checkpoint:
+                    checkpoint.done('cut', str(output_path), item=output_path.name)
+            uploads.submit((index, j), output_path)
+
+    async def _cut_to_pipe(self, video_path: str, start_time: float, clip_duration: float, sink) -> None:
+        """Нарезать клип в fragmented MP4 на stdout (moov в начале, без перемотки назад)"""
+        async with self.memory.admit(self.memory.estimate('cut', duration=clip_duration)) as ticket:
+            await self.ffmpeg.run(
+                ffmpeg.input(video_path, ss=start_time, t=clip_duration)
+                .output('pipe:1', format='mp4', movflags='frag_keyframe+empty_moov+default_base_moof', avoid_negative_ts='make_zero'),
+                on_peak_rss=ticket.record_peak,
+                stdout_sink=sink,
+            )
+
+    async def finish_uploads(self, uploads: UploadStage, cuts: List[asyncio.Future], chat_id: int, workspace: Optional[Workspace] = None) -> Optional[str]:
+        """Дождаться нарезки и загрузки всех клипов: вернуть ZIP для Telegram или файл со ссылками по порядку"""
+        try:
+            await asyncio.gather(*cuts)
+            chat_dir = workspace.path if workspace else self.temp_dir / str(chat_id)
+            if uploads.holding:
+                archive_path = await self.archive_clips(uploads.held(), chat_dir / f"final_videos_{chat_id}.zip", uploads.hold_limit, workspace)
+                if archive_path:
+                    return archive_path
+                uploads.release()
+            uploaded_links = await uploads.links()
+
             links_file_path = chat_dir / "uploaded_links.txt"
             with open(links_file_path, "w", encoding="utf-8") as f:
                 f.write("\n".join(uploaded_links))
 
             return str(links_file_path)
         except Exception as e:
-            logger.error(f"Ошибка нарезки и загрузки на Google Drive: {e}")
+            logger.error(f"Ошибка нарезки и загрузки клипов: {e}")
             return None
 
+    async def archive_clips(self, clips: List[Path], zip_path: Path, limit: int, workspace: Optional[Workspace] = None) -> Optional[str]:
+        """Сложить клипы в ZIP без сжатия (mp4 уже сжаты), если архив уложится в `limit` байт"""
+        # Клипа может не быть, если он загружен до перезапуска — тогда результат только ссылками
+        if not clips or any(not clip.exists() for clip in clips):
+            return None
+        expected = sum(clip.stat().st_size for clip in clips) + len(clips) * ZIP_ENTRY_OVERHEAD
+        if expected > limit:
+            return None
+
+        def write() -> None:
+            with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_STORED) as archive:
+                for clip in clips:
+                    archive.write(clip, arcname=clip.name)
+
+        await io_executor.run(write)
+        for clip in clips:
+            if workspace:
+                workspace.discard(clip)
+            else:
+                clip.unlink(missing_ok=True)
+        logger.info(f"Клипы ({len(clips)}) упакованы в {zip_path.name}: {self.get_file_size(str(zip_path)) / 1024 / 1024:.1f} МБ")
+        return str(zip_path)
+
+    async def cut_and_upload_to_drive(self, video_paths: List[str], chat_id: int, clip_duration: Optional[int] = None, workspace: Optional[Workspace] = None, checkpoint: Optional[JobCheckpoint] = None) -> Optional[str]:
+        """Нарезает видео на сегменты, загружает их на Google Drive и возвращает путь к файлу со ссылками."""
+        uploads = self.new_upload_stage(chat_id, clip_duration, workspace, checkpoint)
+        cuts = [asyncio.ensure_future(self.cut_clips(path, i, uploads, chat_id, workspace, checkpoint)) for i, path in enumerate(video_paths)]
+        try:
+            return await self.finish_uploads(uploads, cuts, chat_id, workspace)
+        finally:
+            for cut in cuts:
+                cut.cancel()
+            uploads.cancel()
+
     async def get_video_info(self, video_path: str) -> Dict:
         """Получить информацию о видео"""
         try:
-            def get_info():
-                probe = ffmpeg.probe(video_path)
-                video_stream = next((stream for stream in probe['streams'] if stream['codec_type'] == 'video'), None)
-                return {
-                    'duration': float(probe['format']['duration']),
-                    'width': int(video_stream['width']),
-                    'height': int(video_stream['height']),
-                    'fps': eval(video_stream['r_frame_rate'])
-                }
-            loop = asyncio.get_event_loop()
-            return await loop.run_in_executor(None, get_info)
+            probe = await self.ffmpeg.probe(video_path)
+            video_stream = next((stream for stream in probe['streams'] if stream['codec_type'] == 'video'), None)
+            return {
+                'duration': float(probe['format']['duration']),
+                'width': int(video_stream['width']),
+                'height': int(video_stream['height']),
+                'fps': eval(video_stream['r_frame_rate'])
+            }
         except Exception as e:
             logger.error(f"Ошибка получения информации о видео: {e}")
             return {'duration': 0, 'width': 1920, 'height': 1080, 'fps': 30}
 
-    async def split_video_into_chunks(self, video_path: str, output_dir: Path) -> List[str]:
-        """Нарезка видео на чанки по 5 минут"""
+    async def split_video_into_chunks(self, video_path: str, output_dir: Path, workspace: Optional[Workspace] = None) -> List[str]:
+        """Нарезка видео на чанки по 5 минут (в RAM-папку задачи, если хватает бюджета)"""
         try:
             video_info = await self.get_video_info(video_path)
             total_duration = video_info['duration']
             chunk_count = math.ceil(total_duration / CHUNK_DURATION_SECONDS)
             chunks = []
+            # Ожидаемый размер чанка (копирование без перекодирования) с небольшим запасом
+            expected_chunk_bytes = int(self.get_file_size(video_path) * CHUNK_DURATION_SECONDS / max(total_duration, 1) * 1.2)
 
             logger.info(f"✂️ Нарезаем видео на {chunk_count} чанков...")
-            with tqdm(total=chunk_count, desc="✂️ Нарезка видео", unit="чанк") as pbar:
+            with self.costs.measure('split', total_duration), tqdm(total=chunk_count, desc="✂️ Нарезка видео", unit="чанк") as pbar:
                 for i in range(chunk_count):
                     start_time = i * CHUNK_DURATION_SECONDS
-                    output_path = output_dir / f"chunk_{i:03d}.mp4"
-                    (ffmpeg.input(video_path, ss=start_time, t=CHUNK_DURATION_SECONDS).output(str(output_path), c='copy', avoid_negative_ts='make_zero').overwrite_output().run(quiet=True))
+                    name = f"chunk_{i:03d}.mp4"
+                    output_path = workspace.hot_path(name, expected_chunk_bytes) if workspace else output_dir / name
+                    async with self.memory.admit(self.memory.estimate('split')) as ticket:
+                        await self.ffmpeg.run(ffmpeg.input(video_path, ss=start_time, t=CHUNK_DURATION_SECONDS).output(str(output_path), c='copy', avoid_negative_ts='make_zero').overwrite_output(), on_peak_rss=ticket.record_peak)
                     chunks.append(str(output_path))
                     pbar.update(1)
             
@@ -168,42 +513,34 @@ class FastVideoProcessor:
             logger.error(f"Ошибка нарезки видео: {e}")
             return [video_path]
 
-    async def generate_subtitles(self, video_path: str) -> List[Dict]:
-        """Генерация субтитров через Faster-Whisper"""
+    async def generate_subtitles(self, video_path: str, audio: Optional[np.ndarray] = None) -> Optional[List[Dict]]:
+        """Генерация субтитров через Faster-Whisper (из файла или готового PCM 16 кГц).
+
+        None — транскрибация не удалась (в отличие от [] — речи нет): такой результат не кэшируется.
+        """
         try:
-            if not self.whisper_model:
-                logger.error("Модель Faster-Whisper не загружена")
-                return []
-            def transcribe():
-                logger.info("🤖 Генерируем субтитры через Faster-Whisper AI...")
-                segments, info = self.whisper_model.transcribe(video_path, word_timestamps=True, language='ru', beam_size=5)
-                subtitles = []
-                total_segments = info.duration
-                with tqdm(total=total_segments, desc="🎤 Обработка речи", unit="сек") as pbar:
-                    for segment in segments:
-                        if segment.words:
-                            for word in segment.words:
-                                subtitles.append({'start': word.start, 'end': word.end, 'text': word.word.strip(), 'confidence': word.probability})
-                        pbar.update(segment.end - segment.start)
-                logger.info(f"Обнаружен язык: {info.language} (вероятность: {info.language_probability:.2f})")
-                return subtitles
-            loop = asyncio.get_event_loop()
-            subtitles = await loop.run_in_executor(None, transcribe)
+            logger.info("🤖 Генерируем субтитры через Faster-Whisper AI...")
+            source = audio if audio is not None else video_path
+            duration = len(audio) / 16000 if audio is not None else CHUNK_DURATION_SECONDS
+            ticket = self.memory.estimate('transcribe', duration=duration)
+            async with self.memory.admit(ticket):
+                # Модель живёт в отдельном процессе пула — ни её память, ни её падение не затрагивают бота
+                subtitles, info = await transcribe_executor.run(transcribe, source, on_peak_rss=ticket.record_peak)
+            logger.info(f"Обнаружен язык: {info['language']} (вероятность: {info['language_probability']:.2f})")
+            self.costs.record('transcribe', info['duration'], info['elapsed'])
             logger.info(f"Сгенерировано {len(subtitles)} субтитров")
             return subtitles
         except Exception as e:
             logger.error(f"Ошибка генерации субтитров: {e}")
-            return []
+            return None
 
-    async def create_vertical_video_fast(
-        self, video_path: str, subtitles: List[Dict], output_dir: Path, chunk_index: int,
+    def build_vertical_graph(
+        self, video_path: str, subtitles: List[Dict], width: int, height: int, duration: float,
         background_music_path: Optional[str] = None, chat_id: int = None,
-        top_header: str = None, bottom_header: str = None, settings: Optional[Dict] = None
-    ) -> Optional[str]:
-        """Быстрое создание вертикального видео через FFmpeg"""
-        output_path = output_dir / f"vertical_{chunk_index:03d}.mp4"
-        srt_path = output_dir / f"subtitles_{chunk_index:03d}.srt"
-        
+        top_header: str = None, bottom_header: str = None, settings: Optional[Dict] = None,
+        input_options: Optional[Dict] = None, audio_source: Optional[Tuple[str, Dict]] = None
+    ) -> Tuple:
+        """Граф фильтров вертикального видео (видео и звук) — общий для рендера и предпросмотра"""
         # Resolve settings with fallbacks to global config
         s = settings or {}
         main_video_scale = s.get('layout', {}).get('main_video_scale', MAIN_VIDEO_SCALE)
@@ -217,7 +554,7 @@ class FastVideoProcessor:
         chroma_color = s.get('banner', {}).get('chroma_key_color', CHROMA_KEY_COLOR)
         chroma_similarity = s.get('banner', {}).get('chroma_key_similarity', CHROMA_KEY_SIMILARITY)
         chroma_blend = s.get('banner', {}).get('chroma_key_blend', CHROMA_KEY_BLEND)
-        subs_font_path = (Path(__file__).parent / s.get('subtitles', {}).get('font_path', FONT_PATH)).as_posix()
+        subs_font_path = self.subtitle_font_path(s)
         subs_font_size = int(s.get('subtitles', {}).get('font_size', FONT_SIZE) * 1.5)
         subs_font_color = s.get('subtitles', {}).get('font_color', FONT_COLOR)
         subs_stroke_color = s.get('subtitles', {}).get('stroke_color', STROKE_COLOR)
@@ -228,98 +565,119 @@ class FastVideoProcessor:
         top_font_size = s.get('headers', {}).get('top_font_size', TOP_HEADER_FONT_SIZE)
         bottom_font_size = s.get('headers', {}).get('bottom_font_size', BOTTOM_HEADER_FONT_SIZE)
 
-        try:
-            def create_vertical():
-                
-                logger.info("Создаем вертикальное видео через FFmpeg...")
-                probe = ffmpeg.probe(video_path)
-                video_stream = next(s for s in probe['streams'] if s['codec_type'] == 'video')
-                width, height = int(video_stream['width']), int(video_stream['height'])
-                target_width, target_height = 1080, 1920
-                self.create_srt_file(subtitles, srt_path)
-
-                # Новая логика для основного видео: делаем его больше и обрезаем по бокам
-                # Устанавливаем ширину на 100%, а высоту оставляем на 70%
-                main_video_height_on_canvas = int(target_height * main_video_scale)
-                main_video_width_on_canvas = target_width
-
-                # Соотношение сторон для основного видео (3:4)
-                new_aspect_ratio = main_video_width_on_canvas / main_video_height_on_canvas
-
-                # Определяем, как кропать: по ширине или по высоте
-                if (width / height) > new_aspect_ratio:
-                    # Видео шире, чем нужно -> кропаем ширину
-                    new_width = int(height * new_aspect_ratio)
-                    crop_x = (width - new_width) // 2
-                    crop_y = 0
-                    crop_width = new_width
-                    crop_height = height
-                else:
-                    # Видео выше, чем нужно -> кропаем высоту
-                    new_height = int(width / new_aspect_ratio)
-                    crop_x = 0
-                    crop_y = (height - new_height) // 2
-                    crop_width = width
-                    crop_height = new_height
-                
-                input_video = ffmpeg.input(video_path, **{'noautorotate': None})
-                background = input_video.filter('scale', target_width, target_height).filter('gblur', sigma=20)
-                
-                # Обрезаем и масштабируем основное видео
-                main_video = input_video.crop(crop_x, crop_y, crop_width, crop_height)
-                main_video = main_video.filter('scale', main_video_width_on_canvas, main_video_height_on_canvas)
-
-                # Центрируем основное видео
-                x_offset = (target_width - main_video_width_on_canvas) // 2
-                y_offset = (target_height - main_video_height_on_canvas) // 2
-                composed = ffmpeg.overlay(background, main_video, x=x_offset, y=y_offset).filter('setdar', '9/16')
-                duration = float(probe['format']['duration'])
+        target_width, target_height = 1080, 1920
+
+        # Новая логика для основного видео: делаем его больше и обрезаем по бокам
+        # Устанавливаем ширину на 100%, а высоту оставляем на 70%
+        main_video_height_on_canvas = int(target_height * main_video_scale)
+        main_video_width_on_canvas = target_width
+
+        # Соотношение сторон для основного видео (3:4)
+        new_aspect_ratio = main_video_width_on_canvas / main_video_height_on_canvas
+
+        # Определяем, как кропать: по ширине или по высоте
+        if (width / height) > new_aspect_ratio:
+            # Видео шире, чем нужно -> кропаем ширину
+            new_width = int(height * new_aspect_ratio)
+            crop_x = (width - new_width) // 2
+            crop_y = 0
+            crop_width = new_width
+            crop_height = height
+        else:
+            # Видео выше, чем нужно -> кропаем высоту
+            new_height = int(width / new_aspect_ratio)
+            crop_x = 0
+            crop_y = (height - new_height) // 2
+            crop_width = width
+            crop_height = new_height
+        
+        input_video = ffmpeg.input(video_path, **{'noautorotate': None, **(input_options or {})})
+        background = input_video.filter('scale', target_width, target_height).filter('gblur', sigma=20)
+        
+        # Обрезаем и масштабируем основное видео
+        main_video = input_video.crop(crop_x, crop_y, crop_width, crop_height)
+        main_video = main_video.filter('scale', main_video_width_on_canvas, main_video_height_on_canvas)
 
-                
-                
-                audio = input_video.audio
-                if music_enabled:
-                    music_path_to_use = background_music_path or self.get_custom_background_music(chat_id) or music_path_cfg
-                    if music_path_to_use and os.path.exists(music_path_to_use):
-                        audio = self.add_background_music(audio, music_path_to_use, duration, music_volume)
+        # Центрируем основное видео
+        x_offset = (target_width - main_video_width_on_canvas) // 2
+        y_offset = (target_height - main_video_height_on_canvas) // 2
+        composed = ffmpeg.overlay(background, main_video, x=x_offset, y=y_offset).filter('setdar', '9/16')
 
-                if subtitles:
-                    composed = self.add_animated_subtitles(composed, subtitles, target_width, target_height, subs_font_path, subs_font_size, subs_font_color, subs_stroke_color, subs_stroke_width)
+        
+        
+        if audio_source:
+            audio_url, audio_options = audio_source
+            audio = ffmpeg.input(audio_url, **(audio_options or {})).audio
+        else:
+            audio = input_video.audio
+        if music_enabled:
+            music_path_to_use = background_music_path or self.get_custom_background_music(chat_id) or music_path_cfg
+            if music_path_to_use and os.path.exists(music_path_to_use):
+                audio = self.add_background_music(audio, music_path_to_use, duration, music_volume)
 
-                if top_header:
-                    composed = self.add_header(composed, top_header, target_width, target_height, 'top', top_font_size, header_font_color, header_stroke_color, header_stroke_width)
-                if bottom_header:
-                    composed = self.add_header(composed, bottom_header, target_width, target_height, 'bottom', bottom_font_size, header_font_color, header_stroke_color, header_stroke_width)
+        if subtitles:
+            composed = self.add_animated_subtitles(composed, subtitles, target_width, target_height, subs_font_path, subs_font_size, subs_font_color, subs_stroke_color, subs_stroke_width)
 
-                if banner_enabled and os.path.exists(banner_path):
-                    composed = self.add_ivideo_banner(composed, banner_path, duration, chroma_color, chroma_similarity, chroma_blend, banner_x, banner_y)
+        if top_header:
+            composed = self.add_header(composed, top_header, target_width, target_height, 'top', top_font_size, header_font_color, header_stroke_color, header_stroke_width)
+        if bottom_header:
+            composed = self.add_header(composed, bottom_header, target_width, target_height, 'bottom', bottom_font_size, header_font_color, header_stroke_color, header_stroke_width)
 
-                if audio:
-                    output_args = ffmpeg.output(composed, audio, str(output_path), vcodec='libx264', acodec='aac', preset='fast', crf=18, pix_fmt='yuv420p', movflags='faststart').overwrite_output()
-                else:
-                    output_args = ffmpeg.output(composed, str(output_path), vcodec='libx264', preset='fast', crf=23, pix_fmt='yuv420p', movflags='faststart').overwrite_output()
-                
-                cmd_args = ffmpeg.compile(output_args)
+        if banner_enabled and os.path.exists(banner_path):
+            composed = self.add_ivideo_banner(composed, banner_path, duration, chroma_color, chroma_similarity, chroma_blend, banner_x, banner_y)
+
+        return composed, audio
+
+    async def create_vertical_video_fast(
+        self, video_path: str, subtitles: List[Dict], output_dir: Path, chunk_index: int,
+        background_music_path: Optional[str] = None, chat_id: int = None,
+        top_header: str = None, bottom_header: str = None, settings: Optional[Dict] = None,
+        input_options: Optional[Dict] = None, audio_source: Optional[Tuple[str, Dict]] = None,
+        source_info: Optional[Dict] = None, scratch_dir: Optional[Path] = None
+    ) -> Optional[str]:
+        """Быстрое создание вертикального видео через FFmpeg"""
+        output_path = output_dir / f"vertical_{chunk_index:03d}.mp4"
+        srt_path = (scratch_dir or output_dir) / f"subtitles_{chunk_index:03d}.srt"
+
+        try:
+            logger.info("Создаем вертикальное видео через FFmpeg...")
+            if source_info:
+                # Прямой поток: размеры и длительность окна известны заранее, ffprobe не нужен
+                width, height = int(source_info['width']), int(source_info['height'])
+                duration = float(source_info['duration'])
+            else:
+                probe = await self.ffmpeg.probe(video_path)
+                video_stream = next(s for s in probe['streams'] if s['codec_type'] == 'video')
+                width, height = int(video_stream['width']), int(video_stream['height'])
+                duration = float(probe['format']['duration'])
+            self.create_srt_file(subtitles, srt_path)
+            composed, audio = self.build_vertical_graph(
+                video_path, subtitles, width, height, duration, background_music_path, chat_id,
+                top_header, bottom_header, settings=settings, input_options=input_options, audio_source=audio_source
+            )
+
+            if audio:
+                output_args = ffmpeg.output(composed, audio, str(output_path), vcodec='libx264', acodec='aac', preset='fast', crf=18, pix_fmt='yuv420p', movflags='faststart').overwrite_output()
+            else:
+                output_args = ffmpeg.output(composed, str(output_path), vcodec='libx264', preset='fast', crf=23, pix_fmt='yuv420p', movflags='faststart').overwrite_output()
+            
+            # Путь мог остаться жёсткой ссылкой на запись кэша этапов — ffmpeg не должен писать в неё
+            output_path.unlink(missing_ok=True)
+            ticket = self.memory.estimate('render', width, height, duration, settings, subtitles=len(subtitles or []))
+            async with self.memory.admit(ticket):
                 logger.info("Начинаем рендеринг вертикального видео...")
-                success = self.run_ffmpeg_with_progress(cmd_args, duration, f"🎬 Создание вертикального видео {chunk_index+1}")
-                
-                if not success:
-                    logger.warning("Прогресс-бар не сработал, запускаем FFmpeg обычным способом...")
-                    try:
-                        output_args.run(quiet=True, overwrite_output=True)
-                        success = True
-                    except ffmpeg.Error as e:
-                        logger.error(f"FFmpeg ошибка: {e.stderr.decode('utf-8', errors='ignore')}")
-                        return None
-                
-                if not success:
-                    return None
-                return str(output_path)
-
-            loop = asyncio.get_event_loop()
-            result = await loop.run_in_executor(None, create_vertical)
-            logger.info(f"Создано вертикальное видео: {result}")
-            return result
+                with tqdm(total=100, desc=f"🎬 Создание вертикального видео {chunk_index+1}", unit='%', bar_format='{l_bar}{bar}| {n:.1f}% [{elapsed}<{remaining}]') as pbar:
+                    def show_progress(progress):
+                        pbar.n = progress.percent
+                        pbar.refresh()
+                    with self.costs.measure('render', render_feature(duration, width, height, settings, words=len(subtitles or []))):
+                        await self.ffmpeg.run(output_args, duration=duration, on_progress=show_progress, on_peak_rss=ticket.record_peak)
+
+            logger.info(f"Создано вертикальное видео: {output_path}")
+            return str(output_path)
+        except FFmpegError as e:
+            logger.error(f"FFmpeg ошибка: {e.stderr}")
+            return None
         except Exception as e:
             logger.error(f"Ошибка создания вертикального видео: {e}")
             return None
@@ -328,6 +686,63 @@ class FastVideoProcessor:
             if srt_path.exists(): srt_path.unlink() 
             
 
+    async def render_preview(
+        self, source, output_dir: Path, timestamp: float, chat_id: int = None,
+        top_header: str = None, bottom_header: str = None, settings: Optional[Dict] = None
+    ) -> Tuple[Optional[str], Optional[str]]:
+        """Предпросмотр оформления: кадр в момент `timestamp` и короткий ролик 540x960.
+
+        `source` — путь к локальному файлу или результат YouTubeDownloader.resolve_stream.
+        Граф тот же, что у рендера; вместо транскрибации — образец субтитров.
+        """
+        if isinstance(source, dict):
+            video_path = source['video_url']
+            width, height, duration = int(source['width']), int(source['height']), float(source['duration'] or 0)
+            video_options = dict(source.get('video_input_options') or {})
+            audio_source = (source['audio_url'], dict(source.get('audio_input_options') or {})) if source.get('audio_url') else None
+        else:
+            video_path = source
+            info = await self.get_video_info(source)
+            width, height, duration = info['width'], info['height'], info['duration']
+            video_options, audio_source = {}, None
+        if duration:
+            timestamp = min(max(timestamp, 0), max(duration - PREVIEW_DURATION, 0))
+        window = min(PREVIEW_DURATION, duration - timestamp) if duration else PREVIEW_DURATION
+        video_options.update(ss=timestamp, t=window)
+        if audio_source:
+            audio_source[1].update(ss=timestamp, t=window)
+
+        frame_path = output_dir / 'preview.jpg'
+        clip_path = output_dir / 'preview.mp4'
+        # Кадр: субтитр виден сразу, без анимации появления
+        frame_graph, _ = self.build_vertical_graph(
+            video_path, [{'start': -1, 'end': window, 'text': 'Субтитры'}], width, height, window, None, chat_id,
+            top_header, bottom_header, settings=settings, input_options=video_options
+        )
+        sample_words = ['Так', 'будут', 'выглядеть', 'субтитры']
+        step = window / len(sample_words)
+        clip_graph, clip_audio = self.build_vertical_graph(
+            video_path, [{'start': i * step, 'end': (i + 1) * step, 'text': word} for i, word in enumerate(sample_words)],
+            width, height, window, None, chat_id, top_header, bottom_header,
+            settings=settings, input_options=video_options, audio_source=audio_source
+        )
+        clip_video = clip_graph.filter('scale', 540, 960)
+        clip_streams = [clip_video, clip_audio] if clip_audio else [clip_video]
+        clip_output = ffmpeg.output(*clip_streams, str(clip_path), t=window, vcodec='libx264', preset='ultrafast', crf=28, pix_fmt='yuv420p', acodec='aac', movflags='faststart').overwrite_output()
+        frame_output = ffmpeg.output(frame_graph, str(frame_path), vframes=1, **{'q:v': 3}).overwrite_output()
+
+        async def render(output) -> bool:
+            try:
+                await self.ffmpeg.run(output, duration=window, limited=False)
+                return True
+            except FFmpegError as e:
+                logger.error(f"Ошибка предпросмотра: {e.stderr[-500:]}")
+                return False
+
+        async with self._preview_limit:
+            frame_ok, clip_ok = await asyncio.gather(render(frame_output), render(clip_output))
+        return (str(frame_path) if frame_ok else None), (str(clip_path) if clip_ok else None)
+
     def create_srt_file(self, subtitles: List[Dict], srt_path: Path):
         try:
             with open(srt_path, 'w', encoding='utf-8') as f:
@@ -351,36 +766,6 @@ class FastVideoProcessor:
                 logger.info(f"Временные файлы для чата {chat_id} удалены")
         except Exception as e: logger.error(f"Ошибка очистки временных файлов: {e}")
 
-    def run_ffmpeg_with_progress(self, cmd_args: List[str], duration: float, description: str = "Processing"):
-        try:
-            process = subprocess.Popen(cmd_args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, encoding='utf-8', errors='ignore')
-            with tqdm(total=100, desc=description, unit='%', bar_format='{l_bar}{bar}| {n:.1f}% [{elapsed}<{remaining}]') as pbar:
-                stderr_lines = []
-                for line in process.stderr:
-                    stderr_lines.append(line.strip())
-                    time_match = re.search(r'time=(\d+):(\d+):(\d+\.\d+)', line)
-                    if time_match:
-                        h, m, s = map(float, time_match.groups())
-                        current_time = h * 3600 + m * 60 + s
-                        progress = min((current_time / duration) * 100, 100)
-                        pbar.n = progress
-                        pbar.refresh()
-            return_code = process.wait(timeout=3600) # Увеличиваем таймаут до 1 часа
-            if return_code != 0:
-                logger.error(f"FFmpeg завершился с кодом {return_code}")
-                logger.error("Последние 10 строк вывода FFmpeg:")
-                for line in stderr_lines[-10:]:
-                    logger.error(f"  {line}")
-                return False
-            return True
-        except subprocess.TimeoutExpired:
-            logger.error("FFmpeg процесс был убит по таймауту (1 час)")
-            process.kill()
-            return False
-        except Exception as e:
-            logger.error(f"Ошибка запуска FFmpeg с прогрессом: {e}")
-            return False
-
     def add_animated_subtitles(self, video_stream, subtitles: List[Dict], width: int, height: int, font_path: str, font_size: int, font_color: str, stroke_color: str, stroke_width: int):
         try:
             if not subtitles:
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import os
+import socket
+from typing import Optional
+
+from telegram import Bot
+from telegram.error import BadRequest
+
+from config import BOT_TOKEN, JOB_WORKERS, JOB_BROKER_POLL_INTERVAL, JOB_BROKER_LEASE
+from executors import start_metrics_log
+from job_store import DONE, FAILED
+from pipeline import job_store, workspaces, collect_links, execute_job
+from telegram_api import bot_options
+
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+
+class StatusMessage:
+    """Статусное сообщение задачи, созданное ботом: обработчик меняет его через Bot API"""
+
+    def __init__(self, bot: Bot, chat_id: int, message_id: int):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+
+    async def edit_text(self, text: str, parse_mode: Optional[str] = None) -> None:
+        await self.bot.edit_message_text(text, chat_id=self.chat_id, message_id=self.message_id, parse_mode=parse_mode)
+
+    async def delete(self) -> None:
+        await self.bot.delete_message(chat_id=self.chat_id, message_id=self.message_id)
+
+
+class Worker:
+    """Обработчик задач из брокера (JOB_BROKER=sqlite).
+
+    Забирает задачи, поставленные ботом, выполняет конвейер и сам отправляет
+    прогресс и результат в чат. Задачи пакетов (без статусного сообщения) только
+    записывают ссылки в брокер — их собирает бот.
+    """
+
+    def __init__(self, slots: int = JOB_WORKERS):
+        self.slots = slots
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.bot = Bot(BOT_TOKEN, **bot_options())
+
+    async def run(self) -> None:
+        workspaces.start_janitor()
+        start_metrics_log()
+        requeued = job_store.requeue_stale(JOB_BROKER_LEASE)
+        if requeued:
+            logger.info(f"Возвращено в очередь задач упавших обработчиков: {requeued}")
+        logger.info(f"Обработчик {self.worker_id} запущен, слотов: {self.slots}")
+        async with self.bot:
+            try:
+                await asyncio.gather(self._keep_lease(), *(self._slot(i) for i in range(self.slots)))
+            finally:
+                # Незавершённые задачи продолжит другой обработчик (или этот после перезапуска)
+                job_store.release_claims(self.worker_id)
+
+    async def _keep_lease(self) -> None:
+        while True:
+            await asyncio.sleep(JOB_BROKER_LEASE / 3)
+            job_store.heartbeat(self.worker_id)
+            job_store.requeue_stale(JOB_BROKER_LEASE)
+
+    async def _slot(self, slot: int) -> None:
+        while True:
+            job = job_store.claim_job(self.worker_id)
+            if job is None:
+                await asyncio.sleep(JOB_BROKER_POLL_INTERVAL)
+                continue
+            logger.info(f"Слот {slot}: задача {job['id']} (чат {job['chat_id']}) {job['url']}")
+            try:
+                await self._execute(job)
+            except Exception as e:
+                logger.error(f"Задача {job['id']} завершилась с ошибкой: {e}")
+                job_store.set_status(job['id'], FAILED, str(e))
+
+    async def _execute(self, job: dict) -> None:
+        if job['message_id']:
+            status_message = StatusMessage(self.bot, job['chat_id'], job['message_id'])
+            try:
+                await status_message.edit_text("🎬 Начинаю обработку видео...")
+            except BadRequest:
+                pass
+            await execute_job(self.bot, job['id'], job['chat_id'], job['url'], job['settings'], status_message, flight_key=job['flight_key'])
+            return
+
+        async def report(text: str) -> None:
+            job_store.set_progress(job['id'], text)
+
+        links = await collect_links(job['url'], job['chat_id'], job['settings'], on_progress=report, flight_key=job['flight_key'])
+        job_store.set_status(job['id'], DONE if links else FAILED, result=links)
+
+
+def main() -> None:
+    try:
+        asyncio.run(Worker().run())
+    except KeyboardInterrupt:
+        print("Обработчик остановлен.")
+
+if __name__ == '__main__':
+    main()
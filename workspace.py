@@ -0,0 +1,294 @@
+import asyncio
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: без блокировок, папки видит только один процесс
+    fcntl = None
+
+from config import (
+    WORKSPACE_RAM_DIR, WORKSPACE_RAM_BUDGET,
+    WORKSPACE_JOB_RESERVE_BYTES, WORKSPACE_DISK_HIGH_WATERMARK, WORKSPACE_DISK_LOW_WATERMARK,
+    WORKSPACE_JANITOR_INTERVAL, WORKSPACE_ACQUIRE_TIMEOUT
+)
+from executors import io_executor
+
+logger = logging.getLogger(__name__)
+
+# Файл-метка занятой папки: её держит процесс задачи, чтобы уборщики других процессов (worker.py) её не трогали
+LOCK_NAME = '.lock'
+
+
+class WorkspaceUnavailable(Exception):
+    """Недостаточно места на диске для новой задачи"""
+
+
+def _dir_size(path: Path) -> int:
+    total = 0
+    for root, _dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class Workspace:
+    """Рабочая папка одной задачи: файлы на диске + «горячие» промежуточные файлы в RAM"""
+
+    def __init__(self, manager: 'WorkspaceManager', job_id: str, chat_id: int, path: Path, hot_dir: Optional[Path]):
+        self.manager = manager
+        self.job_id = job_id
+        self.chat_id = chat_id
+        self.path = path
+        self.hot_dir = hot_dir or path
+        self.created_at = time.time()
+        self.bytes_used = 0
+        self._hot_reserved: Dict[Path, int] = {}
+        self._lock_file = None
+
+    def hot_path(self, name: str, expected_bytes: int = 0) -> Path:
+        """Путь для промежуточного файла: в RAM, если хватает бюджета, иначе на диске"""
+        if self.hot_dir != self.path and self.manager._reserve_hot(expected_bytes):
+            path = self.hot_dir / name
+            self._hot_reserved[path] = expected_bytes
+            return path
+        return self.path / name
+
+    def discard(self, file_path) -> None:
+        """Удалить отработавший промежуточный файл и вернуть его долю RAM-бюджета"""
+        path = Path(file_path)
+        try:
+            path.unlink(missing_ok=True)
+        except OSError as e:
+            logger.error(f"Ошибка удаления промежуточного файла {path}: {e}")
+        reserved = self._hot_reserved.pop(path, 0)
+        if reserved:
+            self.manager._release_hot(reserved)
+
+    def measure(self) -> int:
+        self.bytes_used = _dir_size(self.path) + (_dir_size(self.hot_dir) if self.hot_dir != self.path else 0)
+        return self.bytes_used
+
+    def release(self) -> None:
+        self.manager.release(self)
+
+    def _hold_lock(self) -> None:
+        if fcntl is None:
+            return
+        try:
+            self._lock_file = open(self.path / LOCK_NAME, 'w')
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as e:
+            logger.warning(f"Не удалось заблокировать рабочую папку {self.path}: {e}")
+
+    def _drop_lock(self) -> None:
+        if self._lock_file:
+            self._lock_file.close()
+            self._lock_file = None
+
+
+def _in_use(path: Path) -> bool:
+    """Занята ли папка задачей другого процесса"""
+    if fcntl is None:
+        return False
+    try:
+        with open(path / LOCK_NAME, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return True
+    except OSError:
+        pass
+    return False
+
+
+class WorkspaceManager:
+    """Выдаёт каждой задаче отдельную папку, учитывает занятое место и чистит диск.
+
+    Новая задача ждёт (а по таймауту получает отказ), если свободного места меньше
+    резерва на задачу. Фоновый уборщик удаляет брошенные папки, когда заполнение
+    диска выше верхней отметки, пока оно не опустится до нижней.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        ram_dir: Optional[Path] = WORKSPACE_RAM_DIR,
+        ram_budget: int = WORKSPACE_RAM_BUDGET,
+        job_reserve_bytes: int = WORKSPACE_JOB_RESERVE_BYTES,
+        high_watermark: float = WORKSPACE_DISK_HIGH_WATERMARK,
+        low_watermark: float = WORKSPACE_DISK_LOW_WATERMARK,
+    ):
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.ram_dir = Path(ram_dir) if ram_dir else None
+        self.ram_budget = ram_budget if self.ram_dir else 0
+        self.job_reserve_bytes = job_reserve_bytes
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self._lock = threading.Lock()
+        self._active: Dict[str, Workspace] = {}
+        self._ram_used = 0
+        self._janitor: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    # ----- RAM-бюджет -----
+
+    def _reserve_hot(self, size: int) -> bool:
+        with self._lock:
+            if self._ram_used + size > self.ram_budget:
+                return False
+            self._ram_used += size
+            return True
+
+    def _release_hot(self, size: int) -> None:
+        with self._lock:
+            self._ram_used = max(0, self._ram_used - size)
+
+    # ----- выдача и освобождение -----
+
+    def _available_bytes(self) -> int:
+        free = shutil.disk_usage(self.root).free
+        with self._lock:
+            # Резерв активных задач, который они ещё не успели занять
+            pending = sum(max(0, self.job_reserve_bytes - ws.bytes_used) for ws in self._active.values())
+        return free - pending
+
+    async def acquire(self, chat_id: int, job_tag: str, timeout: float = WORKSPACE_ACQUIRE_TIMEOUT, existing: Optional[Path] = None) -> Workspace:
+        """Выдать рабочую папку, дождавшись свободного места на диске.
+
+        `existing` — папка прерванной задачи, которую нужно продолжить (после перезапуска).
+        """
+        if existing and Path(existing).is_dir():
+            existing = Path(existing)
+            ws = Workspace(self, existing.name[len('job_'):], chat_id, existing, None)
+            if self.ram_dir:
+                try:
+                    hot_dir = self.ram_dir / existing.parent.name / existing.name
+                    hot_dir.mkdir(parents=True, exist_ok=True)
+                    ws.hot_dir = hot_dir
+                except OSError as e:
+                    logger.warning(f"RAM-папка недоступна, промежуточные файлы пойдут на диск: {e}")
+            with self._lock:
+                self._active[ws.job_id] = ws
+            ws._hold_lock()
+            logger.info(f"Продолжаем задачу в рабочей папке {existing}")
+            return ws
+        if shutil.disk_usage(self.root).total < self.job_reserve_bytes:
+            raise WorkspaceUnavailable("Диск меньше резерва на одну задачу")
+        deadline = time.monotonic() + timeout
+        waited = False
+        while self._available_bytes() < self.job_reserve_bytes:
+            if time.monotonic() >= deadline:
+                raise WorkspaceUnavailable("Недостаточно места на диске")
+            if not waited:
+                logger.warning(f"Мало места на диске, задача {job_tag} ждёт освобождения")
+                waited = True
+                await io_executor.run(self.sweep)
+            await asyncio.sleep(5)
+
+        safe_tag = re.sub(r'[^\w-]', '_', job_tag)
+        job_id = f"{safe_tag}_{uuid.uuid4().hex[:8]}"
+        path = self.root / str(chat_id) / f"job_{job_id}"
+        hot_dir = self.ram_dir / str(chat_id) / f"job_{job_id}" if self.ram_dir else None
+        ws = Workspace(self, job_id, chat_id, path, hot_dir)
+        # Регистрируем до создания папок, чтобы уборщик не принял их за брошенные
+        with self._lock:
+            self._active[job_id] = ws
+        path.mkdir(parents=True, exist_ok=True)
+        ws._hold_lock()
+        if hot_dir:
+            try:
+                hot_dir.mkdir(parents=True, exist_ok=True)
+            except OSError as e:
+                logger.warning(f"RAM-папка недоступна, промежуточные файлы пойдут на диск: {e}")
+                ws.hot_dir = path
+        return ws
+
+    def detach(self, ws: Workspace) -> None:
+        """Снять папку с учёта, не удаляя файлы (задача будет продолжена после перезапуска)"""
+        with self._lock:
+            self._active.pop(ws.job_id, None)
+            self._ram_used = max(0, self._ram_used - sum(ws._hot_reserved.values()))
+            ws._hot_reserved.clear()
+        ws._drop_lock()
+
+    def release(self, ws: Workspace) -> None:
+        with self._lock:
+            self._active.pop(ws.job_id, None)
+            self._ram_used = max(0, self._ram_used - sum(ws._hot_reserved.values()))
+            ws._hot_reserved.clear()
+        ws._drop_lock()
+        logger.info(f"Задача {ws.job_id} заняла {ws.measure() / (1024 * 1024):.1f} MB")
+        for path in {ws.path, ws.hot_dir}:
+            try:
+                if path.exists():
+                    shutil.rmtree(path)
+            except Exception as e:
+                logger.error(f"Ошибка очистки рабочей папки {path}: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            active = list(self._active.values())
+            ram_used = self._ram_used
+        return {
+            'active_jobs': len(active),
+            'job_bytes': sum(ws.bytes_used for ws in active),
+            'ram_used': ram_used,
+            'disk_free': shutil.disk_usage(self.root).free,
+        }
+
+    # ----- уборщик -----
+
+    def _disk_fill(self) -> float:
+        usage = shutil.disk_usage(self.root)
+        return (usage.total - usage.free) / usage.total if usage.total else 0.0
+
+    def sweep(self) -> None:
+        """Обновить учёт занятого места и, если диск заполнен выше верхней отметки, удалить брошенные папки"""
+        with self._lock:
+            active = list(self._active.values())
+        for ws in active:
+            ws.measure()
+        if self.ram_dir and self.ram_dir.exists():
+            # Брошенные RAM-папки (например, после перезапуска) удаляем всегда
+            active_hot = {ws.hot_dir for ws in active}
+            for path in self.ram_dir.glob('*/job_*'):
+                if path not in active_hot and not _in_use(self.root / path.parent.name / path.name):
+                    shutil.rmtree(path, ignore_errors=True)
+        if self._disk_fill() < self.high_watermark:
+            return
+        active_paths = {ws.path for ws in active}
+        orphans = [p for p in self.root.glob('*/job_*') if p.is_dir() and p not in active_paths and not _in_use(p)]
+        orphans.sort(key=lambda p: p.stat().st_mtime)
+        for path in orphans:
+            if self._disk_fill() <= self.low_watermark:
+                break
+            logger.info(f"Уборщик удаляет брошенную рабочую папку {path}")
+            shutil.rmtree(path, ignore_errors=True)
+
+    def _janitor_loop(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Ошибка уборщика рабочих папок: {e}")
+
+    def start_janitor(self, interval: float = WORKSPACE_JANITOR_INTERVAL) -> None:
+        if self._janitor and self._janitor.is_alive():
+            return
+        self._stop.clear()
+        self._janitor = threading.Thread(target=self._janitor_loop, args=(interval,), name='workspace-janitor', daemon=True)
+        self._janitor.start()
+
+    def stop_janitor(self) -> None:
+        self._stop.set()
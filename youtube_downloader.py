@@ -1,18 +1,127 @@
 import yt_dlp
+import hashlib
+import json
 import os
-import asyncio
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple
 import logging
 
+from config import YTDL_POOL_MAX_IDLE, YTDL_INFO_TTL
+from executors import io_executor
+
 logger = logging.getLogger(__name__)
 
 USER_ASSETS_DIR = Path('user_assets')
 
+
+PoolKey = Tuple[str, Optional[str], str]
+
+
+class YoutubeDLPool:
+    """Пул долгоживущих экземпляров YoutubeDL, сгруппированных по профилю, файлу cookies и настройкам.
+
+    Экземпляр выдаётся в монопольное пользование на время одного вызова. Вызовы с
+    разными настройками (например, другим `playlistend`) получают разные экземпляры;
+    параметры из PER_CALL_OPTS в ключ не входят — вызывающий сам выставляет их в
+    `ydl.params`. Если mtime файла cookies изменился, все экземпляры этого профиля
+    пересоздаются.
+    """
+
+    # Уникальны для каждого вызова (путь скачивания) и переопределяются на экземпляре
+    PER_CALL_OPTS = ('outtmpl',)
+
+    def __init__(self, max_idle_per_key: int = YTDL_POOL_MAX_IDLE):
+        self.max_idle_per_key = max_idle_per_key
+        self._lock = threading.Lock()
+        self._idle: Dict[PoolKey, List[yt_dlp.YoutubeDL]] = {}
+        self._mtimes: Dict[PoolKey, Optional[float]] = {}
+
+    @staticmethod
+    def _cookie_mtime(cookie_path: Optional[str]) -> Optional[float]:
+        if not cookie_path:
+            return None
+        try:
+            return os.path.getmtime(cookie_path)
+        except OSError:
+            return None
+
+    @classmethod
+    def _opts_hash(cls, opts: Dict[str, Any]) -> str:
+        shared = {name: value for name, value in opts.items() if name not in cls.PER_CALL_OPTS}
+        payload = json.dumps(shared, sort_keys=True, default=str)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+    @staticmethod
+    def _discard(ydl: yt_dlp.YoutubeDL) -> None:
+        # Не даём close() перезаписать cookies-файл устаревшим содержимым
+        ydl.params.pop('cookiefile', None)
+        try:
+            ydl.close()
+        except Exception as e:
+            logger.debug(f"Ошибка закрытия YoutubeDL: {e}")
+
+    @contextmanager
+    def acquire(self, profile: str, opts: Dict[str, Any]):
+        """Выдать экземпляр YoutubeDL для профиля `profile` с настройками `opts`."""
+        cookie_path = opts.get('cookiefile')
+        key = (profile, cookie_path, self._opts_hash(opts))
+        mtime = self._cookie_mtime(cookie_path)
+        ydl = None
+        stale: List[yt_dlp.YoutubeDL] = []
+        with self._lock:
+            if key in self._mtimes and self._mtimes[key] != mtime:
+                stale = self._idle.pop(key, [])
+                logger.info(f"Cookies изменились, сбрасываем пул YoutubeDL для {cookie_path}")
+            self._mtimes[key] = mtime
+            idle = self._idle.get(key)
+            if idle:
+                ydl = idle.pop()
+        for old in stale:
+            self._discard(old)
+        if ydl is None:
+            ydl = yt_dlp.YoutubeDL(dict(opts))
+        try:
+            yield ydl
+        finally:
+            with self._lock:
+                idle = self._idle.setdefault(key, [])
+                keep = self._mtimes.get(key) == mtime and len(idle) < self.max_idle_per_key
+                if keep:
+                    idle.append(ydl)
+            if not keep:
+                self._discard(ydl)
+
+    def clear(self) -> None:
+        with self._lock:
+            pools = list(self._idle.values())
+            self._idle.clear()
+            self._mtimes.clear()
+        for idle in pools:
+            for ydl in idle:
+                self._discard(ydl)
+
+
+# Сколько метаданных видео держать в памяти
+INFO_CACHE_SIZE = 128
+
+
+def info_is_fresh(info: Optional[Dict[str, Any]], ttl: float = YTDL_INFO_TTL) -> bool:
+    """Метаданные получены не раньше `ttl` секунд назад (yt-dlp пишет время извлечения в 'epoch')"""
+    return bool(info) and time.time() - float(info.get('epoch') or 0) < ttl
+
+
 class YouTubeDownloader:
-    def __init__(self, download_dir: Path, cookies_file: Optional[Path] = None):
+    def __init__(self, download_dir: Path, cookies_file: Optional[Path] = None, pool: Optional[YoutubeDLPool] = None):
         self.download_dir = download_dir
         self.cookies_file = cookies_file
+        self.pool = pool or YoutubeDLPool()
+        # Свежие метаданные по (ссылка, cookies): прогноз задачи, прямой поток и скачивание
+        # одного видео обходятся одним извлечением
+        self._infos: 'OrderedDict[Tuple[str, Optional[str]], Dict[str, Any]]' = OrderedDict()
         
     def _resolve_cookies_path(self, chat_id: Optional[int]) -> Optional[Path]:
         try:
@@ -38,6 +147,7 @@ class YouTubeDownloader:
             'writeinfojson': False,
             'writethumbnail': False,
             'merge_output_format': 'mp4',
+            'noplaylist': True,
         }
         
         # Добавляем cookies если файл существует
@@ -48,24 +158,34 @@ class YouTubeDownloader:
         return opts
     
     async def get_video_info(self, url: str, chat_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
-        """Получить информацию о видео без скачивания"""
+        """Получить информацию о видео без скачивания (повторный запрос в пределах YTDL_INFO_TTL — из памяти)"""
         try:
             opts = {
                 'quiet': True,
                 'no_warnings': True,
+                'noplaylist': True,
             }
             
             cookie_path = self._resolve_cookies_path(chat_id)
             if cookie_path and Path(cookie_path).exists():
                 opts['cookiefile'] = str(cookie_path)
+
+            cache_key = (url, opts.get('cookiefile'))
+            cached = self._infos.get(cache_key)
+            if info_is_fresh(cached):
+                return cached
             
             def extract_info():
-                with yt_dlp.YoutubeDL(opts) as ydl:
+                with self.pool.acquire('info', opts) as ydl:
                     return ydl.extract_info(url, download=False)
             
             # Запускаем в отдельном потоке чтобы не блокировать event loop
-            loop = asyncio.get_event_loop()
-            info = await loop.run_in_executor(None, extract_info)
+            info = await io_executor.run(extract_info)
+            if info:
+                self._infos.pop(cache_key, None)
+                self._infos[cache_key] = info
+                while len(self._infos) > INFO_CACHE_SIZE:
+                    self._infos.popitem(last=False)
             
             return info
             
@@ -73,15 +193,124 @@ class YouTubeDownloader:
             logger.error(f"Ошибка получения информации о видео: {e}")
             return None
     
-    async def download_video(self, url: str, chat_id: int) -> Optional[str]:
-        """Скачать видео и вернуть путь к файлу"""
+    @staticmethod
+    def _ffmpeg_input_options(ydl: yt_dlp.YoutubeDL, fmt: Dict[str, Any], info: Dict[str, Any]) -> Dict[str, Any]:
+        """Заголовки и cookies для чтения формата напрямую через ffmpeg (как в FFmpegFD yt-dlp)"""
+        options: Dict[str, Any] = {
+            'reconnect': 1,
+            'reconnect_streamed': 1,
+            'reconnect_delay_max': 5,
+        }
+        cookies = ydl.cookiejar.get_cookies_for_url(fmt['url'])
+        if cookies:
+            options['cookies'] = ''.join(
+                f'{cookie.name}={cookie.value}; path={cookie.path}; domain={cookie.domain};\r\n'
+                for cookie in cookies)
+        http_headers = fmt.get('http_headers') or info.get('http_headers')
+        if http_headers:
+            options['headers'] = ''.join(f'{key}: {val}\r\n' for key, val in http_headers.items())
+        return options
+
+    async def resolve_stream(self, url: str, chat_id: Optional[int] = None, info: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """Получить прямые ссылки на медиа для чтения через ffmpeg без скачивания файла.
+
+        Возвращает None, если формат нельзя читать напрямую по HTTP (например, HLS/DASH-манифест).
+        Свежий `info` (переданный или запомненный get_video_info) используется вместо
+        повторного извлечения: из него заново выбираются форматы.
+        """
+        try:
+            opts = {
+                'quiet': True,
+                'no_warnings': True,
+                'noplaylist': True,
+                'format': 'bestvideo[height<=1080]+bestaudio/best[height<=1080]',
+            }
+            
+            cookie_path = self._resolve_cookies_path(chat_id)
+            if cookie_path and Path(cookie_path).exists():
+                opts['cookiefile'] = str(cookie_path)
+            
+            info = info or self._infos.get((url, opts.get('cookiefile')))
+            fresh_info = info if info_is_fresh(info) else None
+
+            def extract_stream():
+                with self.pool.acquire('stream', opts) as ydl:
+                    if fresh_info:
+                        info = ydl.process_ie_result(dict(fresh_info), download=False)
+                    else:
+                        info = ydl.extract_info(url, download=False)
+                    if not info:
+                        return None
+                    formats = info.get('requested_formats') or [info]
+                    if any(fmt.get('protocol') not in ('http', 'https') for fmt in formats):
+                        return None
+                    video_fmt = formats[0]
+                    audio_fmt = formats[1] if len(formats) > 1 else None
+                    return {
+                        'id': info.get('id'),
+                        'title': info.get('title', 'video'),
+                        'duration': float(info.get('duration') or 0),
+                        'width': int(video_fmt.get('width') or info.get('width') or 1920),
+                        'height': int(video_fmt.get('height') or info.get('height') or 1080),
+                        'video_url': video_fmt['url'],
+                        'video_input_options': self._ffmpeg_input_options(ydl, video_fmt, info),
+                        'audio_url': audio_fmt['url'] if audio_fmt else None,
+                        'audio_input_options': self._ffmpeg_input_options(ydl, audio_fmt, info) if audio_fmt else None,
+                    }
+            
+            return await io_executor.run(extract_stream)
+            
+        except Exception as e:
+            logger.error(f"Ошибка получения прямых ссылок на видео: {e}")
+            return None
+    
+    async def expand_playlist(self, url: str, chat_id: Optional[int] = None, limit: Optional[int] = None) -> List[str]:
+        """Получить список ссылок на видео плейлиста (без скачивания)"""
+        try:
+            opts = {
+                'quiet': True,
+                'no_warnings': True,
+                'extract_flat': 'in_playlist',
+            }
+            if limit:
+                opts['playlistend'] = limit
+            
+            cookie_path = self._resolve_cookies_path(chat_id)
+            if cookie_path and Path(cookie_path).exists():
+                opts['cookiefile'] = str(cookie_path)
+            
+            def extract_entries():
+                with self.pool.acquire('playlist', opts) as ydl:
+                    return ydl.extract_info(url, download=False)
+            
+            info = await io_executor.run(extract_entries)
+            if not info:
+                return []
+            
+            urls = []
+            for entry in info.get('entries') or []:
+                if not entry:
+                    continue
+                video_url = entry.get('url') or entry.get('webpage_url')
+                if not video_url and entry.get('id'):
+                    video_url = f"https://www.youtube.com/watch?v={entry['id']}"
+                if video_url:
+                    urls.append(video_url)
+            return urls[:limit] if limit else urls
+            
+        except Exception as e:
+            logger.error(f"Ошибка получения списка видео плейлиста: {e}")
+            return []
+    
+    async def download_video(self, url: str, chat_id: int, info: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """Скачать видео и вернуть путь к файлу (`info` — уже полученный get_video_info; используется, пока не старше YTDL_INFO_TTL)"""
         try:
             # Создаем уникальную папку для каждого чата
             chat_dir = self.download_dir / str(chat_id)
             chat_dir.mkdir(parents=True, exist_ok=True)
             
             # Получаем информацию о видео
-            info = await self.get_video_info(url, chat_id)
+            info = info or await self.get_video_info(url, chat_id)
             if not info:
                 return None
             
@@ -96,13 +325,21 @@ class YouTubeDownloader:
             # Настройки для скачивания
             ydl_opts = self.get_ydl_opts(output_path, chat_id)
             
+            fresh_info = info if info_is_fresh(info) else None
+
             def download():
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    ydl.download([url])
+                with self.pool.acquire('download', ydl_opts) as ydl:
+                    # outtmpl уникален для каждого вызова, экземпляр принадлежит нам монопольно
+                    ydl.params['outtmpl']['default'] = output_path
+                    if fresh_info:
+                        # Используем уже извлечённую информацию, чтобы не запрашивать страницу повторно
+                        ydl.process_ie_result(dict(fresh_info), download=True)
+                    else:
+                        # Задача долго ждала в очереди: подписанные ссылки на форматы могли истечь
+                        ydl.extract_info(url, download=True)
             
             # Запускаем скачивание в отдельном потоке
-            loop = asyncio.get_event_loop()
-            await loop.run_in_executor(None, download)
+            await io_executor.run(download)
             
             # Ищем скачанный файл
             for file_path in chat_dir.glob(f"{safe_title}.*"):